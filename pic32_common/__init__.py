@@ -0,0 +1,6 @@
+'''
+Code shared by the pic32_icsp and pic32_jtag decoders
+
+Not a decoder by itself, but needs to be copied (or symlinked) into the
+decoders directory together with them.
+'''
@@ -0,0 +1,119 @@
+'''
+Status poll compression - with the "polls" option set to "collapse"
+
+While flash is erased or written, programmers poll: MTAP_COMMAND with
+MCHP_STATUS over and over until the flash controller is done, or
+ETAP_CONTROL until PrAcc is set. Every poll is a full set of JTAG state,
+TMS/TDI/TDO and Command/Data annotations.
+
+The decoder's put() is wrapped on the instance (like the profiler does), and
+watches the transaction records go by. A poll (a record in the decoder's poll
+table) opens a run. Everything put after it is held back, and dropped if the
+next transaction is the same poll again (same command/data, the TDO may
+differ). Anything else ends the run: one annotation over all of it, "polled
+N times", with the time taken and the last TDO (the final status), and one
+['POLL', count, record] record, with the last poll's record. Then the held
+back puts go out, as they were. A run of one poll is put out as it was.
+
+The first poll's JTAG states & bits are shown as usual, only its Command/Data
+annotation and record are replaced.
+'''
+
+from pic32_common.records import *
+
+TDO_AT = {REC_COMMAND_DR: 2, REC_DATA: 3}	# Where the TDO is in a record, the rest has to match
+
+
+def pollIdentity(record):
+	# The record without the TDO
+	at = TDO_AT[record[0]]
+	return tuple(record[:at]) + tuple(record[at+1:])
+
+
+class PollCollapser:
+
+	def __init__(self, decoder, polls):
+		# polls: {(record type, command or register): (annotation id, name)}, from the decoder
+		self.decoder = decoder
+		self.polls = polls
+		self.identity = None	# Of the polls in the open run, None when there's none
+		self.held = []			# Puts since the last poll of the run
+		self.firstTail = []		# The first poll's record & annotation, if it stays on its own
+		self.dropAt = None		# End sample of the last poll, its annotation is dropped too
+		self.count = 0
+		self.start = 0
+		self.end = 0
+		self.last = None		# Last poll's record
+		self.wrapPut()
+		self.wrapWait()
+
+	def wrapPut(self):
+		function = self.originalPut = self.decoder.put
+		decoder = self.decoder
+		def put(startsample, endsample, output, data):
+			if (output == decoder.out_python):
+				self.onRecord(startsample, endsample, data)
+			elif (self.identity is None):
+				function(startsample, endsample, output, data)
+			elif (endsample == self.dropAt):
+				if (self.count == 1):
+					self.firstTail.append((startsample, endsample, output, data))
+			else:
+				self.held.append((startsample, endsample, output, data))
+		self.decoder.put = put
+
+	def wrapWait(self):
+		function = self.decoder.wait
+		def wait(*args):
+			try:
+				return function(*args)
+			except EOFError:
+				self.flush()
+				raise
+		self.decoder.wait = wait
+
+	def onRecord(self, startsample, endsample, record):
+		poll = None
+		if (record[0] in TDO_AT and (record[0], record[1]) in self.polls):
+			poll = pollIdentity(record)
+		if (poll is not None and poll == self.identity):
+			self.held = []		# The clocks in between are part of the run
+			self.count += 1
+		else:
+			self.flush()
+			if (poll is None):
+				self.originalPut(startsample, endsample, self.decoder.out_python, record)
+				return
+			self.identity = poll
+			self.start = startsample
+			self.count = 1
+			self.firstTail = [(startsample, endsample, self.decoder.out_python, record)]
+		self.end = endsample
+		self.last = record
+		self.dropAt = endsample
+
+	def flush(self):
+		# Ends the open run, if there is one. Also at the end of the data.
+		if (self.identity is None):
+			return
+		put = self.originalPut
+		decoder = self.decoder
+		if (self.count == 1):
+			for x in self.firstTail:
+				put(*x)
+		else:
+			record = self.last
+			annotation, name = self.polls[(record[0], record[1])]
+			text = name + ' polled ' + str(self.count) + 'x'
+			samplerate = getattr(decoder, 'samplerate', 0)
+			if (samplerate):
+				text += ', %.3f ms' % ((self.end - self.start) * 1000.0 / samplerate)
+			text += ', last TDO ' + hex(record[TDO_AT[record[0]]])
+			put(self.start, self.end, decoder.out_ann, [annotation, [text]])
+			put(self.start, self.end, decoder.out_python, [REC_POLL, self.count, record])
+		for x in self.held:
+			put(*x)
+		self.identity = None
+		self.held = []
+		self.firstTail = []
+		self.dropAt = None
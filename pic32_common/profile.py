@@ -0,0 +1,100 @@
+'''
+Profiling for the decoders - opt-in, with the "profile" option
+
+The decoder's hot methods (wait, put, the per-clock ones) are wrapped on the
+instance, so nothing changes when the option is off. Counts are exact; the
+time is measured on every SAMPLE_EVERY-th call only, and scaled up. Time of a
+phase includes what it calls (a put() from onJtagBit counts for both).
+
+At the end of the data (EOFError out of wait(), or report() called by whoever
+feeds the decoder), everything is put() on OUTPUT_META outputs, one per value.
+'''
+
+import time
+
+import sigrokdecode as srd
+
+from pic32_common.tap import JSLookup, STATE_ANNOTATION
+
+SAMPLE_EVERY = 16
+
+STATE_IDS = set(x[0] for x in STATE_ANNOTATION)	# JTAG state annotations, not "formatted"
+
+
+class Profiler:
+
+	def __init__(self, decoder, phases, clockPhase):
+		# phases: decoder method names to count & time. clockPhase: the one called once per TAP clock.
+		self.decoder = decoder
+		self.phases = list(phases) + ['put']
+		self.calls = dict((x, 0) for x in self.phases)
+		self.sampled = dict((x, 0.0) for x in self.phases)
+		self.clocks = [0] * 16		# By JTAG state
+		self.annotations = 0		# Formatted annotations put (everything but the state ones)
+		self.reported = False
+		for phase in phases:
+			self.wrap(phase, phase == clockPhase)
+		self.wrapPut()
+
+		self.outputs = {}
+		for name, kind, desc in self.values():
+			self.outputs[name] = decoder.register(srd.OUTPUT_META, meta=(kind, name, desc))
+
+	def wrap(self, phase, perClock):
+		function = getattr(self.decoder, phase)
+		decoder = self.decoder
+		def wrapper(*args):
+			count = self.calls[phase] = self.calls[phase] + 1
+			if (perClock):
+				self.clocks[decoder.stateJTAG] += 1
+			try:
+				if (count % SAMPLE_EVERY):
+					return function(*args)
+				start = time.perf_counter()
+				result = function(*args)
+				self.sampled[phase] += time.perf_counter() - start
+				return result
+			except EOFError:
+				self.report()
+				raise
+		setattr(self.decoder, phase, wrapper)
+
+	def wrapPut(self):
+		function = self.originalPut = self.decoder.put
+		decoder = self.decoder
+		def put(startsample, endsample, output, data):
+			count = self.calls['put'] = self.calls['put'] + 1
+			if (output == decoder.out_ann and data[0] not in STATE_IDS):
+				self.annotations += 1
+			if (count % SAMPLE_EVERY):
+				return function(startsample, endsample, output, data)
+			start = time.perf_counter()
+			function(startsample, endsample, output, data)
+			self.sampled['put'] += time.perf_counter() - start
+		self.decoder.put = put
+
+	def values(self):
+		# (name, type, description) of everything reported
+		result = []
+		for state in range(16):
+			result.append(('clocks-' + JSLookup[state], int, 'TAP clocks in ' + JSLookup[state]))
+		for phase in self.phases:
+			result.append((phase + '-calls', int, 'Calls to ' + phase + '()'))
+			result.append((phase + '-seconds', float, 'Time in ' + phase + '(), estimated'))
+		result.append(('formatted-annotations', int, 'Annotations put, other than JTAG states'))
+		return result
+
+	def report(self):
+		if (self.reported):
+			return
+		self.reported = True
+		decoder = self.decoder
+		put = self.originalPut	# Not counted
+		values = {'formatted-annotations': self.annotations}
+		for state in range(16):
+			values['clocks-' + JSLookup[state]] = self.clocks[state]
+		for phase in self.phases:
+			values[phase + '-calls'] = self.calls[phase]
+			values[phase + '-seconds'] = self.sampled[phase] * SAMPLE_EVERY
+		for name, kind, desc in self.values():
+			put(0, decoder.samplenum, self.outputs[name], values[name])
@@ -0,0 +1,31 @@
+'''
+Transaction records, put() by both decoders on their OUTPUT_PYTHON output
+
+So stacked decoders (and pic32_tools) get the values, not the annotation strings.
+Every record is a list, starting with its type:
+
+['RESET', how]							TAPs reset. how is 'MCLR' (ICSP only, MCLR asserted while
+										in ICSP) or 'TMS' (Test-Logic-Reset entered)
+['ENTER']								ICSP entry key accepted (ICSP only)
+['ENTER_FAILED', key, clocks]			MCLR released after clocks that weren't the entry key (ICSP only).
+										key is the last 32 bits clocked in, clocks how many (up to 100)
+['IR', tap, instruction]				5-bit instruction, tap is the TAP it went to ('MTAP'/'ETAP')
+['COMMAND_DR', command, tdo]			MTAP_COMMAND data register (MCHP_STATUS, ...)
+['DATA', register, tdi, tdo, bits]		Plain data register transfer, register = selected instruction
+['FASTDATA', tdi, tdo, praccPIC, praccProbe]	ETAP_FASTDATA transfer, data without the PrAcc bit
+['POLL', count, record]					count identical polls in a row (MCHP_STATUS, ETAP_CONTROL), only
+										with polls=collapse. record is the last one, with the final status
+
+All values are ints, except for POLL's record. Start/end samples are the same as for the matching annotation.
+'''
+
+REC_RESET = 'RESET'
+REC_ENTER = 'ENTER'
+REC_ENTER_FAILED = 'ENTER_FAILED'
+REC_IR = 'IR'
+REC_COMMAND_DR = 'COMMAND_DR'
+REC_DATA = 'DATA'
+REC_FASTDATA = 'FASTDATA'
+REC_POLL = 'POLL'
+
+TAP_NAMES = ('MTAP', 'ETAP')	# By MTAP, ETAP in the decoders
@@ -0,0 +1,57 @@
+'''
+Shift-DR/IR accumulator, for shifts of any length
+
+A value is shifted in LSB first, one bit per clock. Or-ing every bit into one
+growing int makes a long shift (BYPASS chains, boundary scan, a probe parked in
+Shift-DR) quadratic, since each bit copies the whole int. So the decoders only
+or the bits into a word of WORD_BITS, and put full words into a list, as
+(tdi, tdo, tms). The ints are joined back together at Update-DR/IR - the usual
+5/8/32/33 bit shifts never fill a word, and never get here.
+
+shiftRun() takes a run of bits at once, for the batch engine's frame templates.
+'''
+
+WORD_BITS = 64
+WORD_MASK = WORD_BITS - 1	# Bit in the current word = clockCycles & WORD_MASK
+WORD_BYTES = WORD_BITS // 8
+
+
+def joinWords(words, last):
+	# Full words (LSB first), then last on top. Linear in the length.
+	data = b''.join(x.to_bytes(WORD_BYTES, 'little') for x in words)
+	return int.from_bytes(data, 'little') | (last << (len(words) * WORD_BITS))
+
+
+def joinShift(words, tdi, tdo, tms, withTms=True):
+	'''words: [(tdi, tdo, tms)] full words, tdi/tdo/tms: the current one. Returns the whole (tdi, tdo, tms).
+	TMS is only shown, not decoded - with withTms off, it's not joined (the current word is returned).'''
+	tdi = joinWords([x[0] for x in words], tdi)
+	tdo = joinWords([x[1] for x in words], tdo)
+	if (withTms):
+		tms = joinWords([x[2] for x in words], tms)
+	return tdi, tdo, tms
+
+
+def splitWords(value, count):
+	# The first count words of value, LSB first
+	data = value.to_bytes((count + 1) * WORD_BYTES, 'little')
+	return [int.from_bytes(data[x*WORD_BYTES:(x+1)*WORD_BYTES], 'little') for x in range(count)]
+
+
+def shiftRun(decoder, tdi, tdo, tms, count):
+	'''count clocks in Shift-DR/IR at once, the same as count bits one by one. tdi/tdo/tms: the bits, LSB first.
+	Uses the decoder's valueTDI/valueTDO/valueTMS, clockCycles & shiftWords.'''
+	bit = decoder.clockCycles & WORD_MASK
+	tdi = decoder.valueTDI | (tdi << bit)
+	tdo = decoder.valueTDO | (tdo << bit)
+	tms = decoder.valueTMS | (tms << bit)
+	decoder.clockCycles = decoder.clockCycles + count
+	full = (bit + count) // WORD_BITS
+	if (full):
+		decoder.shiftWords.extend(zip(splitWords(tdi, full), splitWords(tdo, full), splitWords(tms, full)))
+		tdi = tdi >> (full * WORD_BITS)
+		tdo = tdo >> (full * WORD_BITS)
+		tms = tms >> (full * WORD_BITS)
+	decoder.valueTDI = tdi
+	decoder.valueTDO = tdo
+	decoder.valueTMS = tms
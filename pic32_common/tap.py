@@ -0,0 +1,41 @@
+'''
+JTAG TAP state machine, as tables
+
+Both decoders step through the 16 TAP states once per clock. Instead of an if/elif
+chain per state, everything for a state is looked up by its number:
+next state (by TMS), the annotation to print, and which start sample it uses.
+'''
+
+# JTAG related stuff & states. Gotta do it properly, because J-Link
+# JS == JtagState
+JS_TestLogicReset, JS_RunTestIdle, JS_SelectDRScan, JS_CaptureDR, JS_ShiftDR, JS_Exit1DR, JS_PauseDR, JS_Exit2DR, JS_UpdateDR, JS_SelectIRScan, JS_CaptureIR, JS_ShiftIR, JS_Exit1IR, JS_PauseIR, JS_Exit2IR, JS_UpdateIR = range(16)
+JSLookup = {JS_TestLogicReset:'TestLogicReset', JS_RunTestIdle:'RunTestIdle', JS_SelectDRScan: 'SelectDRScan', JS_CaptureDR:'CaptureDR', JS_ShiftDR:'ShiftDR', JS_Exit1DR:'Exit1DR', JS_PauseDR:'PauseDR', JS_Exit2DR:'Exit2DR', JS_UpdateDR:'UpdateDR', JS_SelectIRScan:'SelectIRScan', JS_CaptureIR:'CaptureIR', JS_ShiftIR:'ShiftIR', JS_Exit1IR:'Exit1IR', JS_PauseIR:'PauseIR', JS_Exit2IR:'Exit2IR', JS_UpdateIR:'UpdateIR'}
+
+# Start sample slots - states that are annotated from the same start sample. See startSamples in the decoders.
+SLOT_TLR, SLOT_RTI, SLOT_SCAN, SLOT_CAPTURE, SLOT_SHIFT, SLOT_EXIT, SLOT_PAUSE, SLOT_UPDATE = range(8)
+NUM_SLOTS = 8
+
+# state: (next state on TMS=0, next state on TMS=1, annotation, start sample slot)
+STATES = {
+	JS_TestLogicReset:	(JS_RunTestIdle, JS_TestLogicReset,	[14, ['Test-Logic-Reset']],	SLOT_TLR),
+	JS_RunTestIdle:		(JS_RunTestIdle, JS_SelectDRScan,	[15, ['Run-Test-Idle']],	SLOT_RTI),
+	JS_SelectDRScan:	(JS_CaptureDR, JS_SelectIRScan,		[16, ['Select-DR-Scan']],	SLOT_SCAN),
+	JS_CaptureDR:		(JS_ShiftDR, JS_Exit1DR,			[16, ['Capture-DR']],		SLOT_CAPTURE),
+	JS_ShiftDR:			(JS_ShiftDR, JS_Exit1DR,			[16, ['Shift-DR']],			SLOT_SHIFT),
+	JS_Exit1DR:			(JS_PauseDR, JS_UpdateDR,			[16, ['Exit1-DR']],			SLOT_EXIT),
+	JS_PauseDR:			(JS_PauseDR, JS_Exit2DR,			[16, ['Pause-DR']],			SLOT_PAUSE),
+	JS_Exit2DR:			(JS_ShiftDR, JS_UpdateDR,			[16, ['Exit2-DR']],			SLOT_EXIT),
+	JS_UpdateDR:		(JS_RunTestIdle, JS_SelectDRScan,	[16, ['Update-DR']],		SLOT_UPDATE),
+	JS_SelectIRScan:	(JS_CaptureIR, JS_TestLogicReset,	[17, ['Select-IR-Scan']],	SLOT_SCAN),
+	JS_CaptureIR:		(JS_ShiftIR, JS_Exit1IR,			[17, ['Capture-IR']],		SLOT_CAPTURE),
+	JS_ShiftIR:			(JS_ShiftIR, JS_Exit1IR,			[17, ['Shift-IR']],			SLOT_SHIFT),
+	JS_Exit1IR:			(JS_PauseIR, JS_UpdateIR,			[17, ['Exit1-IR']],			SLOT_EXIT),
+	JS_PauseIR:			(JS_PauseIR, JS_Exit2IR,			[17, ['Pause-IR']],			SLOT_PAUSE),
+	JS_Exit2IR:			(JS_ShiftIR, JS_UpdateIR,			[17, ['Exit2-IR']],			SLOT_EXIT),
+	JS_UpdateIR:		(JS_RunTestIdle, JS_SelectDRScan,	[17, ['Update-IR']],		SLOT_UPDATE),
+}
+
+# Flat tables, built from the above. Indexed by state, or by (state << 1) | TMS.
+NEXT_STATE = tuple(STATES[state >> 1][state & 1] for state in range(32))
+STATE_ANNOTATION = tuple(STATES[state][2] for state in range(16))
+STATE_SLOT = tuple(STATES[state][3] for state in range(16))
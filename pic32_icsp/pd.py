@@ -1,5 +1,5 @@
 '''
-Microchip ICSP decoder, with 4-phase supprt (2-phase is not supported)
+Microchip ICSP decoder, 4-phase, or 2-phase with the "phases" option
 Everything is CLOCK driven
 -> First there needs to be a Reset, to get into a known state
 -> Then there should be an entry pattern
@@ -11,6 +11,12 @@ Update - now properly moves through all JTAG states (it's just JTAG over ICSP)
 import sigrokdecode as srd
 import time
 
+from pic32_common.tap import *
+from pic32_common.records import *
+from pic32_common.shift import WORD_MASK, joinShift, shiftRun
+from pic32_common.profile import Profiler
+from pic32_common.polls import PollCollapser
+
 PIN_RESET, PIN_CLOCK, PIN_DATA = range(3)	# Pins, same as channels = (...)
 MTAP, ETAP = range(2)	# TAPs in the microcontroller
 
@@ -39,18 +45,23 @@ INSTRUCTIONS = {MTAP_COMMAND:'MTAP_COMMAND', MTAP_SW_MTAP:'MTAP_SW_MTAP', MTAP_S
 
 MTAP_COMMAND_DR = {MTAP_DR_MCHP_STATUS:'MTAP_DR_MCHP_STATUS', MTAP_DR_MCHP_ASSERT_RST:'MTAP_DR_MCHP_ASSERT_RST', MTAP_DR_MCHP_DE_ASSERT_RST:'MTAP_DR_MCHP_DE_ASSERT_RST', MTAP_DR_MCHP_ERASE:'MTAP_DR_MCHP_ERASE', MTAP_DR_MCHP_FLASH_ENABLE:'MTAP_DR_MCHP_FLASH_ENABLE', MTAP_DR_MCHP_FLASH_DISABLE:'MTAP_DR_MCHP_FLASH_DISABLE'}
 
-# JTAG related stuff & states. Gotta do it properly, because J-Link
-# JS == JtagState
-JS_TestLogicReset, JS_RunTestIdle, JS_SelectDRScan, JS_CaptureDR, JS_ShiftDR, JS_Exit1DR, JS_PauseDR, JS_Exit2DR, JS_UpdateDR, JS_SelectIRScan, JS_CaptureIR, JS_ShiftIR, JS_Exit1IR, JS_PauseIR, JS_Exit2IR, JS_UpdateIR = range(16)
-JSLookup = {JS_TestLogicReset:'TestLogicReset', JS_RunTestIdle:'RunTestIdle', JS_SelectDRScan: 'SelectDRScan', JS_CaptureDR:'CaptureDR', JS_ShiftDR:'ShiftDR', JS_Exit1DR:'Exit1DR', JS_PauseDR:'PauseDR', JS_Exit2DR:'Exit2DR', JS_UpdateDR:'UpdateDR', JS_SelectIRScan:'SelectIRScan', JS_CaptureIR:'CaptureIR', JS_ShiftIR:'ShiftIR', JS_Exit1IR:'Exit1IR', JS_PauseIR:'PauseIR', JS_Exit2IR:'Exit2IR', JS_UpdateIR:'UpdateIR'}
-
+# Annotation payloads that never change, built once here instead of on every Update-IR/DR. Shared, don't modify.
+# Both TAPs take all instructions (MTAP_SW_MTAP/MTAP_SW_ETAP switch either way), only the row & prefix differ.
+IR_ANNOTATIONS = (
+	dict((x, [2, ['MTAP COMMAND: ' + INSTRUCTIONS[x]]]) for x in INSTRUCTIONS),	# MTAP
+	dict((x, [3, ['ETAP COMMAND: ' + INSTRUCTIONS[x]]]) for x in INSTRUCTIONS),	# ETAP
+)
+COMMAND_DR_ANNOTATIONS = dict((x, [4, ['COMMAND_DR: ' + MTAP_COMMAND_DR[x]]]) for x in MTAP_COMMAND_DR)
+RESET_TMS = [REC_RESET, 'TMS']
 
+# Status polls, for polls=collapse (pic32_common.polls): (record type, command/register) -> annotation, name
+POLLS = {(REC_COMMAND_DR, MTAP_DR_MCHP_STATUS): (4, 'COMMAND_DR: MTAP_DR_MCHP_STATUS'), (REC_DATA, ETAP_CONTROL): (5, 'ETAP_CONTROL')}
 
 class Decoder(srd.Decoder):
 	api_version = 3
 	id = 'pic32_icsp'
 	name = 'PIC32-ICSP'
-	longname = 'Microchip PIC32 ICSP (4-phase)'
+	longname = 'Microchip PIC32 ICSP (4/2-phase)'
 	desc = 'PIC32 programming protocol-'
 	license = 'gplv2+'
 	inputs = ['logic']
@@ -94,22 +105,40 @@ class Decoder(srd.Decoder):
 		('tdo', 'TDO', (11, )),
 		('unknown', 'WTF', (7, )),
 	)
+	options = (
+		{'id': 'coalesce', 'desc': 'Merge repeated JTAG states into one annotation', 'default': 'no', 'values': ('no', 'yes')},
+		{'id': 'profile', 'desc': 'Count & time clocks, waits and puts (slower)', 'default': 'no', 'values': ('no', 'yes')},
+		{'id': 'verbosity', 'desc': 'Rows to decode', 'default': 'full', 'values': ('full', 'transactions+bits', 'transactions')},
+		{'id': 'polls', 'desc': 'Repeated MCHP_STATUS/ETAP_CONTROL polls', 'default': 'show', 'values': ('show', 'collapse')},
+		{'id': 'phases', 'desc': 'PGEC clocks per JTAG bit (2-phase: TDI, TMS, no TDO)', 'default': '4', 'values': ('4', '2')},
+	)
+	# Everything the decoder keeps between clocks, for checkpoints (pic32_tools/checkpoint.py)
+	checkpointState = ('stateJTAG', 'statePrevJTAG', 'selectedTAP', 'selectedRegister', 'clockCycles',
+		'valueTDI', 'valueTDO', 'valueTMS', 'shiftWords', 'startSamples', 'startSampleShiftData',
+		'enteredICSP', 'valueInReset', 'startSample')
 
 
 	def __init__(self):
 		# Vars used 
+		self.samplerate = 0
 		self.clockCycles = 0
 		self.valueTDI = 0
 		self.valueTDO = 0
 		self.valueTMS = 0
+		self.enteredICSP = 0
 
 
 	# Apparently now required?	
 	def reset(self):
 		self.onResetAsserted()
+
+	def metadata(self, key, value):
+		if (key == srd.SRD_CONF_SAMPLERATE):
+			self.samplerate = value	# Only for the poll times
 	
 	def start(self):
 		self.out_ann = self.register(srd.OUTPUT_ANN)
+		self.out_python = self.register(srd.OUTPUT_PYTHON)	# Transaction records, see pic32_common.records
 		self.stateJTAG = 0		# Assume TestLogicReset
 		self.statePrevJTAG = 0
 		self.selectedTAP = 0	# Assum MTAP
@@ -117,26 +146,40 @@ class Decoder(srd.Decoder):
 		self.valueTDI = 0
 		self.valueTDO = 0
 		self.valueTMS = 0
+		self.shiftWords = []	# Full words of a long shift, see pic32_common.shift
 		self.selectedRegister = 0;
 		
-		self.startSampleTLR = 0
-		self.startSampleRTI = 0
-		self.startSampleScan = 0
-		self.startSampleCapture = 0
-		self.startSampleShift = 0
+		self.startSamples = [0] * NUM_SLOTS	# Where the current state's annotation starts, by SLOT_*
 		self.startSampleShiftData = 0
-		self.startSampleExitOne = 0
-		self.startSamplePause = 0
-		self.startSampleExitTwo = 0
-		self.startSampleUpdate = 0
+		# Coalesce: a state that loops on itself (Run-Test-Idle, Shift-DR...) is printed once, when it's left
+		self.coalesceStates = (self.options['coalesce'] == 'yes')
+		# Verbosity: rows that are not shown are not built at all. Command & Data rows are always there.
+		self.showStates = (self.options['verbosity'] == 'full')				# JTAG state row
+		self.showBits = (self.options['verbosity'] != 'transactions')		# TMS/TDI/TDO rows
+		# Profile: counters & timing, put on OUTPUT_META at the end of data
+		self.profiler = None
+		if (self.options['profile'] == 'yes'):
+			self.profiler = Profiler(self, ('wait', 'onClockInReset', 'onJtagBit'), 'onJtagBit')
+		# Polls: a run of the same status poll is put as one annotation, see pic32_common.polls
+		self.polls = None
+		if (self.options['polls'] == 'collapse'):
+			self.polls = PollCollapser(self, POLLS)
 
 		self.valueInReset = 0
 	
 		self.enteredICSP = 0
+		# 2-phase: TDI and TMS only, 2 clocks per bit. Nothing to tell it apart on the wire, so it's an option.
+		self.twoPhase = (self.options['phases'] == '2')
+		self.tdoWarned = False
+		if (self.twoPhase):
+			# TDO is never on the wire, so everything read back (status, PrAcc, data) is 0. Said once, at the first entry.
+			self.out_warning = self.register(srd.OUTPUT_META, meta=(str, 'warning', 'Decoder warnings'))
 		
 		
 	def onResetAsserted(self):
 		# We need this, because the "JTAG"/ICSP controller gets reset on RESET.
+		if (self.enteredICSP > 0):
+			self.put(self.samplenum, self.samplenum, self.out_python, [REC_RESET, 'MCLR'])
 		self.valueInReset = 0
 		self.clockCycles = 0	
 		self.startSample = self.samplenum	# From where we will annotate
@@ -147,18 +190,42 @@ class Decoder(srd.Decoder):
 		# We need this, because the "JTAG"/ICSP controller gets reset on RESET.
 		if (self.clockCycles == 32 and self.valueInReset == 0x4D434850):	# If value was MCHP
 			self.put(self.startSample, self.samplenum, self.out_ann, [1, ['ICSP ENTER']])
+			self.put(self.startSample, self.samplenum, self.out_python, [REC_ENTER])
 			self.enteredICSP = 1
+			if (self.twoPhase and not self.tdoWarned):
+				self.put(self.startSample, self.samplenum, self.out_warning, 'phases=2: no TDO on the wire, every TDO value is shown as 0')
+				self.tdoWarned = True
 		else:
+			if (self.clockCycles > 0):
+				# Something was clocked in, just not the key. MCLR going up & down without clocks is only a reset.
+				self.put(self.startSample, self.samplenum, self.out_ann,
+					[1, ['ICSP ENTER FAILED: ' + hex(self.valueInReset) + ', ' + str(self.clockCycles) + ' clocks']])
+				self.put(self.startSample, self.samplenum, self.out_python, [REC_ENTER_FAILED, self.valueInReset, self.clockCycles])
 			self.enteredICSP = -1	# Denote failure to enter
 
 		self.valueTDI = 0
 		self.valueTDO = 0
 		self.valueTMS = 0
+		self.shiftWords = []
 		self.clockCycles = 0	
 		self.selectedTAP = 0;
 		self.selectedRegister = 0;
 		self.startSample = self.samplenum
 
+	# Rising clock while in reset, before ICSP is entered. Shifts in the entry key.
+	def onClockInReset(self, data):
+		# Check if last reset toggle was unsuccessful
+		if (self.enteredICSP == -1):
+			self.onResetAsserted()
+			self.enteredICSP = 0
+		# Clock high - save value into raw register
+		# Shift right and ave into LSB, as data comes MSB first
+		# Added precaution against infinite integers... Ask me why.
+		self.valueInReset = ((self.valueInReset << 1) | data ) & 0xFFFFFFFF	
+		self.clockCycles = self.clockCycles + 1
+		if (self.clockCycles > 100):	# BS prevention.
+			self.clockCycles = 100
+
 
 
 	def decode(self):
@@ -172,8 +239,6 @@ class Decoder(srd.Decoder):
 		self.onResetAsserted()
 		
 		while True:
-			stringsToPrint = []		
-
 			if (self.enteredICSP <= 0):
 
 				# Loop here, until ICSP is entered.
@@ -187,19 +252,26 @@ class Decoder(srd.Decoder):
 					# Check if all conditions have been met
 					self.onResetDeasserted()
 				else:
-					# Check if last reset toggle was unsuccessful
-					if (self.enteredICSP == -1):
-						self.onResetAsserted()
-						self.enteredICSP = 0
-					# Clock high - save value into raw register
-					# Shift right and ave into LSB, as data comes MSB first
-					# Added precaution against infinite integers... Ask me why.
-					self.valueInReset = ((self.valueInReset << 1) | data ) & 0xFFFFFFFF	
-					self.clockCycles = self.clockCycles + 1
-					if (self.clockCycles > 100):	# BS prevention.
-						self.clockCycles = 100
+					self.onClockInReset(data)
 
 			
+			elif (self.twoPhase):
+				# 2-phase: TDI on the first falling clock, TMS on the second. There is no TDO.
+				conds = []
+				conds.append({PIN_CLOCK: 'f'})					# On falling clock
+				conds.append({PIN_RESET: 'f'})					# Or falling reset
+				reset, clock, data = self.wait(conds)
+				tdi = data
+				if (reset == 0):
+					self.onResetAsserted()
+					continue
+				reset, clock, data = self.wait(conds)
+				tms = data
+				if (reset == 0):
+					self.onResetAsserted()
+					continue
+				self.onJtagBit(tdi, tms, 0)
+
 			else:
 				# After we are in ICSP, we just need to do JTAG over ICSP.
 				# Which is just 4 CLK cycles per one bit.
@@ -245,279 +317,205 @@ class Decoder(srd.Decoder):
 				reset, clock, data = self.wait(conds)	# Get all bits
 				if (reset == 0):
 					self.onResetAsserted()
-					continue	
-				
-				# At this point we are done getting bits, and can proceed with decoding data and such.
-				# Since it's kinda-sorta-but-not-really-still-yes JTAG over ICSP, here are the main components
-				# (Notes for me):
-				# SetMode, is just sending TMS until we end up in the right state (usualy Run-Test/Idle, but can differ). TDO is ignored, TDI should be 0.
-				# SendCommand, 4 bits TMS, then (5-1) bits of data (first bit TDI is LSB), then 3 bits of TMS footer, with first bit also MSB of command
-				# XferData, 3 bits TMS, with last bit also TDO = oLSb. Followed by (32-1) bits of data, first is TDI = iLSb, TDO = oLSb+1. Then 3 bits of TMS foorter, first is TDI = iMSb.
-				# XferFastData, 3 bits TMS, with last bit also TDO = oPrAcc, then one bit of PrAcc, where TDI = _0_, TDO = oLSb.
-				## Then (32-1) bits of data, where first is TDI = iLSb, TDO = oLSb+1
-				## Then 3 bits of TMS footer, with first bt also TDI = iMSb. TDO was transmitted already fully before
-				## XferFastData is equal to XferData, just with one extra bit. This bit is dropped by PicKit 3. That, and FastData register is selected ofc -> nice hook.
-				### Tried checking Pickit 3 for the 32bit FastData transfers, and now they're ok? Might've been the decoder at fault or something.
-				# XferInstruction is just XferData, with ETAP_DATA selected and then sending ETAP_CONTROL and 32 0s.
-				
-				# Anyways, nothing to fret. Eerything still gets checked in Update-DR or Update-IR.
-				
-				
-				# First we check whhich state we are, and do that operation
-				# afterwards, we check the TMS state, and move accordingly if needed			
-				
-				self.statePrevJTAG = self.stateJTAG	# Makes easier to update
-				
-
-				if (JS_TestLogicReset == self.stateJTAG):
-					stringsToPrint.append([self.startSampleTLR, self.out_ann, [14, ['Test-Logic-Reset']]])
-					self.selectedRegister = E_MTAP_IDCODE
-					if (0 == tms):
-						self.stateJTAG = JS_RunTestIdle
-					# Else loop back to TLR
-				elif (JS_RunTestIdle == self.stateJTAG):
-					stringsToPrint.append([self.startSampleRTI, self.out_ann, [15, ['Run-Test-Idle']]])
-					if (1 == tms):
-						self.stateJTAG = JS_SelectDRScan
-					# Else loop back to RTI
-## Scan versions
-				elif (JS_SelectDRScan == self.stateJTAG):
-					stringsToPrint.append([self.startSampleScan, self.out_ann, [16, ['Select-DR-Scan']]])
-					if (0 == tms):
-						self.stateJTAG = JS_CaptureDR
-					else:
-						self.stateJTAG = JS_SelectIRScan
-
-				elif (JS_SelectIRScan == self.stateJTAG):
-					stringsToPrint.append([self.startSampleScan, self.out_ann, [17, ['Select-IR-Scan']]])
-					if (0 == tms):
-						self.stateJTAG = JS_CaptureIR
-					else:
-						self.stateJTAG = JS_TestLogicReset	# Loop back
+					continue
+				self.onJtagBit(tdi, tms, tdo)
+
+	# One JTAG bit, after all 4 phases are in. Kept apart from decode(), so it
+	# can also be fed from elsewhere (pic32_tools), with self.samplenum set by the caller.
+	def onJtagBit(self, tdi, tms, tdo):
+		# Everything is put() right away, at the end of the bit - no list of strings to print in between.
+
+		# At this point we are done getting bits, and can proceed with decoding data and such.
+		# Since it's kinda-sorta-but-not-really-still-yes JTAG over ICSP, here are the main components
+		# (Notes for me):
+		# SetMode, is just sending TMS until we end up in the right state (usualy Run-Test/Idle, but can differ). TDO is ignored, TDI should be 0.
+		# SendCommand, 4 bits TMS, then (5-1) bits of data (first bit TDI is LSB), then 3 bits of TMS footer, with first bit also MSB of command
+		# XferData, 3 bits TMS, with last bit also TDO = oLSb. Followed by (32-1) bits of data, first is TDI = iLSb, TDO = oLSb+1. Then 3 bits of TMS foorter, first is TDI = iMSb.
+		# XferFastData, 3 bits TMS, with last bit also TDO = oPrAcc, then one bit of PrAcc, where TDI = _0_, TDO = oLSb.
+		## Then (32-1) bits of data, where first is TDI = iLSb, TDO = oLSb+1
+		## Then 3 bits of TMS footer, with first bt also TDI = iMSb. TDO was transmitted already fully before
+		## XferFastData is equal to XferData, just with one extra bit. This bit is dropped by PicKit 3. That, and FastData register is selected ofc -> nice hook.
+		### Tried checking Pickit 3 for the 32bit FastData transfers, and now they're ok? Might've been the decoder at fault or something.
+		# XferInstruction is just XferData, with ETAP_DATA selected and then sending ETAP_CONTROL and 32 0s.
+		
+		# Anyways, nothing to fret. Eerything still gets checked in Update-DR or Update-IR.
+		
+		
+		# First we check whhich state we are, and do that operation
+		# afterwards, we check the TMS state, and move accordingly if needed.
+		# The state's annotation, start sample & next state come from the tables in pic32_common.tap
+		
+		state = self.stateJTAG
+		self.statePrevJTAG = state	# Makes easier to update
+		nextState = NEXT_STATE[(state << 1) | tms]
+		if (self.showStates and (not self.coalesceStates or nextState != state)):
+			self.put(self.startSamples[STATE_SLOT[state]], self.samplenum, self.out_ann, STATE_ANNOTATION[state])
+
+## Shift versions, most common, so first
+		if (JS_ShiftDR == state or JS_ShiftIR == state):
+			## SHIFT DATA IN!!!! LSB first ><
+			# Into the current word only, full ones go to shiftWords. Keeps long shifts linear.
+			bit = self.clockCycles & WORD_MASK
+			self.valueTDI = self.valueTDI | (tdi<<bit)
+			self.valueTDO = self.valueTDO | (tdo<<bit)
+			self.valueTMS = self.valueTMS | (tms<<bit)
+			self.clockCycles = self.clockCycles + 1
+			if (JS_ShiftDR == state and 1 == tms):
+				# Expanded for ICSP. On a Shift-DR -> Exit1-DR transition, TDO is discarded.
+				self.valueTDO = self.valueTDO ^ (tdo<<bit)	# XOR the bit, if set
+			if (bit == WORD_MASK):
+				self.shiftWords.append((self.valueTDI, self.valueTDO, self.valueTMS))
+				self.valueTDI = 0
+				self.valueTDO = 0
+				self.valueTMS = 0
 
 ## Capture versions
-				elif (JS_CaptureDR == self.stateJTAG):
-					stringsToPrint.append([self.startSampleCapture, self.out_ann, [16, ['Capture-DR']]])
-					if (0 == tms):
-						self.stateJTAG = JS_ShiftDR
-						self.valueTDI = 0	## Prep variables
-						self.valueTDO = tdo	# Expanded for ICSP. TDO oLSb or oPrAcc is read HERE. 
-						self.valueTMS = 0
-						self.clockCycles = 0
-						self.startSampleShiftData = self.samplenum
-					else:
-						self.stateJTAG = JS_Exit1DR
-
-				elif (JS_CaptureIR == self.stateJTAG):
-					stringsToPrint.append([self.startSampleCapture, self.out_ann, [17, ['Capture-IR']]])
-					if (0 == tms):
-						self.stateJTAG = JS_ShiftIR
-						self.valueTDI = 0	## Prep variables
-						self.valueTDO = 0
-						self.valueTMS = 0
-						self.clockCycles = 0
-						self.startSampleShiftData = self.samplenum
-					else:
-						self.stateJTAG = JS_Exit1IR
-## Shift versions
-				elif (JS_ShiftDR == self.stateJTAG):
-					## SHIFT DATA IN!!!! LSB first ><
-					self.valueTDI = self.valueTDI | (tdi<<self.clockCycles)
-					self.valueTDO = self.valueTDO | (tdo<<self.clockCycles)
-					self.valueTMS = self.valueTMS | (tms<<self.clockCycles)
-					self.clockCycles = self.clockCycles + 1
-					stringsToPrint.append([self.startSampleShift, self.out_ann, [16, ['Shift-DR']]])
-					if (1 == tms):
-						self.stateJTAG = JS_Exit1DR
-						# Expanded for ICSP. On a Shift-DR -> Exit1-DR transition, TDO is discarded.
-						self.valueTDO = self.valueTDO ^ (tdo<<(self.clockCycles-1))	# XOR the bit, if set
-
-				elif (JS_ShiftIR == self.stateJTAG):
-					## SHIFT DATA IN!!!! LSB first ><
-					self.valueTDI = self.valueTDI | (tdi<<self.clockCycles)
-					self.valueTDO = self.valueTDO | (tdo<<self.clockCycles)
-					self.valueTMS = self.valueTMS | (tms<<self.clockCycles)
-					self.clockCycles = self.clockCycles + 1
-					stringsToPrint.append([self.startSampleShift, self.out_ann, [17, ['Shift-IR']]])
-					if (1 == tms):
-						self.stateJTAG = JS_Exit1IR
-					
-## Exit versions
-				elif (JS_Exit1DR == self.stateJTAG):
-					stringsToPrint.append([self.startSampleExit, self.out_ann, [16, ['Exit1-DR']]])
-					if (0 == tms):
-						self.stateJTAG = JS_PauseDR
-					else:
-						self.stateJTAG = JS_UpdateDR
-
-				elif (JS_Exit1IR == self.stateJTAG):
-					stringsToPrint.append([self.startSampleExit, self.out_ann, [17, ['Exit1-IR']]])
-					if (0 == tms):
-						self.stateJTAG = JS_PauseIR
-					else:
-						self.stateJTAG = JS_UpdateIR
-
-## Pause versions
-				elif (JS_PauseDR == self.stateJTAG):
-					stringsToPrint.append([self.startSamplePause, self.out_ann, [16, ['Pause-DR']]])
-					if (1 == tms):
-						self.stateJTAG = JS_Exit2DR
-				elif (JS_PauseIR == self.stateJTAG):
-					stringsToPrint.append([self.startSamplePause, self.out_ann, [17, ['Pause-IR']]])
-					if (1 == tms):
-						self.stateJTAG = JS_Exit2IR
-					
-## Exit versions
-				elif (JS_Exit2DR == self.stateJTAG):
-					stringsToPrint.append([self.startSampleExit, self.out_ann, [16, ['Exit2-DR']]])
-					if (0 == tms):
-						self.stateJTAG = JS_ShiftDR
-					else:
-						self.stateJTAG = JS_UpdateDR
-				elif (JS_Exit2IR == self.stateJTAG):
-					stringsToPrint.append([self.startSampleExit, self.out_ann, [17, ['Exit2-IR']]])
-					if (0 == tms):
-						self.stateJTAG = JS_ShiftIR
-					else:
-						self.stateJTAG = JS_UpdateIR
-					
+		elif (JS_CaptureDR == state):
+			if (0 == tms):
+				self.valueTDI = 0	## Prep variables
+				self.valueTDO = tdo	# Expanded for ICSP. TDO oLSb or oPrAcc is read HERE. 
+				self.valueTMS = 0
+				self.clockCycles = 0
+				if (self.shiftWords):
+					self.shiftWords = []
+				self.startSampleShiftData = self.samplenum
+		elif (JS_CaptureIR == state):
+			if (0 == tms):
+				self.valueTDI = 0	## Prep variables
+				self.valueTDO = 0
+				self.valueTMS = 0
+				self.clockCycles = 0
+				if (self.shiftWords):
+					self.shiftWords = []
+				self.startSampleShiftData = self.samplenum
 
 ## Update versions, the fun stuff
-				elif (JS_UpdateDR == self.stateJTAG):
-					stringsToPrint.append([self.startSampleUpdate, self.out_ann, [16, ['Update-DR']]])
-					stringsToPrint.append([self.startSampleShiftData, self.out_ann, [9, ['TMS ' + str(self.clockCycles) + 'b ' + str(hex(self.valueTMS))]]])
-					stringsToPrint.append([self.startSampleShiftData, self.out_ann, [10, ['TDI ' + str(self.clockCycles) + 'b ' + str(hex(self.valueTDI))]]])
-					stringsToPrint.append([self.startSampleShiftData, self.out_ann, [11, ['TDO ' + str(self.clockCycles) + 'b ' + str(hex(self.valueTDO))]]])
+		elif (JS_UpdateDR == state):
+			valueTDI, valueTDO, valueTMS = self.valueTDI, self.valueTDO, self.valueTMS
+			if (self.shiftWords):
+				valueTDI, valueTDO, valueTMS = joinShift(self.shiftWords, valueTDI, valueTDO, valueTMS, self.showBits)
+			if (self.showBits):
+				self.put(self.startSampleShiftData, self.samplenum, self.out_ann, [9, ['TMS ' + str(self.clockCycles) + 'b ' + str(hex(valueTMS))]])
+				self.put(self.startSampleShiftData, self.samplenum, self.out_ann, [10, ['TDI ' + str(self.clockCycles) + 'b ' + str(hex(valueTDI))]])
+				self.put(self.startSampleShiftData, self.samplenum, self.out_ann, [11, ['TDO ' + str(self.clockCycles) + 'b ' + str(hex(valueTDO))]])
 
 ### Decoding
-					if (self.clockCycles == 5):
-						# Ok, this is a 5bit instruction
-						if (self.valueTDI not in INSTRUCTIONS):
-							stringsToPrint.append([self.startSampleShiftData, self.out_ann, [2, ['Unknown command: ' + str(hex(self.valueTDI))]]])					
-						else:
-							if (self.selectedTAP == ETAP):
-								stringsToPrint.append([self.startSampleShiftData, self.out_ann, [3, ['ETAP COMMAND: ' + INSTRUCTIONS[self.valueTDI]]]])
-							else:
-								stringsToPrint.append([self.startSampleShiftData, self.out_ann, [2, ['MTAP COMMAND: ' + INSTRUCTIONS[self.valueTDI]]]])
-							if (self.valueTDI == MTAP_SW_ETAP):
-								self.selectedTAP = ETAP
-							elif(self.valueTDI == MTAP_SW_MTAP):
-								self.selectedTAP = MTAP
-		
-							self.selectedRegister = self.valueTDI	# Save selected register
-						
-					
-					elif (self.selectedRegister == MTAP_COMMAND):
-						# Ok, this is an 8-bit Command DR thing (should be in the upper quadrant)
-						if (self.valueTDI in MTAP_COMMAND_DR):
-							stringsToPrint.append([self.startSampleShiftData, self.out_ann, [4, ['COMMAND_DR: ' + MTAP_COMMAND_DR[self.valueTDI]]]])	
-						else:
-							stringsToPrint.append([self.startSampleShiftData, self.out_ann, [4, ['COMMAND_DR: Unknown :( ' + str(hex(self.valueTDI))]]])
-					elif (self.clockCycles == 32):
-						# Just normal data
-						stringsToPrint.append([self.startSampleShiftData, self.out_ann, [5, ['Normal data transfer TDI: ' +  str(hex(self.valueTDI))  + ' TDO: ' + str(hex(self.valueTDO)) ]]])
-					elif (self.selectedRegister == ETAP_FASTDATA):	# Could check for 33 bits -> NO! Pickit frigs this up.
-						# FAST DATA
-						# TODO, CHECK this and improve for pickit (><)
-						## >>1 are there to remove bits from PrAcc. Needs to be revised
-						if (self.clockCycles == 32):
-							# Pickit transfer
-							stringsToPrint.append([self.startSampleShiftData, self.out_ann,\
-							[5, ['Fast data transfer TDI: ' +  str(hex(self.valueTDI>>1))  + ' TDO: ' + str(hex(self.valueTDO>>1))\
-							+ ' PrAcc PIC: ' + str(hex(self.valueTDO & 0x01)) + ' PrAcc PROBE: ' + str(hex(self.valueTDI & 0x01))  ]]])	# PrAcc PROBE is probably missing on Pickit.
-						else:
-							# Either normal fast transfer, or error.
-							stringsToPrint.append([self.startSampleShiftData, self.out_ann,\
-							[5, ['Fast data transfer TDI: ' +  str(hex(self.valueTDI>>1))  + ' TDO: ' + str(hex(self.valueTDO>>1))\
-							+ ' PrAcc PIC: ' + str(hex(self.valueTDO & 0x01)) + ' PrAcc PROBE: ' + str(hex(self.valueTDI & 0x01))  ]]])	
-### End decoding
-					
-					if (0 == tms):
-						self.stateJTAG = JS_RunTestIdle
-					else:
-						self.stateJTAG = JS_SelectDRScan
-				elif (JS_UpdateIR == self.stateJTAG):
-					stringsToPrint.append([self.startSampleUpdate, self.out_ann, [17, ['Update-IR']]])
-					stringsToPrint.append([self.startSampleShiftData, self.out_ann, [9, ['TMS ' + str(self.clockCycles) + 'b ' + str(hex(self.valueTMS))]]])
-					stringsToPrint.append([self.startSampleShiftData, self.out_ann, [10, ['TDI ' + str(self.clockCycles) + 'b ' + str(hex(self.valueTDI))]]])
-					stringsToPrint.append([self.startSampleShiftData, self.out_ann, [11, ['TDO ' + str(self.clockCycles) + 'b ' + str(hex(self.valueTDO))]]])
+			if (self.clockCycles == 5):
+				# Ok, this is a 5bit instruction
+				self.put(self.startSampleShiftData, self.samplenum, self.out_python, [REC_IR, TAP_NAMES[self.selectedTAP], valueTDI])
+				if (valueTDI not in INSTRUCTIONS):
+					self.put(self.startSampleShiftData, self.samplenum, self.out_ann, [2, ['Unknown command: ' + str(hex(valueTDI))]])					
+				else:
+					self.put(self.startSampleShiftData, self.samplenum, self.out_ann, IR_ANNOTATIONS[self.selectedTAP][valueTDI])
+					if (valueTDI == MTAP_SW_ETAP):
+						self.selectedTAP = ETAP
+					elif(valueTDI == MTAP_SW_MTAP):
+						self.selectedTAP = MTAP
 
-### Decoding
-					if (self.clockCycles == 5):
-						# Ok, this is a 5bit instruction
-						if (self.valueTDI not in INSTRUCTIONS):
-							stringsToPrint.append([self.startSampleShiftData, self.out_ann, [2, ['Unknown command: ' + str(hex(self.valueTDI))]]])					
-						else:
-							if (self.selectedTAP == ETAP):
-								stringsToPrint.append([self.startSampleShiftData, self.out_ann, [3, ['ETAP COMMAND: ' + INSTRUCTIONS[self.valueTDI]]]])
-							else:
-								stringsToPrint.append([self.startSampleShiftData, self.out_ann, [2, ['MTAP COMMAND: ' + INSTRUCTIONS[self.valueTDI]]]])
-							if (self.valueTDI == MTAP_SW_ETAP):
-								self.selectedTAP = ETAP
-							elif(self.valueTDI == MTAP_SW_MTAP):
-								self.selectedTAP = MTAP
-		
-							self.selectedRegister = self.valueTDI	# Save selected register
-						
-					
-					elif (self.selectedRegister == MTAP_COMMAND):
-						# Ok, this is an 8-bit Command DR thing (should be in the upper quadrant)
-						if (self.valueTDI in MTAP_COMMAND_DR):
-							stringsToPrint.append([self.startSampleShiftData, self.out_ann, [4, ['COMMAND_DR: ' + MTAP_COMMAND_DR[self.valueTDI]]]])	
-						else:
-							stringsToPrint.append([self.startSampleShiftData, self.out_ann, [4, ['COMMAND_DR: Unknown :( ' + str(hex(self.valueTDI))]]])
-					elif (self.clockCycles == 32):
-						# Just normal data
-						stringsToPrint.append([self.startSampleShiftData, self.out_ann, [5, ['Normal data transfer']]])
-					elif (self.selectedRegister == ETAP_FASTDATA):	# Could check for 33 bits
-						# FAST DATA
-						stringsToPrint.append([self.startSampleShiftData, self.out_ann, [5, ['Fast data transfer TDI:' +  str(hex(self.valueTDI>>1))  + ' TDO: ' + str(hex(self.valueTDO>>1)) ]]])
+					self.selectedRegister = valueTDI	# Save selected register
+				
+			
+			elif (self.selectedRegister == MTAP_COMMAND):
+				# Ok, this is an 8-bit Command DR thing (should be in the upper quadrant)
+				self.put(self.startSampleShiftData, self.samplenum, self.out_python, [REC_COMMAND_DR, valueTDI, valueTDO])
+				if (valueTDI in MTAP_COMMAND_DR):
+					self.put(self.startSampleShiftData, self.samplenum, self.out_ann, COMMAND_DR_ANNOTATIONS[valueTDI])	
+				else:
+					self.put(self.startSampleShiftData, self.samplenum, self.out_ann, [4, ['COMMAND_DR: Unknown :( ' + str(hex(valueTDI))]])
+			elif (self.selectedRegister == ETAP_FASTDATA):	# Could check for 33 bits -> NO! Pickit frigs this up.
+				# FAST DATA
+				self.put(self.startSampleShiftData, self.samplenum, self.out_python, [REC_FASTDATA, valueTDI>>1, valueTDO>>1, valueTDO & 0x01, valueTDI & 0x01])
+				# TODO, CHECK this and improve for pickit (><)
+				## >>1 are there to remove bits from PrAcc. Needs to be revised
+				if (self.clockCycles == 32):
+					# Pickit transfer
+					self.put(self.startSampleShiftData, self.samplenum, self.out_ann,\
+					[5, ['Fast data transfer TDI: ' +  str(hex(valueTDI>>1))  + ' TDO: ' + str(hex(valueTDO>>1))\
+					+ ' PrAcc PIC: ' + str(hex(valueTDO & 0x01)) + ' PrAcc PROBE: ' + str(hex(valueTDI & 0x01))  ]])	# PrAcc PROBE is probably missing on Pickit.
+				else:
+					# Either normal fast transfer, or error.
+					self.put(self.startSampleShiftData, self.samplenum, self.out_ann,\
+					[5, ['Fast data transfer TDI: ' +  str(hex(valueTDI>>1))  + ' TDO: ' + str(hex(valueTDO>>1))\
+					+ ' PrAcc PIC: ' + str(hex(valueTDO & 0x01)) + ' PrAcc PROBE: ' + str(hex(valueTDI & 0x01))  ]])	
+			elif (self.clockCycles == 32):
+				# Just normal data
+				self.put(self.startSampleShiftData, self.samplenum, self.out_python, [REC_DATA, self.selectedRegister, valueTDI, valueTDO, self.clockCycles])
+				self.put(self.startSampleShiftData, self.samplenum, self.out_ann, [5, ['Normal data transfer TDI: ' +  str(hex(valueTDI))  + ' TDO: ' + str(hex(valueTDO)) ]])
 ### End decoding
 
-					if (0 == tms):
-						self.stateJTAG = JS_RunTestIdle
-					else:
-						self.stateJTAG = JS_SelectDRScan
+		elif (JS_UpdateIR == state):
+			valueTDI, valueTDO, valueTMS = self.valueTDI, self.valueTDO, self.valueTMS
+			if (self.shiftWords):
+				valueTDI, valueTDO, valueTMS = joinShift(self.shiftWords, valueTDI, valueTDO, valueTMS, self.showBits)
+			if (self.showBits):
+				self.put(self.startSampleShiftData, self.samplenum, self.out_ann, [9, ['TMS ' + str(self.clockCycles) + 'b ' + str(hex(valueTMS))]])
+				self.put(self.startSampleShiftData, self.samplenum, self.out_ann, [10, ['TDI ' + str(self.clockCycles) + 'b ' + str(hex(valueTDI))]])
+				self.put(self.startSampleShiftData, self.samplenum, self.out_ann, [11, ['TDO ' + str(self.clockCycles) + 'b ' + str(hex(valueTDO))]])
 
-## Else, apocalypse
+### Decoding
+			if (self.clockCycles == 5):
+				# Ok, this is a 5bit instruction
+				self.put(self.startSampleShiftData, self.samplenum, self.out_python, [REC_IR, TAP_NAMES[self.selectedTAP], valueTDI])
+				if (valueTDI not in INSTRUCTIONS):
+					self.put(self.startSampleShiftData, self.samplenum, self.out_ann, [2, ['Unknown command: ' + str(hex(valueTDI))]])					
 				else:
-					print("Unknown State")
-					while(1):
-						continue
-
-
-
-				# Also trigger on the FALLING edge, to make nicer ouput (center the bit on the rising edge)
-				# Reverse archeology is fun...
-				# So, our stringsToPrint were [start position], [out annotation?], [actual data to print]
-				# Here, so do some muckery, to align it bit perfect etc.
-				# Can't do that, so modify.
-				#conds = []
-				#conds.append({PIN_CLOCK: 'f'})
-				#reset, tms, tck, tdi, tdo = self.wait(conds)
-				#for x in stringsToPrint:
-				#	self.put(x[0], self.samplenum, x[1], x[2])
-				for x in stringsToPrint:
-					self.put(x[0], self.samplenum, x[1], x[2])
-					
-
-				# Code duplication. Meh
-				if (JS_TestLogicReset == self.stateJTAG):
-					self.startSampleTLR = self.samplenum
-				elif (JS_RunTestIdle == self.stateJTAG):
-					self.startSampleRTI = self.samplenum
-				elif (JS_SelectDRScan == self.stateJTAG or JS_SelectIRScan == self.stateJTAG):
-					self.startSampleScan = self.samplenum
-				elif (JS_CaptureDR == self.stateJTAG or JS_CaptureIR == self.stateJTAG):
-					self.startSampleCapture = self.samplenum
-				elif (JS_ShiftDR == self.stateJTAG or JS_ShiftIR == self.stateJTAG):
-					self.startSampleShift = self.samplenum
-				elif (JS_Exit1DR == self.stateJTAG or JS_Exit1IR == self.stateJTAG or JS_Exit2DR == self.stateJTAG or JS_Exit2IR == self.stateJTAG):
-					self.startSampleExit = self.samplenum
-				elif (JS_PauseDR == self.stateJTAG or JS_PauseIR == self.stateJTAG):
-					self.startSamplePause = self.samplenum
-				elif (JS_UpdateDR == self.stateJTAG or JS_UpdateIR == self.stateJTAG):
-					self.startSampleUpdate = self.samplenum
+					self.put(self.startSampleShiftData, self.samplenum, self.out_ann, IR_ANNOTATIONS[self.selectedTAP][valueTDI])
+					if (valueTDI == MTAP_SW_ETAP):
+						self.selectedTAP = ETAP
+					elif(valueTDI == MTAP_SW_MTAP):
+						self.selectedTAP = MTAP
+
+					self.selectedRegister = valueTDI	# Save selected register
+				
+			
+			elif (self.selectedRegister == MTAP_COMMAND):
+				# Ok, this is an 8-bit Command DR thing (should be in the upper quadrant)
+				self.put(self.startSampleShiftData, self.samplenum, self.out_python, [REC_COMMAND_DR, valueTDI, valueTDO])
+				if (valueTDI in MTAP_COMMAND_DR):
+					self.put(self.startSampleShiftData, self.samplenum, self.out_ann, COMMAND_DR_ANNOTATIONS[valueTDI])	
+				else:
+					self.put(self.startSampleShiftData, self.samplenum, self.out_ann, [4, ['COMMAND_DR: Unknown :( ' + str(hex(valueTDI))]])
+			elif (self.selectedRegister == ETAP_FASTDATA):	# Could check for 33 bits
+				# FAST DATA
+				self.put(self.startSampleShiftData, self.samplenum, self.out_python, [REC_FASTDATA, valueTDI>>1, valueTDO>>1, valueTDO & 0x01, valueTDI & 0x01])
+				self.put(self.startSampleShiftData, self.samplenum, self.out_ann, [5, ['Fast data transfer TDI:' +  str(hex(valueTDI>>1))  + ' TDO: ' + str(hex(valueTDO>>1)) ]])
+			elif (self.clockCycles == 32):
+				# Just normal data
+				self.put(self.startSampleShiftData, self.samplenum, self.out_python, [REC_DATA, self.selectedRegister, valueTDI, valueTDO, self.clockCycles])
+				self.put(self.startSampleShiftData, self.samplenum, self.out_ann, [5, ['Normal data transfer']])
+### End decoding
+
+		elif (JS_TestLogicReset == state):
+			self.selectedRegister = E_MTAP_IDCODE
+
+		if (JS_TestLogicReset == nextState and JS_TestLogicReset != state):
+			self.put(self.samplenum, self.samplenum, self.out_python, RESET_TMS)
+
+		self.stateJTAG = nextState
+
+
+		# Also trigger on the FALLING edge, to make nicer ouput (center the bit on the rising edge)
+		# Reverse archeology is fun...
+		# Can't do that, the bit is only complete here. So everything above was put() at this sample already.
+		if (not self.coalesceStates or self.stateJTAG != self.statePrevJTAG):
+			self.startSamples[STATE_SLOT[self.stateJTAG]] = self.samplenum
+
+	# Bits in Shift-DR/IR that stay there (TMS 0), all at once - the same as onJtagBit() for each.
+	# tdi/tdo are the bits as ints, LSB first, samples the sample of each bit.
+	# For the batch engine, when a whole SendCommand/XferData frame was recognised (pic32_tools/engines.py).
+	def onShiftRun(self, tdi, tdo, samples):
+		state = self.stateJTAG
+		self.statePrevJTAG = state
+		if (not self.coalesceStates):
+			if (self.showStates):
+				annotation = STATE_ANNOTATION[state]
+				start = self.startSamples[SLOT_SHIFT]
+				for sample in samples:
+					self.put(start, sample, self.out_ann, annotation)
+					start = sample
+			self.startSamples[SLOT_SHIFT] = samples[-1]
+		shiftRun(self, tdi, tdo, 0, len(samples))
+		self.samplenum = samples[-1]
 
 ###############################################################################
 	
@@ -8,6 +8,12 @@ Everything is CLOCK driven
 import sigrokdecode as srd
 import time
 
+from pic32_common.tap import *
+from pic32_common.records import *
+from pic32_common.shift import WORD_MASK, joinShift
+from pic32_common.profile import Profiler
+from pic32_common.polls import PollCollapser
+
 PIN_RESET, PIN_TMS, PIN_CLOCK, PIN_TDI, PIN_TDO = range(5)	# Pins
 MTAP, ETAP = range(2)	# TAPs in the microcontroller
 
@@ -36,10 +42,17 @@ INSTRUCTIONS = {MTAP_COMMAND:'MTAP_COMMAND', MTAP_SW_MTAP:'MTAP_SW_MTAP', MTAP_S
 
 MTAP_COMMAND_DR = {MTAP_DR_MCHP_STATUS:'MTAP_DR_MCHP_STATUS', MTAP_DR_MCHP_ASSERT_RST:'MTAP_DR_MCHP_ASSERT_RST', MTAP_DR_MCHP_DE_ASSERT_RST:'MTAP_DR_MCHP_DE_ASSERT_RST', MTAP_DR_MCHP_ERASE:'MTAP_DR_MCHP_ERASE', MTAP_DR_MCHP_FLASH_ENABLE:'MTAP_DR_MCHP_FLASH_ENABLE', MTAP_DR_MCHP_FLASH_DISABLE:'MTAP_DR_MCHP_FLASH_DISABLE'}
 
-# JTAG related stuff & states. Gotta do it properly, because J-Link
-# JS == JtagState
-JS_TestLogicReset, JS_RunTestIdle, JS_SelectDRScan, JS_CaptureDR, JS_ShiftDR, JS_Exit1DR, JS_PauseDR, JS_Exit2DR, JS_UpdateDR, JS_SelectIRScan, JS_CaptureIR, JS_ShiftIR, JS_Exit1IR, JS_PauseIR, JS_Exit2IR, JS_UpdateIR = range(16)
-JSLookup = {JS_TestLogicReset:'TestLogicReset', JS_RunTestIdle:'RunTestIdle', JS_SelectDRScan: 'SelectDRScan', JS_CaptureDR:'CaptureDR', JS_ShiftDR:'ShiftDR', JS_Exit1DR:'Exit1DR', JS_PauseDR:'PauseDR', JS_Exit2DR:'Exit2DR', JS_UpdateDR:'UpdateDR', JS_SelectIRScan:'SelectIRScan', JS_CaptureIR:'CaptureIR', JS_ShiftIR:'ShiftIR', JS_Exit1IR:'Exit1IR', JS_PauseIR:'PauseIR', JS_Exit2IR:'Exit2IR', JS_UpdateIR:'UpdateIR'}
+# Annotation payloads that never change, built once here instead of on every Update-IR/DR. Shared, don't modify.
+# Both TAPs take all instructions (MTAP_SW_MTAP/MTAP_SW_ETAP switch either way), only the row & prefix differ.
+IR_ANNOTATIONS = (
+	dict((x, [2, ['MTAP COMMAND: ' + INSTRUCTIONS[x]]]) for x in INSTRUCTIONS),	# MTAP
+	dict((x, [3, ['ETAP COMMAND: ' + INSTRUCTIONS[x]]]) for x in INSTRUCTIONS),	# ETAP
+)
+COMMAND_DR_ANNOTATIONS = dict((x, [4, ['COMMAND_DR: ' + MTAP_COMMAND_DR[x]]]) for x in MTAP_COMMAND_DR)
+RESET_TMS = [REC_RESET, 'TMS']
+
+# Status polls, for polls=collapse (pic32_common.polls): (record type, command/register) -> annotation, name
+POLLS = {(REC_COMMAND_DR, MTAP_DR_MCHP_STATUS): (4, 'COMMAND_DR: MTAP_DR_MCHP_STATUS'), (REC_DATA, ETAP_CONTROL): (5, 'ETAP_CONTROL')}
 
 class Decoder(srd.Decoder):
 	api_version = 3
@@ -91,9 +104,19 @@ class Decoder(srd.Decoder):
 		('tdo', 'TDO', (11, )),
 		('unknown', 'WTF', (7, )),
 	)
+	options = (
+		{'id': 'coalesce', 'desc': 'Merge repeated JTAG states into one annotation', 'default': 'no', 'values': ('no', 'yes')},
+		{'id': 'profile', 'desc': 'Count & time clocks, waits and puts (slower)', 'default': 'no', 'values': ('no', 'yes')},
+		{'id': 'verbosity', 'desc': 'Rows to decode', 'default': 'full', 'values': ('full', 'transactions+bits', 'transactions')},
+		{'id': 'polls', 'desc': 'Repeated MCHP_STATUS/ETAP_CONTROL polls', 'default': 'show', 'values': ('show', 'collapse')},
+	)
+	# Everything the decoder keeps between clocks, for checkpoints (pic32_tools/checkpoint.py)
+	checkpointState = ('stateJTAG', 'statePrevJTAG', 'selectedTAP', 'selectedRegister', 'clockCycles',
+		'valueTDI', 'valueTDO', 'valueTMS', 'shiftWords', 'startSamples', 'startSampleShiftData', 'stateStart')
 
 	def __init__(self):
 		# Vars used 
+		self.samplerate = 0
 		self.clockCycles = 0
 		self.valueTDI = 0
 		self.valueTDO = 0
@@ -101,6 +124,7 @@ class Decoder(srd.Decoder):
 
 	def start(self):
 		self.out_ann = self.register(srd.OUTPUT_ANN)
+		self.out_python = self.register(srd.OUTPUT_PYTHON)	# Transaction records, see pic32_common.records
 		self.stateJTAG = 0		# Assume TestLogicReset
 		self.statePrevJTAG = 0
 		self.selectedTAP = 0	# Assum MTAP
@@ -108,273 +132,203 @@ class Decoder(srd.Decoder):
 		self.valueTDI = 0
 		self.valueTDO = 0
 		self.valueTMS = 0
+		self.shiftWords = []	# Full words of a long shift, see pic32_common.shift
 		self.selectedRegister = 0	# Selected register for MCHP decoding specifics	
-		self.startSampleTLR = 0
-		self.startSampleRTI = 0
-		self.startSampleScan = 0
-		self.startSampleCapture = 0
-		self.startSampleShift = 0
+		self.startSamples = [0] * NUM_SLOTS	# Where the current state's annotation starts, by SLOT_*
 		self.startSampleShiftData = 0
-		self.startSampleExitOne = 0
-		self.startSamplePause = 0
-		self.startSampleExitTwo = 0
-		self.startSampleUpdate = 0
+		self.stateStart = None	# Start of the state annotation to put on the falling edge, None if there's none
+		# Coalesce: a state that loops on itself (Run-Test-Idle, Shift-DR...) is printed once, when it's left
+		self.coalesceStates = (self.options['coalesce'] == 'yes')
+		# Verbosity: rows that are not shown are not built at all. Command & Data rows are always there.
+		self.showStates = (self.options['verbosity'] == 'full')				# JTAG state row
+		self.showBits = (self.options['verbosity'] != 'transactions')		# TMS/TDI/TDO rows
+		# Profile: counters & timing, put on OUTPUT_META at the end of data
+		self.profiler = None
+		if (self.options['profile'] == 'yes'):
+			self.profiler = Profiler(self, ('wait', 'onClockRising', 'onClockFalling'), 'onClockRising')
+		# Polls: a run of the same status poll is put as one annotation, see pic32_common.polls
+		self.polls = None
+		if (self.options['polls'] == 'collapse'):
+			self.polls = PollCollapser(self, POLLS)
 
 	# Now required
 	def reset(self):
 		pass
 
+	def metadata(self, key, value):
+		if (key == srd.SRD_CONF_SAMPLERATE):
+			self.samplerate = value	# Only for the poll times
+
 	def decode(self):
 		#print("HERE 2");
 		
 		while True:
 			#time.sleep(0.01)
 			conds = []
-			stringsToPrint = []
 			
 			# EVERYTHING is rising edge driven.
 			conds.append({PIN_CLOCK: 'r'})	
 			reset, tms, tck, tdi, tdo = self.wait(conds)
+			stringsToPrint = self.onClockRising(tms, tdi, tdo)
 
-			# First we check whhich state we are, and do that operation
-			# afterwards, we check the TMS state, and move accordingly if needed
-
-			self.statePrevJTAG = self.stateJTAG	# Makes easier to update
-
-			if (JS_TestLogicReset == self.stateJTAG):
-				stringsToPrint.append([self.startSampleTLR, self.out_ann, [14, ['Test-Logic-Reset']]])
-				self.selectedRegister = E_MTAP_IDCODE
-				if (0 == tms):
-					self.stateJTAG = JS_RunTestIdle
-				# Else loop back to TLR
-			elif (JS_RunTestIdle == self.stateJTAG):
-				stringsToPrint.append([self.startSampleRTI, self.out_ann, [15, ['Run-Test-Idle']]])
-				if (1 == tms):
-					self.stateJTAG = JS_SelectDRScan
-				# Else loop back to RTI
-## Scan versions
-			elif (JS_SelectDRScan == self.stateJTAG):
-				stringsToPrint.append([self.startSampleScan, self.out_ann, [16, ['Select-DR-Scan']]])
-				if (0 == tms):
-					self.stateJTAG = JS_CaptureDR
-				else:
-					self.stateJTAG = JS_SelectIRScan
-
-			elif (JS_SelectIRScan == self.stateJTAG):
-				stringsToPrint.append([self.startSampleScan, self.out_ann, [17, ['Select-IR-Scan']]])
-				if (0 == tms):
-					self.stateJTAG = JS_CaptureIR
-				else:
-					self.stateJTAG = JS_TestLogicReset	# Loop back
+			# Also trigger on the FALLING edge, to make nicer ouput (center the bit on the rising edge)
+			conds = []
+			conds.append({PIN_CLOCK: 'f'})
+			reset, tms, tck, tdi, tdo = self.wait(conds)
+			self.onClockFalling(stringsToPrint)
+
+	# One TCK cycle, sampled on the rising edge. Kept apart from decode(), so it
+	# can also be fed from elsewhere (pic32_tools), with self.samplenum set by the caller.
+	# Returns what needs to be printed on the falling edge. Mostly nothing (the empty tuple, not a new list),
+	# the state annotation is kept in self.stateStart, for statePrevJTAG.
+	def onClockRising(self, tms, tdi, tdo):
+		stringsToPrint = ()
+
+		# First we check whhich state we are, and do that operation
+		# afterwards, we check the TMS state, and move accordingly if needed.
+		# The state's annotation, start sample & next state come from the tables in pic32_common.tap
+
+		state = self.stateJTAG
+		self.statePrevJTAG = state	# Makes easier to update
+		nextState = NEXT_STATE[(state << 1) | tms]
+		if (self.showStates and (not self.coalesceStates or nextState != state)):
+			self.stateStart = self.startSamples[STATE_SLOT[state]]
+
+## Shift versions, most common, so first
+		if (JS_ShiftDR == state or JS_ShiftIR == state):
+			## SHIFT DATA IN!!!! LSB first ><
+			# Into the current word only, full ones go to shiftWords. Keeps long shifts linear.
+			bit = self.clockCycles & WORD_MASK
+			self.valueTDI = self.valueTDI | (tdi<<bit)
+			self.valueTDO = self.valueTDO | (tdo<<bit)
+			self.valueTMS = self.valueTMS | (tms<<bit)
+			self.clockCycles = self.clockCycles + 1
+			if (bit == WORD_MASK):
+				self.shiftWords.append((self.valueTDI, self.valueTDO, self.valueTMS))
+				self.valueTDI = 0
+				self.valueTDO = 0
+				self.valueTMS = 0
 
 ## Capture versions
-			elif (JS_CaptureDR == self.stateJTAG):
-				stringsToPrint.append([self.startSampleCapture, self.out_ann, [16, ['Capture-DR']]])
-				if (0 == tms):
-					self.stateJTAG = JS_ShiftDR
-					self.valueTDI = 0	## Prep variables
-					self.valueTDO = 0
-					self.valueTMS = 0
-					self.clockCycles = 0
-					self.startSampleShiftData = self.samplenum
-				else:
-					self.stateJTAG = JS_Exit1DR
-
-			elif (JS_CaptureIR == self.stateJTAG):
-				stringsToPrint.append([self.startSampleCapture, self.out_ann, [17, ['Capture-IR']]])
-				if (0 == tms):
-					self.stateJTAG = JS_ShiftIR
-					self.valueTDI = 0	## Prep variables
-					self.valueTDO = 0
-					self.valueTMS = 0
-					self.clockCycles = 0
-					self.startSampleShiftData = self.samplenum
-				else:
-					self.stateJTAG = JS_Exit1IR
-## Shift versions
-			elif (JS_ShiftDR == self.stateJTAG):
-				## SHIFT DATA IN!!!! LSB first ><
-				self.valueTDI = self.valueTDI | (tdi<<self.clockCycles)
-				self.valueTDO = self.valueTDO | (tdo<<self.clockCycles)
-				self.valueTMS = self.valueTMS | (tms<<self.clockCycles)
-				self.clockCycles = self.clockCycles + 1
-				stringsToPrint.append([self.startSampleShift, self.out_ann, [16, ['Shift-DR']]])
-				if (1 == tms):
-					self.stateJTAG = JS_Exit1DR
-
-			elif (JS_ShiftIR == self.stateJTAG):
-				## SHIFT DATA IN!!!! LSB first ><
-				self.valueTDI = self.valueTDI | (tdi<<self.clockCycles)
-				self.valueTDO = self.valueTDO | (tdo<<self.clockCycles)
-				self.valueTMS = self.valueTMS | (tms<<self.clockCycles)
-				self.clockCycles = self.clockCycles + 1
-				stringsToPrint.append([self.startSampleShift, self.out_ann, [17, ['Shift-IR']]])
-				if (1 == tms):
-					self.stateJTAG = JS_Exit1IR
-				
-## Exit versions
-			elif (JS_Exit1DR == self.stateJTAG):
-				stringsToPrint.append([self.startSampleExit, self.out_ann, [16, ['Exit1-DR']]])
-				if (0 == tms):
-					self.stateJTAG = JS_PauseDR
-				else:
-					self.stateJTAG = JS_UpdateDR
-
-			elif (JS_Exit1IR == self.stateJTAG):
-				stringsToPrint.append([self.startSampleExit, self.out_ann, [17, ['Exit1-IR']]])
-				if (0 == tms):
-					self.stateJTAG = JS_PauseIR
-				else:
-					self.stateJTAG = JS_UpdateIR
-
-## Pause versions
-			elif (JS_PauseDR == self.stateJTAG):
-				stringsToPrint.append([self.startSamplePause, self.out_ann, [16, ['Pause-DR']]])
-				if (1 == tms):
-					self.stateJTAG = JS_Exit2DR
-			elif (JS_PauseIR == self.stateJTAG):
-				stringsToPrint.append([self.startSamplePause, self.out_ann, [17, ['Pause-IR']]])
-				if (1 == tms):
-					self.stateJTAG = JS_Exit2IR
-				
-## Exit versions
-			elif (JS_Exit2DR == self.stateJTAG):
-				stringsToPrint.append([self.startSampleExit, self.out_ann, [16, ['Exit2-DR']]])
-				if (0 == tms):
-					self.stateJTAG = JS_ShiftDR
-				else:
-					self.stateJTAG = JS_UpdateDR
-			elif (JS_Exit2IR == self.stateJTAG):
-				stringsToPrint.append([self.startSampleExit, self.out_ann, [17, ['Exit2-IR']]])
-				if (0 == tms):
-					self.stateJTAG = JS_ShiftIR
-				else:
-					self.stateJTAG = JS_UpdateIR
-				
+		elif (JS_CaptureDR == state or JS_CaptureIR == state):
+			if (0 == tms):
+				self.valueTDI = 0	## Prep variables
+				self.valueTDO = 0
+				self.valueTMS = 0
+				self.clockCycles = 0
+				if (self.shiftWords):
+					self.shiftWords = []
+				self.startSampleShiftData = self.samplenum
 
 ## Update versions, the fun stuff
-			elif (JS_UpdateDR == self.stateJTAG):
-				stringsToPrint.append([self.startSampleUpdate, self.out_ann, [16, ['Update-DR']]])
-				stringsToPrint.append([self.startSampleShiftData, self.out_ann, [9, ['TMS ' + str(self.clockCycles) + 'b ' + str(hex(self.valueTMS))]]])
-				stringsToPrint.append([self.startSampleShiftData, self.out_ann, [10, ['TDI ' + str(self.clockCycles) + 'b ' + str(hex(self.valueTDI))]]])
-				stringsToPrint.append([self.startSampleShiftData, self.out_ann, [11, ['TDO ' + str(self.clockCycles) + 'b ' + str(hex(self.valueTDO))]]])
+		elif (JS_UpdateDR == state):
+			stringsToPrint = []
+			valueTDI, valueTDO, valueTMS = self.valueTDI, self.valueTDO, self.valueTMS
+			if (self.shiftWords):
+				valueTDI, valueTDO, valueTMS = joinShift(self.shiftWords, valueTDI, valueTDO, valueTMS, self.showBits)
+			if (self.showBits):
+				stringsToPrint.append([self.startSampleShiftData, self.out_ann, [9, ['TMS ' + str(self.clockCycles) + 'b ' + str(hex(valueTMS))]]])
+				stringsToPrint.append([self.startSampleShiftData, self.out_ann, [10, ['TDI ' + str(self.clockCycles) + 'b ' + str(hex(valueTDI))]]])
+				stringsToPrint.append([self.startSampleShiftData, self.out_ann, [11, ['TDO ' + str(self.clockCycles) + 'b ' + str(hex(valueTDO))]]])
 
 ### Decoding
-				if (self.clockCycles == 5):
-					# Ok, this is a 5bit instruction
-					if (self.valueTDI not in INSTRUCTIONS):
-						stringsToPrint.append([self.startSampleShiftData, self.out_ann, [2, ['Unknown command: ' + str(hex(self.valueTDI))]]])					
-					else:
-						if (self.selectedTAP == ETAP):
-							stringsToPrint.append([self.startSampleShiftData, self.out_ann, [3, ['ETAP COMMAND: ' + INSTRUCTIONS[self.valueTDI]]]])
-						else:
-							stringsToPrint.append([self.startSampleShiftData, self.out_ann, [2, ['MTAP COMMAND: ' + INSTRUCTIONS[self.valueTDI]]]])
-						if (self.valueTDI == MTAP_SW_ETAP):
-							self.selectedTAP = ETAP
-						elif(self.valueTDI == MTAP_SW_MTAP):
-							self.selectedTAP = MTAP
-	
-						self.selectedRegister = self.valueTDI	# Save selected register
-					
-				
-				elif (self.selectedRegister == MTAP_COMMAND):
-					# Ok, this is an 8-bit Command DR thing (should be in the upper quadrant)
-					if (self.valueTDI in MTAP_COMMAND_DR):
-						stringsToPrint.append([self.startSampleShiftData, self.out_ann, [4, ['COMMAND_DR: ' + MTAP_COMMAND_DR[self.valueTDI]]]])	
-					else:
-						stringsToPrint.append([self.startSampleShiftData, self.out_ann, [4, ['COMMAND_DR: Unknown :( ' + str(hex(self.valueTDI))]]])
-				elif (self.clockCycles == 32):
-					# Just normal data
-					stringsToPrint.append([self.startSampleShiftData, self.out_ann, [5, ['Normal data transfer']]])
-				elif (self.selectedRegister == ETAP_FASTDATA):	# Could check for 33 bits
-					# FAST DATA
-					stringsToPrint.append([self.startSampleShiftData, self.out_ann,\
-					[5, ['Fast data transfer TDI: ' +  str(hex(self.valueTDI>>1))  + ' TDO: ' + str(hex(self.valueTDO>>1))\
-					+ ' PrAcc PIC: ' + str(hex(self.valueTDO & 0x01)) + ' PrAcc PROBE: ' + str(hex(self.valueTDI & 0x01))  ]]])	
-### End decoding
-				
-				if (0 == tms):
-					self.stateJTAG = JS_RunTestIdle
+			if (self.clockCycles == 5):
+				# Ok, this is a 5bit instruction
+				stringsToPrint.append([self.startSampleShiftData, self.out_python, [REC_IR, TAP_NAMES[self.selectedTAP], valueTDI]])
+				if (valueTDI not in INSTRUCTIONS):
+					stringsToPrint.append([self.startSampleShiftData, self.out_ann, [2, ['Unknown command: ' + str(hex(valueTDI))]]])					
 				else:
-					self.stateJTAG = JS_SelectDRScan
-			elif (JS_UpdateIR == self.stateJTAG):
-				stringsToPrint.append([self.startSampleUpdate, self.out_ann, [17, ['Update-IR']]])
-				stringsToPrint.append([self.startSampleShiftData, self.out_ann, [9, ['TMS ' + str(self.clockCycles) + 'b ' + str(hex(self.valueTMS))]]])
-				stringsToPrint.append([self.startSampleShiftData, self.out_ann, [10, ['TDI ' + str(self.clockCycles) + 'b ' + str(hex(self.valueTDI))]]])
-				stringsToPrint.append([self.startSampleShiftData, self.out_ann, [11, ['TDO ' + str(self.clockCycles) + 'b ' + str(hex(self.valueTDO))]]])
+					stringsToPrint.append([self.startSampleShiftData, self.out_ann, IR_ANNOTATIONS[self.selectedTAP][valueTDI]])
+					if (valueTDI == MTAP_SW_ETAP):
+						self.selectedTAP = ETAP
+					elif(valueTDI == MTAP_SW_MTAP):
+						self.selectedTAP = MTAP
 
-### Decoding
-				if (self.clockCycles == 5):
-					# Ok, this is a 5bit instruction
-					if (self.valueTDI not in INSTRUCTIONS):
-						stringsToPrint.append([self.startSampleShiftData, self.out_ann, [2, ['Unknown command: ' + str(hex(self.valueTDI))]]])					
-					else:
-						if (self.selectedTAP == ETAP):
-							stringsToPrint.append([self.startSampleShiftData, self.out_ann, [3, ['ETAP COMMAND: ' + INSTRUCTIONS[self.valueTDI]]]])
-						else:
-							stringsToPrint.append([self.startSampleShiftData, self.out_ann, [2, ['MTAP COMMAND: ' + INSTRUCTIONS[self.valueTDI]]]])
-						if (self.valueTDI == MTAP_SW_ETAP):
-							self.selectedTAP = ETAP
-						elif(self.valueTDI == MTAP_SW_MTAP):
-							self.selectedTAP = MTAP
-	
-						self.selectedRegister = self.valueTDI	# Save selected register
-					
+					self.selectedRegister = valueTDI	# Save selected register
 				
-				elif (self.selectedRegister == MTAP_COMMAND):
-					# Ok, this is an 8-bit Command DR thing (should be in the upper quadrant)
-					if (self.valueTDI in MTAP_COMMAND_DR):
-						stringsToPrint.append([self.startSampleShiftData, self.out_ann, [4, ['COMMAND_DR: ' + MTAP_COMMAND_DR[self.valueTDI]]]])	
-					else:
-						stringsToPrint.append([self.startSampleShiftData, self.out_ann, [4, ['COMMAND_DR: Unknown :( ' + str(hex(self.valueTDI))]]])
-				elif (self.selectedRegister == ETAP_FASTDATA):	# Could check for 33 bits
-					# FAST DATA
-					stringsToPrint.append([self.startSampleShiftData, self.out_ann,\
-							[5, ['Fast data transfer TDI: ' +  str(hex(self.valueTDI>>1))  + ' TDO: ' + str(hex(self.valueTDO>>1))\
-							+ ' PrAcc PIC: ' + str(hex(self.valueTDO & 0x01)) + 'PrAcc PROBE: ' + str(hex(self.valueTDI & 0x01))  ]]])	
-				#elif (self.clockCycles == 32):
+			
+			elif (self.selectedRegister == MTAP_COMMAND):
+				# Ok, this is an 8-bit Command DR thing (should be in the upper quadrant)
+				stringsToPrint.append([self.startSampleShiftData, self.out_python, [REC_COMMAND_DR, valueTDI, valueTDO]])
+				if (valueTDI in MTAP_COMMAND_DR):
+					stringsToPrint.append([self.startSampleShiftData, self.out_ann, COMMAND_DR_ANNOTATIONS[valueTDI]])	
 				else:
-					# Just normal data
-					stringsToPrint.append([self.startSampleShiftData, self.out_ann, [5, ['Normal data transfer TDI: ' +  str(hex(self.valueTDI))  + ' TDO: ' + str(hex(self.valueTDO)) ]]])
+					stringsToPrint.append([self.startSampleShiftData, self.out_ann, [4, ['COMMAND_DR: Unknown :( ' + str(hex(valueTDI))]]])
+			elif (self.selectedRegister == ETAP_FASTDATA):	# Could check for 33 bits
+				# FAST DATA
+				stringsToPrint.append([self.startSampleShiftData, self.out_python, [REC_FASTDATA, valueTDI>>1, valueTDO>>1, valueTDO & 0x01, valueTDI & 0x01]])
+				stringsToPrint.append([self.startSampleShiftData, self.out_ann,\
+				[5, ['Fast data transfer TDI: ' +  str(hex(valueTDI>>1))  + ' TDO: ' + str(hex(valueTDO>>1))\
+				+ ' PrAcc PIC: ' + str(hex(valueTDO & 0x01)) + ' PrAcc PROBE: ' + str(hex(valueTDI & 0x01))  ]]])	
+			elif (self.clockCycles == 32):
+				# Just normal data
+				stringsToPrint.append([self.startSampleShiftData, self.out_python, [REC_DATA, self.selectedRegister, valueTDI, valueTDO, self.clockCycles]])
+				stringsToPrint.append([self.startSampleShiftData, self.out_ann, [5, ['Normal data transfer']]])
 ### End decoding
 
-				if (0 == tms):
-					self.stateJTAG = JS_RunTestIdle
+		elif (JS_UpdateIR == state):
+			stringsToPrint = []
+			valueTDI, valueTDO, valueTMS = self.valueTDI, self.valueTDO, self.valueTMS
+			if (self.shiftWords):
+				valueTDI, valueTDO, valueTMS = joinShift(self.shiftWords, valueTDI, valueTDO, valueTMS, self.showBits)
+			if (self.showBits):
+				stringsToPrint.append([self.startSampleShiftData, self.out_ann, [9, ['TMS ' + str(self.clockCycles) + 'b ' + str(hex(valueTMS))]]])
+				stringsToPrint.append([self.startSampleShiftData, self.out_ann, [10, ['TDI ' + str(self.clockCycles) + 'b ' + str(hex(valueTDI))]]])
+				stringsToPrint.append([self.startSampleShiftData, self.out_ann, [11, ['TDO ' + str(self.clockCycles) + 'b ' + str(hex(valueTDO))]]])
+
+### Decoding
+			if (self.clockCycles == 5):
+				# Ok, this is a 5bit instruction
+				stringsToPrint.append([self.startSampleShiftData, self.out_python, [REC_IR, TAP_NAMES[self.selectedTAP], valueTDI]])
+				if (valueTDI not in INSTRUCTIONS):
+					stringsToPrint.append([self.startSampleShiftData, self.out_ann, [2, ['Unknown command: ' + str(hex(valueTDI))]]])					
 				else:
-					self.stateJTAG = JS_SelectDRScan
+					stringsToPrint.append([self.startSampleShiftData, self.out_ann, IR_ANNOTATIONS[self.selectedTAP][valueTDI]])
+					if (valueTDI == MTAP_SW_ETAP):
+						self.selectedTAP = ETAP
+					elif(valueTDI == MTAP_SW_MTAP):
+						self.selectedTAP = MTAP
 
-## Else, apocalypse
+					self.selectedRegister = valueTDI	# Save selected register
+				
+			
+			elif (self.selectedRegister == MTAP_COMMAND):
+				# Ok, this is an 8-bit Command DR thing (should be in the upper quadrant)
+				stringsToPrint.append([self.startSampleShiftData, self.out_python, [REC_COMMAND_DR, valueTDI, valueTDO]])
+				if (valueTDI in MTAP_COMMAND_DR):
+					stringsToPrint.append([self.startSampleShiftData, self.out_ann, COMMAND_DR_ANNOTATIONS[valueTDI]])	
+				else:
+					stringsToPrint.append([self.startSampleShiftData, self.out_ann, [4, ['COMMAND_DR: Unknown :( ' + str(hex(valueTDI))]]])
+			elif (self.selectedRegister == ETAP_FASTDATA):	# Could check for 33 bits
+				# FAST DATA
+				stringsToPrint.append([self.startSampleShiftData, self.out_python, [REC_FASTDATA, valueTDI>>1, valueTDO>>1, valueTDO & 0x01, valueTDI & 0x01]])
+				stringsToPrint.append([self.startSampleShiftData, self.out_ann,\
+						[5, ['Fast data transfer TDI: ' +  str(hex(valueTDI>>1))  + ' TDO: ' + str(hex(valueTDO>>1))\
+						+ ' PrAcc PIC: ' + str(hex(valueTDO & 0x01)) + 'PrAcc PROBE: ' + str(hex(valueTDI & 0x01))  ]]])	
+			#elif (self.clockCycles == 32):
 			else:
-				print("Unknown State")
-				while(1):
-					continue
+				# Just normal data
+				stringsToPrint.append([self.startSampleShiftData, self.out_python, [REC_DATA, self.selectedRegister, valueTDI, valueTDO, self.clockCycles]])
+				stringsToPrint.append([self.startSampleShiftData, self.out_ann, [5, ['Normal data transfer TDI: ' +  str(hex(valueTDI))  + ' TDO: ' + str(hex(valueTDO)) ]]])
+### End decoding
 
+		elif (JS_TestLogicReset == state):
+			self.selectedRegister = E_MTAP_IDCODE
 
+		if (JS_TestLogicReset == nextState and JS_TestLogicReset != state):
+			stringsToPrint = [[self.samplenum, self.out_python, RESET_TMS]]	# Only from Select-IR-Scan, nothing else to print
 
-			# Also trigger on the FALLING edge, to make nicer ouput (center the bit on the rising edge)
-			conds = []
-			conds.append({PIN_CLOCK: 'f'})
-			reset, tms, tck, tdi, tdo = self.wait(conds)
-			for x in stringsToPrint:
-				self.put(x[0], self.samplenum, x[1], x[2])
-
-			# Code duplication. Meh
-			if (JS_TestLogicReset == self.stateJTAG):
-				self.startSampleTLR = self.samplenum
-			elif (JS_RunTestIdle == self.stateJTAG):
-				self.startSampleRTI = self.samplenum
-			elif (JS_SelectDRScan == self.stateJTAG or JS_SelectIRScan == self.stateJTAG):
-				self.startSampleScan = self.samplenum
-			elif (JS_CaptureDR == self.stateJTAG or JS_CaptureIR == self.stateJTAG):
-				self.startSampleCapture = self.samplenum
-			elif (JS_ShiftDR == self.stateJTAG or JS_ShiftIR == self.stateJTAG):
-				self.startSampleShift = self.samplenum
-			elif (JS_Exit1DR == self.stateJTAG or JS_Exit1IR == self.stateJTAG or JS_Exit2DR == self.stateJTAG or JS_Exit2IR == self.stateJTAG):
-				self.startSampleExit = self.samplenum
-			elif (JS_PauseDR == self.stateJTAG or JS_PauseIR == self.stateJTAG):
-				self.startSamplePause = self.samplenum
-			elif (JS_UpdateDR == self.stateJTAG or JS_UpdateIR == self.stateJTAG):
-				self.startSampleUpdate = self.samplenum
+		self.stateJTAG = nextState
+		return stringsToPrint
+
+	def onClockFalling(self, stringsToPrint):
+		if (self.stateStart is not None):
+			self.put(self.stateStart, self.samplenum, self.out_ann, STATE_ANNOTATION[self.statePrevJTAG])
+			self.stateStart = None
+		for x in stringsToPrint:
+			self.put(x[0], self.samplenum, x[1], x[2])
+		if (not self.coalesceStates or self.stateJTAG != self.statePrevJTAG):
+			self.startSamples[STATE_SLOT[self.stateJTAG]] = self.samplenum
 
 ###############################################################################
 
@@ -0,0 +1,10 @@
+'''
+Headless tooling for the PIC32 ICSP & JTAG decoders
+
+Runs pic32_icsp and pic32_jtag outside of PulseView/sigrok-cli, straight
+from the sigrok session files (like the ones in "Test data").
+This folder is NOT a decoder, don't copy it to the decoders directory.
+
+Usage:
+python -m pic32_tools.decode "Test data/ICSP_PICKIT3_MZ_PROGYON" -P pic32_icsp:reset=1:clock=2:data=3
+'''
@@ -0,0 +1,162 @@
+'''
+Benchmarks - decodes the captures in "Test data", and reports how fast it went
+
+Every case runs in its own process, so the peak memory is that case's alone.
+Results are printed as a table (stderr), and as JSON (stdout, or -o file).
+With --baseline, the results are compared against a saved run, and the exit
+code is 1 if any case got slower (or bigger) than the tolerance allows:
+
+python3 -m pic32_tools.bench --engine numpy --write-baseline bench.json
+python3 -m pic32_tools.bench --engine numpy --baseline bench.json
+
+TAP clocks are counted from the JTAG state annotations (one per clock), so
+they are only there with the decoders' default options.
+'''
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from . import decode, srd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_DATA = os.path.join(ROOT, 'Test data')
+
+# name: (capture in Test data, decoder spec)
+CASES = {
+	'icsp-mplab':	('ICSP_PICKIT3_MZ_MPLAB', 'pic32_icsp:reset=1:clock=2:data=3'),
+	'icsp-progyon':	('ICSP_PICKIT3_MZ_PROGYON', 'pic32_icsp:reset=1:clock=2:data=3'),
+	'jtag-progyon':	('JTAG_NFXX_MZ_PROGYON', 'pic32_jtag:reset=1:tck=2:tms=3:tdi=4:tdo=5'),
+}
+
+STATE_ANNOTATIONS = (14, 15, 16, 17)	# js-tlr, js-rti, js-DR, js-IR - one per TAP clock
+
+# Compared against the baseline: key -> True if bigger is better
+CHECKED = {'samplesPerSecond': True, 'peakMemoryKiB': False}
+
+
+class Counter:
+	'''Listener that only counts.'''
+
+	def __init__(self):
+		self.annotations = 0
+		self.clocks = 0
+
+	def __call__(self, outputType, startsample, endsample, data):
+		if (outputType == srd.OUTPUT_ANN):
+			self.annotations += 1
+			if (data[0] in STATE_ANNOTATIONS):
+				self.clocks += 1
+
+
+def runCase(name, engine, maxSamples=None):
+	# In this process. Returns the result dict.
+	capture, spec = CASES[name]
+	path = os.path.join(TEST_DATA, capture)
+	with decode.Session(path) as session:
+		samples = session.numSamples()
+	if (maxSamples is not None):
+		samples = min(samples, maxSamples)
+	counter = Counter()
+	start = time.perf_counter()
+	decode.runSession(path, spec, [counter], maxSamples, engine=engine)
+	seconds = time.perf_counter() - start
+	return {
+		'case': name,
+		'engine': engine,
+		'samples': samples,
+		'seconds': seconds,
+		'samplesPerSecond': samples / seconds,
+		'clocksPerSecond': counter.clocks / seconds,
+		'annotationsPerSecond': counter.annotations / seconds,
+		'clocks': counter.clocks,
+		'annotations': counter.annotations,
+		'peakMemoryKiB': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,	# KiB on Linux
+	}
+
+
+def runIsolated(name, engine, maxSamples=None):
+	# In a new process, for a clean peak memory
+	command = [sys.executable, '-m', 'pic32_tools.bench', '--one', name, '--engine', engine]
+	if (maxSamples is not None):
+		command += ['--samples', str(maxSamples)]
+	output = subprocess.run(command, cwd=ROOT, check=True, stdout=subprocess.PIPE).stdout
+	return json.loads(output)
+
+
+def compare(results, baseline, tolerance):
+	'''Returns a list of regressions, as strings.'''
+	old = {(x['case'], x['engine']): x for x in baseline}
+	problems = []
+	for result in results:
+		reference = old.get((result['case'], result['engine']))
+		if (reference is None):
+			continue
+		for key, biggerIsBetter in CHECKED.items():
+			if (biggerIsBetter):
+				limit = reference[key] * (1 - tolerance)
+				bad = result[key] < limit
+			else:
+				limit = reference[key] * (1 + tolerance)
+				bad = result[key] > limit
+			if (bad):
+				problems.append('%s (%s): %s %.0f, limit %.0f (baseline %.0f)' % (result['case'], result['engine'],
+					key, result[key], limit, reference[key]))
+	return problems
+
+
+def printTable(results, stream=sys.stderr):
+	stream.write('%-14s %-6s %10s %14s %12s %14s %10s\n' % ('case', 'engine', 'seconds', 'samples/s', 'clocks/s', 'annotations/s', 'peak KiB'))
+	for x in results:
+		stream.write('%-14s %-6s %10.2f %14.0f %12.0f %14.0f %10d\n' % (x['case'], x['engine'], x['seconds'],
+			x['samplesPerSecond'], x['clocksPerSecond'], x['annotationsPerSecond'], x['peakMemoryKiB']))
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Benchmark the PIC32 decoders on the bundled test captures')
+	parser.add_argument('cases', nargs='*', help='cases to run (default: all): ' + ', '.join(CASES))
+	parser.add_argument('--engine', choices=('wait', 'numpy'), default='wait')
+	parser.add_argument('--samples', type=int, help='only decode this many samples of each capture')
+	parser.add_argument('-o', '--output', help='write the JSON results here instead of stdout')
+	parser.add_argument('--baseline', help='JSON results of an earlier run, fail if slower than that')
+	parser.add_argument('--tolerance', type=float, default=0.2, help='allowed regression against the baseline (default 0.2 = 20%%)')
+	parser.add_argument('--write-baseline', help='save the results as the new baseline')
+	parser.add_argument('--one', help=argparse.SUPPRESS)	# Child process: run one case, print its JSON
+	args = parser.parse_args(argv)
+
+	if (args.one):
+		json.dump(runCase(args.one, args.engine, args.samples), sys.stdout)
+		return 0
+
+	for name in args.cases:
+		if (name not in CASES):
+			parser.error('Unknown case: ' + name)
+	results = [runIsolated(x, args.engine, args.samples) for x in (args.cases or CASES)]
+	printTable(results)
+
+	text = json.dumps(results, indent=1)
+	if (args.output):
+		with open(args.output, 'w') as out:
+			out.write(text + '\n')
+	else:
+		sys.stdout.write(text + '\n')
+	if (args.write_baseline):
+		with open(args.write_baseline, 'w') as out:
+			out.write(text + '\n')
+
+	if (args.baseline):
+		with open(args.baseline) as stream:
+			problems = compare(results, json.load(stream), args.tolerance)
+		for problem in problems:
+			sys.stderr.write('REGRESSION: ' + problem + '\n')
+		if (problems):
+			return 1
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
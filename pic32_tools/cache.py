@@ -0,0 +1,148 @@
+'''
+Edge index cache - the pin changes of a capture, kept on disk between decodes
+
+The numpy engines only look at the samples where some decoder pin changed (see
+edges.py): the clock edges, and the data pins picked up at them. Finding those
+means unpacking every sample of the capture, every time. The first decode with
+the cache on keeps the changes (sample numbers + pins from there on) and saves
+them, and later decodes of the same capture with the same channel mapping are
+fed from that file, without opening the sample data at all.
+
+Files are keyed by the session file's path, size and modification time, and
+the capture bits of the decoder channels, so an edited capture or a different
+mapping doesn't pick up a stale index - without reading the capture to find out.
+The index also keeps a SHA-256 of the session file (taken once, when it's saved).
+verifyIndex() checks it against the file, for when the mtime can't be trusted
+(copied with it kept, edited in place by something that restores it); --verify.
+Only a run that saw the whole capture saves one; any part of it (--samples,
+parallel segments) can be served from it after that.
+'''
+
+import hashlib
+import os
+
+import numpy as np
+
+from .edges import ChangeStream
+
+DEFAULT_DIRECTORY = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'pic32_tools')
+FORMAT = 2				# Bump when the file contents change
+BLOCK_CHANGES = 1024*1024	# Changes handed to the engine at once
+
+
+def captureHash(path):
+	digest = hashlib.sha256()
+	with open(path, 'rb') as stream:
+		for data in iter(lambda: stream.read(1024*1024), b''):
+			digest.update(data)
+	return digest.hexdigest()
+
+
+def captureKey(path):
+	# Cheap stand-in for captureHash(), from the file's metadata
+	info = os.stat(path)
+	key = '%s\0%d\0%d' % (os.path.realpath(path), info.st_size, info.st_mtime_ns)
+	return hashlib.sha256(key.encode('utf-8', 'surrogateescape')).hexdigest()
+
+
+def indexPath(directory, key, bits):
+	return os.path.join(directory, 'edges-%d-%s-%s.npz' % (FORMAT, key[:32], '-'.join(str(x) for x in bits)))
+
+
+class ChangeIndex:
+	'''All pin changes of a capture: sample numbers, pins from there on, pins at sample 0, length, and the capture's captureHash().'''
+
+	def __init__(self, samples, values, initial, numSamples, digest=''):
+		self.samples = samples
+		self.values = values
+		self.initial = initial
+		self.numSamples = numSamples
+		self.digest = digest
+
+	@classmethod
+	def load(cls, path):
+		with np.load(path) as data:
+			samples = np.cumsum(data['gaps'], dtype=np.int64)	# Stored as the gaps between changes, packs better
+			return cls(samples, data['values'], int(data['initial']), int(data['numSamples']), str(data['digest']))
+
+	@staticmethod
+	def loadDigest(path):
+		with np.load(path) as data:
+			return str(data['digest'])
+
+	def save(self, path):
+		gaps = np.diff(self.samples, prepend=0)
+		gaps = gaps.astype(np.uint32) if (len(gaps) == 0 or gaps.max() < 1 << 32) else gaps
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		temporary = path + '.tmp.npz'
+		np.savez_compressed(temporary, gaps=gaps, values=self.values, initial=self.initial, numSamples=self.numSamples, digest=self.digest)
+		os.replace(temporary, path)		# Never a half written index under the real name
+
+	def stream(self, maxSamples=None, startSample=0):
+		'''Changes of samples [startSample, startSample + maxSamples), numbered from startSample, as a ChangeStream would give them.'''
+		end = self.numSamples if maxSamples is None else min(self.numSamples, startSample + maxSamples)
+		first, last = np.searchsorted(self.samples, (startSample, end))
+		initial = self.initial
+		if (first):
+			initial = int(self.values[first - 1])
+		if (first < len(self.samples) and self.samples[first] == startSample):
+			initial = int(self.values[first])	# A change right at the start isn't one, in this stream
+			first += 1
+		return IndexedChanges(self.samples[first:last] - startSample, self.values[first:last], initial, max(0, end - startSample))
+
+
+class IndexedChanges:
+	'''Drop-in for ChangeStream, served from a ChangeIndex.'''
+
+	def __init__(self, samples, values, initial, numSamples):
+		self.samples = samples
+		self.values = values
+		self.initial = initial
+		self.numSamples = numSamples
+
+	def __iter__(self):
+		for start in range(0, len(self.samples), BLOCK_CHANGES):
+			yield self.samples[start:start+BLOCK_CHANGES], self.values[start:start+BLOCK_CHANGES]
+
+
+class RecordingChanges(ChangeStream):
+	'''ChangeStream that also keeps everything it gave out, and saves it as an index at the end.'''
+
+	def __init__(self, blocks, unitsize, bits, path, capture):
+		ChangeStream.__init__(self, blocks, unitsize, bits)
+		self.path = path
+		self.capture = capture		# Session file, hashed into the index
+
+	def __iter__(self):
+		samples = []
+		values = []
+		for block in ChangeStream.__iter__(self):
+			samples.append(block[0])
+			values.append(block[1])
+			yield block
+		if (self.initial is not None):
+			ChangeIndex(np.concatenate(samples or [np.zeros(0, np.int64)]), np.concatenate(values or [np.zeros(0, np.uint8)]),
+				self.initial, self.numSamples, captureHash(self.capture)).save(self.path)
+
+
+def changeSource(path, session, bits, maxSamples=None, startSample=0, directory=DEFAULT_DIRECTORY):
+	'''Pin changes of the capture, from the index if there is one. Otherwise from the samples, saving the index if it's the whole capture.'''
+	cached = indexPath(directory, captureKey(path), bits)
+	if (os.path.exists(cached)):
+		return ChangeIndex.load(cached).stream(maxSamples, startSample)
+	blocks = session.blocks(maxSamples, startSample)
+	if (startSample == 0 and (maxSamples is None or maxSamples >= session.numSamples())):
+		return RecordingChanges(blocks, session.unitsize, bits, cached, path)
+	return ChangeStream(blocks, session.unitsize, bits)
+
+
+def verifyIndex(path, bits, directory=DEFAULT_DIRECTORY):
+	'''Hashes the whole capture and checks the index against it. A stale one is removed (the next run saves it again).
+	Returns True if there is an index and it's good.'''
+	cached = indexPath(directory, captureKey(path), bits)
+	if (not os.path.exists(cached)):
+		return False
+	if (ChangeIndex.loadDigest(cached) == captureHash(path)):
+		return True
+	os.remove(cached)
+	return False
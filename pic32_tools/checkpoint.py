@@ -0,0 +1,159 @@
+'''
+Checkpoints - the decoder's state every so often, to start a decode halfway through
+
+Normally everything the decoders know (JTAG state, selected TAP & register,
+ICSP entry, the bits shifted in so far...) only lives in the running decoder,
+so looking at the end of a capture means decoding all of it. With a checkpoint
+file, a full decode saves that state (the attributes in the decoder's
+checkpointState, plus the numpy engine's own bits) every INTERVAL samples, and
+a later decode starts at the last checkpoint before the wanted start sample.
+The output from there on is the same as from the full decode.
+
+A file is one JSON object per line: a header (decoder spec, interval), then the
+checkpoints in sample order. Checkpoints are only taken between blocks of pin
+changes, with the whole block in the state, so the spacing isn't exact.
+Resuming also appends new checkpoints past the last one - for a capture that
+got longer since, decode from the end of the file's last checkpoint on.
+
+Needs the numpy engine: decode() keeps where it is in the 4-phase ICSP frame in
+its own loop, that can't be saved.
+
+python -m pic32_tools.decode capture -P pic32_icsp:... --checkpoints capture.ckpt
+python -m pic32_tools.decode capture -P pic32_icsp:... --checkpoints capture.ckpt --start 300000000
+'''
+
+import copy
+import json
+
+from . import decode
+from .session import Session
+
+DEFAULT_INTERVAL = 16*1024*1024		# Samples between checkpoints
+
+
+class Checkpoint:
+	'''State after a sample: the decoder's checkpointState, and the engine's part.'''
+
+	def __init__(self, sample, decoder, engine):
+		self.sample = sample
+		self.decoder = decoder
+		self.engine = engine
+
+	def toJson(self):
+		return json.dumps({'sample': self.sample, 'decoder': self.decoder, 'engine': self.engine})
+
+	@classmethod
+	def fromJson(cls, text):
+		data = json.loads(text)
+		return cls(data['sample'], data['decoder'], data['engine'])
+
+	def restore(self, decoder):
+		# Into a freshly started decoder. Returns the engine's part.
+		for name, value in copy.deepcopy(self.decoder).items():
+			setattr(decoder, name, value)
+		decoder.samplenum = self.sample
+		return copy.deepcopy(self.engine)
+
+
+class CheckpointWriter:
+	'''Takes a checkpoint whenever the engine offers one past .next, and writes it out.'''
+
+	def __init__(self, stream, interval=DEFAULT_INTERVAL, after=0):
+		self.stream = stream
+		self.interval = interval
+		self.next = after + interval	# Sample from which the next checkpoint is taken
+		self.decoder = None
+		self.count = 0
+
+	def attach(self, decoder):
+		self.decoder = decoder
+
+	def take(self, sample, engineState):
+		decoder = self.decoder
+		state = dict((name, getattr(decoder, name)) for name in decoder.checkpointState if hasattr(decoder, name))
+		self.writeLine(Checkpoint(sample, state, engineState).toJson())
+		self.count += 1
+		self.next = sample + self.interval
+
+	def writeLine(self, text):
+		self.stream.write(text + '\n')
+		self.stream.flush()		# A file that's being written can already be resumed from
+
+
+def loadCheckpoints(path):
+	'''Returns (header, [Checkpoint]).'''
+	with open(path) as stream:
+		header = json.loads(stream.readline())
+		return header, [Checkpoint.fromJson(x) for x in stream if x.strip()]
+
+
+def nearest(checkpoints, sample):
+	# Last checkpoint before sample, None if there's none. Not at it - what was put() at that sample is in the past already.
+	found = None
+	for checkpoint in checkpoints:
+		if (checkpoint.sample >= sample):
+			break
+		found = checkpoint
+	return found
+
+
+class ShiftedChanges:
+	'''Pin changes numbered from offset on, so the decoder sees the capture's sample numbers.'''
+
+	def __init__(self, changes, offset):
+		self.changes = changes
+		self.offset = offset
+
+	@property
+	def initial(self):
+		return self.changes.initial
+
+	def __iter__(self):
+		for samples, values in self.changes:
+			yield samples + self.offset, values
+
+
+def recordSession(path, spec, checkpointPath, listeners, interval=DEFAULT_INTERVAL, maxSamples=None, cache=None):
+	'''Full decode (numpy engine), saving checkpoints. Returns how many were taken.'''
+	with open(checkpointPath, 'w') as stream:
+		writer = CheckpointWriter(stream, interval)
+		writer.writeLine(json.dumps({'decoder': spec, 'interval': interval}))
+		runWindow(path, spec, listeners, maxSamples, cache, None, writer)
+	return writer.count
+
+
+def resumeSession(path, spec, checkpointPath, listeners, startSample, maxSamples=None, cache=None):
+	'''Decodes samples [startSample, startSample + maxSamples) from the nearest checkpoint.
+	Outputs ending before startSample are dropped. New checkpoints past the file's last one are appended.'''
+	header, checkpoints = loadCheckpoints(checkpointPath)
+	if (header['decoder'] != spec):
+		raise ValueError(checkpointPath + ' was made with ' + header['decoder'] + ', not ' + spec)
+	checkpoint = nearest(checkpoints, startSample)
+	def window(outputType, startsample, endsample, data):
+		if (endsample >= startSample):
+			for listener in listeners:
+				listener(outputType, startsample, endsample, data)
+	last = checkpoints[-1].sample if checkpoints else 0
+	with open(checkpointPath, 'a') as stream:
+		writer = CheckpointWriter(stream, header['interval'], last)
+		end = None if maxSamples is None else startSample + maxSamples
+		runWindow(path, spec, [window], end, cache, checkpoint, writer)
+	return checkpoint
+
+
+def runWindow(path, spec, listeners, endSample, cache, checkpoint, writer):
+	# Decodes from the checkpoint (or from 0) up to endSample
+	decoderId, decoderClass, channels, options = decode.parseDecoderSpec(spec)
+	first = 0 if checkpoint is None else checkpoint.sample
+	count = None if endSample is None else max(0, endSample - first)
+	with Session(path) as session:
+		bits = decode.channelBits(decoderClass, session, channels)
+		changes = decode.changeSource(path, session, bits, count, first, cache)
+		if (changes is None):
+			from .edges import ChangeStream
+			changes = ChangeStream(session.blocks(count, first), session.unitsize, bits)
+		run = decode.DecodeRun(decoderClass, None, session.unitsize, bits, session.samplerate, options, listeners,
+			ShiftedChanges(changes, first))
+		run.checkpoints = writer
+		run.resume = checkpoint
+		return run.run('numpy')
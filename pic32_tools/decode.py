@@ -0,0 +1,311 @@
+'''
+Headless decode driver - runs a decoder over a sigrok session, without a GUI
+
+The decoder gets the srd.py stand-in as its "sigrokdecode" module, and the samples
+are streamed from the session file block by block. Output goes straight to the
+listeners (by default printed, like sigrok-cli does), nothing is collected.
+
+python -m pic32_tools.decode "Test data/JTAG_NFXX_MZ_PROGYON" -P pic32_jtag:reset=1:tck=2:tms=3:tdi=4:tdo=5
+'''
+
+import argparse
+import importlib
+import os
+import stat
+import sys
+
+from . import srd
+
+# Decoders do "import sigrokdecode as srd", so this has to be in place first.
+sys.modules['sigrokdecode'] = srd
+# Decoders live next to this folder, same as they would in the decoders directory.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from .session import Session
+
+
+def loadDecoder(decoderId):
+	return importlib.import_module(decoderId).Decoder
+
+
+def parseDecoderSpec(spec, decoderClass=None):
+	# "pic32_icsp:reset=1:clock=2:opt=x", same as sigrok-cli -P
+	parts = spec.split(':')
+	decoderId = parts[0]
+	if (decoderClass is None):
+		decoderClass = loadDecoder(decoderId)
+	channelIds = [x['id'] for x in decoderClass.channels]
+	optionIds = [x['id'] for x in decoderClass.options]
+	channels = {}
+	options = {}
+	for part in parts[1:]:
+		key, sep, value = part.partition('=')
+		if (not sep):
+			raise ValueError('Expected key=value, got ' + part)
+		if (key in channelIds):
+			channels[key] = value
+		elif (key in optionIds):
+			options[key] = value
+		else:
+			raise ValueError(decoderId + ' has no channel or option ' + key)
+	return decoderId, decoderClass, channels, options
+
+
+def convertOptions(decoderClass, options):
+	# Options from the command line are strings, convert to the type of the default.
+	result = {}
+	for option in decoderClass.options:
+		value = options.get(option['id'], option['default'])
+		if (isinstance(option['default'], int) and not isinstance(value, int)):
+			value = int(value, 0)
+		elif (isinstance(option['default'], float) and not isinstance(value, float)):
+			value = float(value)
+		if ('values' in option and value not in option['values']):
+			raise ValueError('Option ' + option['id'] + ' must be one of ' + str(option['values']))
+		result[option['id']] = value
+	return result
+
+
+def changedOptions(decoderClass, options, ids):
+	# Which of ids options sets to something other than the default, for tools that need the plain output
+	values = convertOptions(decoderClass, options)
+	return [x['id'] + '=' + str(values[x['id']]) for x in decoderClass.options if x['id'] in ids and values[x['id']] != x['default']]
+
+
+def channelBits(decoderClass, session, channels):
+	# Decoder channel N -> bit of the capture. Unmapped channels look for a probe with the same name.
+	bits = []
+	for channel in decoderClass.channels:
+		probe = channels.get(channel['id'])
+		if (probe is None):
+			for name in (channel['id'], channel['name']):
+				if (name in session.probes):
+					probe = name
+					break
+		if (probe is None):
+			raise ValueError('Channel ' + channel['id'] + ' is not mapped to a probe')
+		bits.append(session.probeBit(probe))
+	return bits
+
+
+class AnnotationPrinter:
+	'''Prints annotations, like sigrok-cli -A does.'''
+
+	def __init__(self, decoderClass, stream=sys.stdout):
+		self.prefix = decoderClass.id + '-1: '
+		self.names = [x[0] for x in decoderClass.annotations]
+		self.stream = stream
+
+	def __call__(self, outputType, startsample, endsample, data):
+		if (outputType == srd.OUTPUT_ANN):
+			self.stream.write('%d-%d %s%s: "%s"\n' % (startsample, endsample, self.prefix, self.names[data[0]], data[1][0]))
+
+
+class MetaPrinter:
+	'''Prints OUTPUT_META values (e.g. the decoders' profile option), one "name: value" per line.'''
+
+	def __init__(self, stream=sys.stderr):
+		self.stream = stream
+
+	def __call__(self, outputType, startsample, endsample, data):
+		if (outputType == srd.OUTPUT_META):
+			name, value = data
+			self.stream.write('%s: %s\n' % (name, ('%.3f' % value) if isinstance(value, float) else value))
+
+
+class DecodeRun:
+	'''One decoder instance, fed from a block source. Does what libsigrokdecode would.'''
+
+	def __init__(self, decoderClass, blocks, unitsize, bits, samplerate=0, options=None, listeners=(), changes=None):
+		self.decoderClass = decoderClass
+		self.blocks = blocks
+		self.changes = changes	# Pin changes from somewhere else (cache.py), for the numpy engine
+		self.checkpoints = None	# CheckpointWriter to save checkpoints to (numpy engine)
+		self.resume = None		# Checkpoint to start from instead of sample 0 (numpy engine)
+		self.unitsize = unitsize
+		self.bits = bits
+		self.feed = None	# Only made for wait()
+		self.samplerate = samplerate
+		self.options = convertOptions(decoderClass, options or {})
+		self.listeners = list(listeners)
+		self.outputs = []	# output id -> (output type, meta)
+
+	def register(self, decoder, outputType, meta):
+		for outputId, output in enumerate(self.outputs):
+			if (output == (outputType, meta)):
+				return outputId
+		self.outputs.append((outputType, meta))
+		return len(self.outputs) - 1
+
+	def put(self, decoder, startsample, endsample, outputId, data):
+		outputType, meta = self.outputs[outputId]
+		if (outputType == srd.OUTPUT_META):
+			data = (meta[1], data)	# Listeners get the name too, it's only in the registration
+		for listener in self.listeners:
+			listener(outputType, startsample, endsample, data)
+
+	def createDecoder(self):
+		decoder = self.decoderClass()
+		decoder._srd = self
+		decoder.samplenum = 0
+		decoder.matched = None
+		decoder.options = dict(self.options)
+		if (self.samplerate and hasattr(decoder, 'metadata')):
+			decoder.metadata(srd.SRD_CONF_SAMPLERATE, self.samplerate)
+		decoder.start()
+		return decoder
+
+	def run(self, engine='wait'):
+		if (engine == 'wait' and self.changes is not None):
+			raise ValueError('The wait engine needs the samples, not the pin changes - use the numpy engine')
+		if (engine == 'wait' and (self.checkpoints is not None or self.resume is not None)):
+			raise ValueError('Checkpoints need the numpy engine, decode() keeps part of its state in the loop')
+		if (self.options.get('polls') == 'collapse' and (self.checkpoints is not None or self.resume is not None)):
+			raise ValueError('polls=collapse holds back output, that isn\'t in the checkpoints')
+		if (engine == 'wait'):
+			self.feed = srd.PinFeed(self.blocks, self.unitsize, self.bits)
+			self.decoder = self.createDecoder()
+			try:
+				self.decoder.decode()
+			except EOFError:
+				pass	# Out of samples, that's the normal way out
+		elif (engine == 'numpy'):
+			from .edges import ChangeStream
+			from .engines import ENGINES
+			if (self.decoderClass.id not in ENGINES):
+				raise ValueError('No numpy engine for ' + self.decoderClass.id)
+			self.decoder = self.createDecoder()
+			changes = self.changes if self.changes is not None else ChangeStream(self.blocks, self.unitsize, self.bits)
+			batch = ENGINES[self.decoderClass.id](self.decoder)
+			if (self.checkpoints is not None):
+				self.checkpoints.attach(self.decoder)
+				batch.checkpoints = self.checkpoints
+			batch.run(changes, None if self.resume is None else self.resume.restore(self.decoder))
+			if (getattr(self.decoder, 'polls', None) is not None):
+				self.decoder.polls.flush()		# No EOFError from wait() here
+			if (getattr(self.decoder, 'profiler', None) is not None):
+				self.decoder.profiler.report()
+		else:
+			raise ValueError('Unknown engine: ' + engine)
+		return self.decoder
+
+
+def openSession(path, mapped=False):
+	# mapped: stored chunks through mmap, see mapped.py
+	if (mapped):
+		from .mapped import MappedSession
+		return MappedSession(path)
+	return Session(path)
+
+
+def changeSource(path, session, bits, maxSamples=None, startSample=0, cache=None):
+	# Pin changes from the edge index cache (cache: its directory, or True for the default one), None without
+	if (not cache):
+		return None
+	from . import cache as edgeCache
+	directory = edgeCache.DEFAULT_DIRECTORY if cache is True else cache
+	return edgeCache.changeSource(path, session, bits, maxSamples, startSample, directory)
+
+
+def verifyCache(path, spec, cache):
+	# Checks the capture's edge index against a full hash of the session file, drops it if it's stale
+	from . import cache as edgeCache
+	decoderId, decoderClass, channels, options = parseDecoderSpec(spec)
+	with Session(path) as session:
+		bits = channelBits(decoderClass, session, channels)
+	return edgeCache.verifyIndex(path, bits, edgeCache.DEFAULT_DIRECTORY if cache is True else cache)
+
+
+def runSession(path, spec, listeners=None, maxSamples=None, blockSize=None, engine='wait', mapped=False, cache=None):
+	decoderId, decoderClass, channels, options = parseDecoderSpec(spec)
+	with openSession(path, mapped) as session:
+		if (blockSize):
+			session.blockSize = blockSize
+		if (listeners is None):
+			listeners = [AnnotationPrinter(decoderClass)]
+		bits = channelBits(decoderClass, session, channels)
+		run = DecodeRun(decoderClass, session.blocks(maxSamples), session.unitsize, bits, session.samplerate, options, listeners,
+			changeSource(path, session, bits, maxSamples, cache=cache))
+		return run.run(engine)
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Run a PIC32 decoder over a sigrok session file')
+	parser.add_argument('session', help='sigrok session (.sr) file, or raw samples: - for stdin, a FIFO, or any file with --raw')
+	parser.add_argument('-P', '--decoder', required=True, help='decoder:channel=probe:option=value, as with sigrok-cli')
+	parser.add_argument('-o', '--output', help='write annotations here instead of stdout')
+	parser.add_argument('--samples', type=int, help='only decode this many samples')
+	parser.add_argument('--engine', choices=('wait', 'numpy'),
+		help='wait: run decode() as is, numpy: find the clock edges with numpy first (needs numpy). Default: wait, numpy with --cache')
+	parser.add_argument('-j', '--jobs', type=int, default=1,
+		help='decode in this many processes, split at resets (0: all cores, needs numpy, see parallel.py for the catches)')
+	parser.add_argument('--mmap', action='store_true', help='map uncompressed (stored) chunks instead of reading them, deflated ones are still streamed')
+	parser.add_argument('--cache', nargs='?', const=True, metavar='DIR',
+		help='keep the pin changes of the capture on disk (default: ~/.cache/pic32_tools), later decodes skip the samples. numpy engine only')
+	parser.add_argument('--verify', action='store_true',
+		help='with --cache: check the index against a hash of the whole session file first (it\'s found by path, size & mtime)')
+	parser.add_argument('--checkpoints', metavar='FILE', help='save the decoder state every so often (numpy engine), or with --start, start from there')
+	parser.add_argument('--checkpoint-interval', type=int, default=16*1024*1024, help='samples between checkpoints (default 16M)')
+	parser.add_argument('--start', type=int, help='decode from this sample on (from the nearest checkpoint before it), --samples counts from here')
+	parser.add_argument('--raw', action='store_true', help='the input is raw samples (sigrok-cli -O binary), decoded as they come in, see live.py')
+	parser.add_argument('--unitsize', type=int, default=1, help='raw input: bytes per sample (default 1)')
+	parser.add_argument('--samplerate', help='raw input: samplerate, e.g. 16MHz (there is no metadata)')
+	parser.add_argument('--image', help='rebuild the flash written through the PE, save as Intel HEX (.hex) or binary (one file per region)')
+	parser.add_argument('--row-words', type=int, default=512, help='ROW_PROGRAM row size in words, if the command has none (MZ: 512, MX: 128)')
+	args = parser.parse_args(argv)
+	if (args.cache and args.engine == 'wait'):
+		parser.error('--cache only works with the numpy engine')
+	if (args.verify and not args.cache):
+		parser.error('--verify needs --cache')
+	if (args.checkpoints and (args.engine == 'wait' or args.jobs != 1)):
+		parser.error('--checkpoints only works with the numpy engine, in one process')
+	if (args.start is not None and not args.checkpoints):
+		parser.error('--start needs --checkpoints')
+	engine = args.engine or ('numpy' if (args.cache or args.checkpoints) else 'wait')
+	live = args.raw or args.session == '-' or stat.S_ISFIFO(os.stat(args.session).st_mode)
+	if (live and (args.cache or args.checkpoints or args.mmap or args.jobs != 1 or args.samples is not None)):
+		parser.error('Raw input is decoded as it comes, without --cache, --checkpoints, --mmap, -j or --samples')
+
+	decoderClass = loadDecoder(args.decoder.split(':')[0])
+	stream = open(args.output, 'w') if args.output else sys.stdout
+	listeners = [AnnotationPrinter(decoderClass, stream), MetaPrinter()]
+	if (args.image):
+		from .image import ImageBuilder
+		builder = ImageBuilder(args.row_words)
+		listeners.append(builder)
+	if (args.verify):
+		verifyCache(args.session, args.decoder, args.cache)
+	try:
+		if (live):
+			from . import live as liveDecode
+			source = liveDecode.openStream(args.session, args.unitsize, args.samplerate)
+			source.beforeRead.append(stream.flush)
+			liveDecode.runStream(source, args.decoder, listeners, engine)
+		elif (args.checkpoints):
+			from . import checkpoint
+			if (args.start is None):
+				count = checkpoint.recordSession(args.session, args.decoder, args.checkpoints, listeners,
+					args.checkpoint_interval, args.samples, args.cache)
+				sys.stderr.write('%d checkpoints saved to %s\n' % (count, args.checkpoints))
+			else:
+				found = checkpoint.resumeSession(args.session, args.decoder, args.checkpoints, listeners, args.start, args.samples, args.cache)
+				sys.stderr.write('Started from sample %d\n' % (0 if found is None else found.sample))
+		elif (args.jobs == 1):
+			runSession(args.session, args.decoder, listeners, args.samples, engine=engine, mapped=args.mmap, cache=args.cache)
+		else:
+			from .parallel import runParallel
+			try:
+				runParallel(args.session, args.decoder, listeners, args.jobs, args.samples, engine, args.mmap, args.cache)
+			except ValueError as error:
+				parser.error(str(error))
+	finally:
+		if (args.output):
+			stream.close()
+	if (args.image):
+		from .image import saveImage
+		for name in saveImage(builder.image, args.image):
+			sys.stderr.write('Wrote ' + name + '\n')
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,360 @@
+'''
+Transaction diff - where two captures of a programming run differ, and what it costs
+
+Both captures are decoded to their transaction records (OUTPUT_PYTHON, see
+pic32_common/records.py): resets, ICSP entry, IR selects, MTAP COMMAND_DR
+values, DATA and FASTDATA words. By default only what the programmer sends is
+compared (TDI); --tdo compares what the chip answered too.
+
+The two record streams are lined up with a patience diff: records that occur
+exactly once in both halves of a region are anchors, the longest run of anchors
+in the same order is kept, and the gaps between them are diffed the same way.
+Regions with no anchors left go to difflib. That stays close to O(n log n) on
+the long, repetitive streams a programmer makes (millions of records), where a
+plain LCS would be hopeless.
+
+Every run that differs is reported with its record & sample ranges on both
+sides, and its cost: TAP clocks spent on it (counted from the JTAG state
+annotations, one per clock) and time. The decoders need their default options
+for that - no coalesce, full verbosity, polls shown - a spec that sets any of
+those otherwise is refused.
+
+python3 -m pic32_tools.diff icsp-mplab icsp-progyon
+python3 -m pic32_tools.diff ours.sr theirs.sr -P pic32_icsp:reset=1:clock=2:data=3
+'''
+
+import argparse
+import array
+import bisect
+import collections
+import difflib
+import json
+import os
+import sys
+
+from . import decode, srd
+from .bench import CASES, TEST_DATA
+from pic32_common.records import *
+
+STATE_ANNOTATIONS = (14, 15, 16, 17)	# One per TAP clock
+# These change the state annotations, the clocks would be wrong: coalesce merges clocks, verbosity drops the row,
+# polls=collapse drops them for all but the first poll
+UNSUPPORTED_OPTIONS = ('coalesce', 'verbosity', 'polls')
+DIFFLIB_LIMIT = 4*1000*1000		# Anchorless regions up to this many a x b cells go to difflib without junk heuristics
+
+
+class Interner:
+	'''Record key -> small int, shared by both captures so equal records get equal numbers.'''
+
+	def __init__(self):
+		self.numbers = {}
+		self.keys = []
+
+	def __call__(self, key):
+		number = self.numbers.get(key)
+		if (number is None):
+			number = self.numbers[key] = len(self.keys)
+			self.keys.append(key)
+		return number
+
+
+def recordKey(data, withTdo):
+	# What's compared of a record
+	kind = data[0]
+	if (kind == REC_COMMAND_DR):
+		return (kind, data[1], data[2]) if withTdo else (kind, data[1])
+	if (kind == REC_DATA):
+		return (kind, data[1], data[2], data[4], data[3]) if withTdo else (kind, data[1], data[2], data[4])
+	if (kind == REC_FASTDATA):
+		return (kind, data[1], data[2]) if withTdo else (kind, data[1])
+	return tuple(data)	# RESET, ENTER, IR
+
+
+class TransactionRecorder:
+	'''Listener - keeps every record as a number, with its samples and the TAP clocks so far.'''
+
+	def __init__(self, interner, withTdo=False):
+		self.interner = interner
+		self.withTdo = withTdo
+		self.keys = array.array('l')
+		self.starts = array.array('q')
+		self.ends = array.array('q')
+		self.clocksAt = array.array('q')	# TAP clocks up to & including the record
+		self.clocks = 0
+
+	def __call__(self, outputType, startsample, endsample, data):
+		if (outputType == srd.OUTPUT_ANN):
+			if (data[0] in STATE_ANNOTATIONS):
+				self.clocks += 1
+		elif (outputType == srd.OUTPUT_PYTHON):
+			self.keys.append(self.interner(recordKey(data, self.withTdo)))
+			self.starts.append(startsample)
+			self.ends.append(endsample)
+			self.clocksAt.append(self.clocks)
+
+	def __len__(self):
+		return len(self.keys)
+
+	def cost(self, first, last):
+		# TAP clocks of records [first, last)
+		if (first >= last):
+			return 0
+		return self.clocksAt[last - 1] - (self.clocksAt[first - 1] if first else 0)
+
+
+def longestIncreasing(values):
+	# Indices of a longest strictly increasing subsequence (patience sorting)
+	tails = []		# Smallest tail value of an increasing run of each length
+	tailIndex = []
+	previous = [-1] * len(values)
+	for index, value in enumerate(values):
+		position = bisect.bisect_left(tails, value)
+		if (position == len(tails)):
+			tails.append(value)
+			tailIndex.append(index)
+		else:
+			tails[position] = value
+			tailIndex[position] = index
+		previous[index] = tailIndex[position - 1] if position else -1
+	result = []
+	index = tailIndex[-1] if tailIndex else -1
+	while (index >= 0):
+		result.append(index)
+		index = previous[index]
+	return result[::-1]
+
+
+def uniqueIn(sequence, start, end):
+	# value -> position, for the values that occur once in sequence[start:end]
+	counts = collections.Counter(sequence[start:end])
+	return dict((sequence[x], x) for x in range(start, end) if counts[sequence[x]] == 1)
+
+
+def matchingBlocks(a, b):
+	'''(i, j, n) blocks where a[i:i+n] == b[j:j+n], in order. Patience diff, see above.'''
+	blocks = []
+	work = [('region', 0, len(a), 0, len(b))]	# Handled last in, first out - pushed in reverse
+	while (work):
+		item = work.pop()
+		if (item[0] == 'match'):
+			blocks.append(item[1:])
+			continue
+		aStart, aEnd, bStart, bEnd = item[1:]
+
+		# Same start & end -> matches straight away
+		head = 0
+		while (aStart + head < aEnd and bStart + head < bEnd and a[aStart + head] == b[bStart + head]):
+			head += 1
+		tail = 0
+		while (aEnd - tail > aStart + head and bEnd - tail > bStart + head and a[aEnd - tail - 1] == b[bEnd - tail - 1]):
+			tail += 1
+		if (tail):
+			work.append(('match', aEnd - tail, bEnd - tail, tail))
+		if (head):
+			blocks.append((aStart, bStart, head))
+		aStart += head
+		bStart += head
+		aEnd -= tail
+		bEnd -= tail
+		if (aStart == aEnd or bStart == bEnd):
+			continue
+
+		uniqueA = uniqueIn(a, aStart, aEnd)
+		uniqueB = uniqueIn(b, bStart, bEnd)
+		anchors = sorted((position, uniqueB[value]) for value, position in uniqueA.items() if value in uniqueB)
+		if (anchors):
+			chosen = [anchors[x] for x in longestIncreasing([x[1] for x in anchors])]
+			regions = []
+			previousA, previousB = aStart, bStart
+			for i, j in chosen:
+				regions.append(('region', previousA, i, previousB, j))
+				regions.append(('match', i, j, 1))
+				previousA, previousB = i + 1, j + 1
+			regions.append(('region', previousA, aEnd, previousB, bEnd))
+			work.extend(reversed(regions))
+			continue
+
+		# Nothing unique to hang on to
+		matcher = difflib.SequenceMatcher(None, a[aStart:aEnd], b[bStart:bEnd],
+			autojunk=(aEnd - aStart) * (bEnd - bStart) > DIFFLIB_LIMIT)
+		for i, j, n in matcher.get_matching_blocks():
+			if (n):
+				blocks.append((aStart + i, bStart + j, n))
+	return mergeBlocks(blocks)
+
+
+def mergeBlocks(blocks):
+	# Adjacent blocks -> one
+	merged = []
+	for i, j, n in blocks:
+		if (merged and merged[-1][0] + merged[-1][2] == i and merged[-1][1] + merged[-1][2] == j):
+			merged[-1] = (merged[-1][0], merged[-1][1], merged[-1][2] + n)
+		else:
+			merged.append((i, j, n))
+	return merged
+
+
+def opcodes(a, b):
+	'''difflib style (tag, i1, i2, j1, j2) list. tag: equal, delete (only in a), insert (only in b), replace.'''
+	result = []
+	i = j = 0
+	for blockA, blockB, size in matchingBlocks(a, b) + [(len(a), len(b), 0)]:
+		if (i < blockA and j < blockB):
+			result.append(('replace', i, blockA, j, blockB))
+		elif (i < blockA):
+			result.append(('delete', i, blockA, j, j))
+		elif (j < blockB):
+			result.append(('insert', i, i, j, blockB))
+		if (size):
+			result.append(('equal', blockA, blockA + size, blockB, blockB + size))
+		i, j = blockA + size, blockB + size
+	return result
+
+
+class Side:
+	'''One capture: its records, and how to show them.'''
+
+	def __init__(self, name, path, spec, recorder, samplerate, module):
+		self.name = name
+		self.path = path
+		self.spec = spec
+		self.recorder = recorder
+		self.samplerate = samplerate
+		self.instructions = getattr(module, 'INSTRUCTIONS', {})
+		self.tapInstructions = {'MTAP': getattr(module, 'MTAP_INSTRUCTIONS', {}), 'ETAP': getattr(module, 'ETAP_INSTRUCTIONS', {})}
+		self.commands = getattr(module, 'MTAP_COMMAND_DR', {})
+
+	def span(self, first, last):
+		# Samples, seconds and clocks of records [first, last)
+		recorder = self.recorder
+		if (first >= last):
+			return {'records': [first, last], 'samples': None, 'seconds': 0.0, 'clocks': 0}
+		start, end = recorder.starts[first], recorder.ends[last - 1]
+		return {'records': [first, last], 'samples': [start, end],
+			'seconds': (end - start) / self.samplerate if self.samplerate else None, 'clocks': recorder.cost(first, last)}
+
+	def describe(self, index, interner):
+		key = interner.keys[self.recorder.keys[index]]
+		kind = key[0]
+		if (kind == REC_IR):
+			return 'IR %s %s' % (key[1], self.tapInstructions.get(key[1], {}).get(key[2], hex(key[2])))
+		if (kind == REC_COMMAND_DR):
+			text = 'COMMAND %s' % self.commands.get(key[1], hex(key[1]))
+		elif (kind == REC_DATA):
+			text = 'DATA %s %db 0x%x' % (self.instructions.get(key[1], hex(key[1])), key[3], key[2])
+		elif (kind == REC_FASTDATA):
+			text = 'FASTDATA 0x%08x' % key[1]
+		else:
+			return ' '.join(str(x) for x in key)
+		if (len(key) > {REC_COMMAND_DR:2, REC_DATA:4, REC_FASTDATA:2}[kind]):
+			text += ' -> 0x%x' % key[-1]
+		return text
+
+
+def decodeSide(name, path, spec, interner, withTdo, engine):
+	decoderId, decoderClass, channels, options = decode.parseDecoderSpec(spec)
+	changed = decode.changedOptions(decoderClass, options, UNSUPPORTED_OPTIONS)
+	if (changed):
+		raise ValueError('Clocks can\'t be counted with ' + ', '.join(changed) + ', the decoder needs its default options')
+	if (withTdo and decode.changedOptions(decoderClass, options, ('phases',))):
+		raise ValueError('--tdo: there is no TDO with phases=2, it\'s all 0')
+	recorder = TransactionRecorder(interner, withTdo)
+	with decode.Session(path) as session:
+		samplerate = session.samplerate
+	decode.runSession(path, spec, [recorder], engine=engine)
+	return Side(name, path, spec, recorder, samplerate, sys.modules[decoderClass.__module__])
+
+
+def compare(sideA, sideB):
+	'''Returns (summary dict, [run dicts]) for everything that differs.'''
+	runs = []
+	summary = {'a': sideA.name, 'b': sideB.name, 'recordsA': len(sideA.recorder), 'recordsB': len(sideB.recorder),
+		'equalRecords': 0, 'equalClocksA': 0, 'equalClocksB': 0, 'changedClocksA': 0, 'changedClocksB': 0,
+		'clocksA': sideA.recorder.clocks, 'clocksB': sideB.recorder.clocks}
+	kinds = {'delete':'removed', 'insert':'inserted', 'replace':'changed'}
+	for tag, i1, i2, j1, j2 in opcodes(sideA.recorder.keys, sideB.recorder.keys):
+		spanA = sideA.span(i1, i2)
+		spanB = sideB.span(j1, j2)
+		if (tag == 'equal'):
+			summary['equalRecords'] += i2 - i1
+			summary['equalClocksA'] += spanA['clocks']
+			summary['equalClocksB'] += spanB['clocks']
+			continue
+		summary['changedClocksA'] += spanA['clocks']
+		summary['changedClocksB'] += spanB['clocks']
+		runs.append({'kind': kinds[tag], 'a': spanA, 'b': spanB, 'extraClocks': spanB['clocks'] - spanA['clocks']})
+	summary['runs'] = len(runs)
+	return summary, runs
+
+
+def printReport(summary, runs, sideA, sideB, interner, limit, show, stream=sys.stdout):
+	stream.write('a: %s, %d records, %d TAP clocks\n' % (sideA.name, summary['recordsA'], summary['clocksA']))
+	stream.write('b: %s, %d records, %d TAP clocks\n' % (sideB.name, summary['recordsB'], summary['clocksB']))
+	stream.write('%d records the same (%d clocks in a, %d in b), %d runs differ (%d clocks in a, %d in b)\n\n' % (summary['equalRecords'],
+		summary['equalClocksA'], summary['equalClocksB'], summary['runs'], summary['changedClocksA'], summary['changedClocksB']))
+
+	def where(span):
+		if (span['samples'] is None):
+			return 'at record %d' % span['records'][0]
+		seconds = '' if span['seconds'] is None else ', %.6f s' % span['seconds']
+		return 'records %d-%d, samples %d-%d, %d clocks%s' % (span['records'][0], span['records'][1] - 1,
+			span['samples'][0], span['samples'][1], span['clocks'], seconds)
+
+	for run in runs[:limit]:
+		stream.write('%s (%+d clocks)\n' % (run['kind'], run['extraClocks']))
+		for label, side, span in (('a', sideA, run['a']), ('b', sideB, run['b'])):
+			stream.write('  %s: %s\n' % (label, where(span)))
+			first, last = span['records']
+			for index in range(first, min(last, first + show)):
+				stream.write('    %s %s\n' % ('-' if label == 'a' else '+', side.describe(index, interner)))
+			if (last - first > show):
+				stream.write('    ... %d more\n' % (last - first - show))
+	if (len(runs) > limit):
+		stream.write('... %d more runs (--limit)\n' % (len(runs) - limit))
+
+
+def resolve(name, spec):
+	# Case name from bench.CASES, or a session path (then spec is needed)
+	if (name in CASES):
+		return name, os.path.join(TEST_DATA, CASES[name][0]), spec or CASES[name][1]
+	if (spec is None):
+		raise ValueError(name + ' is not a test case, give the decoder with -P')
+	return os.path.basename(name), name, spec
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Diff the transactions of two PIC32 programming captures')
+	parser.add_argument('a', help='reference: test case (' + ', '.join(CASES) + ') or session file')
+	parser.add_argument('b', help='compared against it: test case or session file')
+	parser.add_argument('-P', '--decoder', help='decoder:channel=probe..., for session files (both, unless --decoder-b)')
+	parser.add_argument('--decoder-b', help='decoder spec for b, if it differs')
+	parser.add_argument('--engine', choices=('wait', 'numpy'), default='wait')
+	parser.add_argument('--tdo', action='store_true', help='also compare what the chip sent back')
+	parser.add_argument('--limit', type=int, default=50, help='runs to print (default 50)')
+	parser.add_argument('--show', type=int, default=4, help='records to print per side of a run (default 4)')
+	parser.add_argument('--sort', action='store_true', help='print the costliest runs first (most extra clocks in b, either way)')
+	parser.add_argument('--json', help='write the summary & all runs here')
+	args = parser.parse_args(argv)
+
+	try:
+		nameA, pathA, specA = resolve(args.a, args.decoder)
+		nameB, pathB, specB = resolve(args.b, args.decoder_b or args.decoder)
+	except ValueError as error:
+		parser.error(str(error))
+	interner = Interner()
+	try:
+		sideA = decodeSide(nameA, pathA, specA, interner, args.tdo, args.engine)
+		sideB = decodeSide(nameB, pathB, specB, interner, args.tdo, args.engine)
+	except ValueError as error:
+		parser.error(str(error))
+	summary, runs = compare(sideA, sideB)
+	shown = sorted(runs, key=lambda x: -abs(x['extraClocks'])) if args.sort else runs
+	printReport(summary, shown, sideA, sideB, interner, args.limit, args.show)
+	if (args.json):
+		with open(args.json, 'w') as out:
+			json.dump({'summary': summary, 'runs': runs}, out, indent=1)
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
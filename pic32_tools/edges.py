@@ -0,0 +1,76 @@
+'''
+NumPy front end - turns raw sample blocks into pin changes
+
+Instead of looking at samples one by one, every block is unpacked into one byte
+per sample (bit N = decoder channel N) and only the samples where some pin
+changed are kept. Everything after that (the engines) works on those.
+Needs numpy, the rest of pic32_tools doesn't.
+'''
+
+import numpy as np
+
+SAMPLE_TYPES = {1:'<u1', 2:'<u2', 4:'<u4', 8:'<u8'}
+
+
+def packBlock(data, unitsize, bits):
+	'''Raw samples -> uint8 array, bit N = value of capture bit bits[N].'''
+	if (unitsize in SAMPLE_TYPES):
+		samples = np.frombuffer(data, dtype=SAMPLE_TYPES[unitsize])
+	else:
+		samples = np.frombuffer(data, dtype=np.uint8).reshape(-1, unitsize)
+	packed = np.zeros(len(samples), dtype=np.uint8)
+	for channel, bit in enumerate(bits):
+		if (unitsize in SAMPLE_TYPES):
+			values = (samples >> bit) & 1
+		else:
+			values = (samples[:, bit // 8] >> (bit % 8)) & 1
+		packed |= values.astype(np.uint8) << channel
+	return packed
+
+
+class ChangeStream:
+	'''Pin changes of a capture, one block at a time.
+
+	Iterating gives (samples, values) array pairs - sample numbers (int64) where
+	the pins changed, and the pins from that sample on. The first sample of the
+	capture is not a change, its value is in .initial once the first block is read.
+	'''
+
+	def __init__(self, blocks, unitsize, bits):
+		self.blocks = blocks
+		self.unitsize = unitsize
+		self.bits = bits
+		self.initial = None
+		self.numSamples = 0		# Samples read so far
+
+	def __iter__(self):
+		last = None
+		for data in self.blocks:
+			packed = packBlock(data, self.unitsize, self.bits)
+			if (len(packed) == 0):
+				continue
+			if (last is None):
+				self.initial = int(packed[0])
+				last = packed[0]
+			changes = np.flatnonzero(packed[1:] != packed[:-1]) + 1
+			if (packed[0] != last):
+				changes = np.concatenate(([0], changes))
+			samples = changes.astype(np.int64) + self.numSamples
+			values = packed[changes]
+			self.numSamples += len(packed)
+			last = packed[-1]
+			if (len(samples)):
+				yield samples, values
+
+
+def pinEdges(samples, values, pin, previous):
+	'''Changes of one pin. Returns (indices into samples/values, new pin levels).
+
+	previous is the pin level before the first change in this block.
+	'''
+	levels = (values >> pin) & 1
+	before = np.empty_like(levels)
+	before[0] = previous
+	before[1:] = levels[:-1]
+	edges = np.flatnonzero(levels != before)
+	return edges, levels[edges]
@@ -0,0 +1,232 @@
+'''
+Programmer efficiency - how well a programmer uses the clock, from a decode
+
+Listens to a decode (state annotations + OUTPUT_PYTHON records) and works out,
+with the session's samplerate:
+
+- TAP clock rate: over the whole programming (first to last clock), and within
+  bursts (from the most common clock period). For ICSP, PGEC is 4x that (2x with phases=2).
+- Where the clocks go: Shift-DR/IR, Run-Test-Idle, Pause, Test-Logic-Reset, and
+  the rest of the TAP states (select, capture, exit, update - overhead).
+- Gaps between bursts: a clock period over GAP_FACTOR x the usual one. How many,
+  total & longest, how long a burst is.
+- FASTDATA words per second, and the time per flash row, from the PE commands
+  that program flash (as followed by image.ImageBuilder).
+
+Clocks are counted from the JTAG state annotations, one per clock, so the
+decoder has to run with its default options (no coalesce, full verbosity, polls shown).
+A spec that sets any of those otherwise is refused.
+
+python3 -m pic32_tools.efficiency
+python3 -m pic32_tools.efficiency --session capture.sr -P pic32_icsp:reset=1:clock=2:data=3
+'''
+
+import argparse
+import collections
+import json
+import os
+import sys
+
+from . import decode, srd
+from .bench import CASES, TEST_DATA
+from .image import DEFAULT_ROW_WORDS, FlashImage, ImageBuilder
+from pic32_common.records import *
+from pic32_common.tap import *
+
+GAP_FACTOR = 4		# A clock period this many times the usual one ends a burst
+
+STATE_ANNOTATIONS = (14, 15, 16, 17)
+# Anything but the defaults changes the state annotations: coalesce merges clocks, verbosity drops the row,
+# polls=collapse drops them for all but the first poll
+UNSUPPORTED_OPTIONS = ('coalesce', 'verbosity', 'polls')
+STATE_BY_NAME = dict((STATES[x][2][1][0], x) for x in STATES)	# 'Shift-DR' -> JS_ShiftDR
+
+# Where a clock goes, by JTAG state
+CATEGORIES = ('shift', 'idle', 'pause', 'reset', 'overhead')
+STATE_CATEGORY = dict((x, 'overhead') for x in STATES)
+STATE_CATEGORY.update({JS_ShiftDR:'shift', JS_ShiftIR:'shift', JS_RunTestIdle:'idle', JS_PauseDR:'pause', JS_PauseIR:'pause',
+	JS_TestLogicReset:'reset'})
+
+
+class EfficiencyAnalyzer:
+	'''Listener for DecodeRun. report() after the decode.'''
+
+	def __init__(self, samplerate, clocksPerBit=1, rowWords=DEFAULT_ROW_WORDS):
+		self.samplerate = samplerate
+		self.clocksPerBit = clocksPerBit	# Wire clocks per TAP clock (ICSP: 4, or 2 with phases=2)
+		self.rowWords = rowWords
+		self.clocks = 0
+		self.firstClock = None
+		self.lastClock = None
+		self.periods = collections.Counter()	# Samples between clocks -> how often
+		self.categories = dict((x, 0) for x in CATEGORIES)
+
+		self.words = 0			# FASTDATA words
+		self.firstWord = None
+		self.lastWord = None
+		self.builder = ImageBuilder(rowWords, FlashImage())
+		self.commandStart = None	# Sample of the PE command word being followed
+		self.programStart = None	# ... once it turned out to program flash
+		self.programWords = 0
+		self.programs = []		# (samples, data words) per flash programming command
+
+	def __call__(self, outputType, startsample, endsample, data):
+		if (outputType == srd.OUTPUT_ANN):
+			if (data[0] in STATE_ANNOTATIONS):
+				self.onClock(endsample, STATE_BY_NAME[data[1][0]])
+		elif (outputType == srd.OUTPUT_PYTHON):
+			if (data[0] == REC_FASTDATA):
+				self.onWord(startsample, endsample, data[1])
+			else:
+				self.builder(outputType, startsample, endsample, data)	# MCLR resets
+
+	def onClock(self, sample, state):
+		self.clocks += 1
+		self.categories[STATE_CATEGORY[state]] += 1
+		if (self.lastClock is None):
+			self.firstClock = sample
+		else:
+			self.periods[sample - self.lastClock] += 1
+		self.lastClock = sample
+
+	def onWord(self, startsample, endsample, word):
+		self.words += 1
+		if (self.firstWord is None):
+			self.firstWord = startsample
+		self.lastWord = endsample
+
+		# Follow the builder: command word -> arguments -> data words
+		builder = self.builder
+		programming = builder.dataWords
+		builder.onWord(word)
+		if (builder.command == word and not builder.arguments):
+			self.commandStart = startsample
+		if (not programming and builder.dataWords):
+			self.programStart = self.commandStart
+			self.programWords = builder.dataWords
+		elif (programming and not builder.dataWords):
+			self.programs.append((endsample - self.programStart, self.programWords))
+
+	def seconds(self, samples):
+		return samples / self.samplerate if self.samplerate else None
+
+	def usualPeriod(self):
+		# Most common clock period, in samples
+		if (not self.periods):
+			return None
+		return self.periods.most_common(1)[0][0]
+
+	def report(self):
+		'''Everything, as a dict. Times in seconds, rates per second (None without a samplerate).'''
+		result = {'samplerate': self.samplerate, 'clocks': self.clocks}
+		span = (self.lastClock - self.firstClock) if self.clocks > 1 else 0
+		result['clockSeconds'] = self.seconds(span)
+		result['clockRate'] = self.clocks / result['clockSeconds'] if span and self.samplerate else None
+		usual = self.usualPeriod()
+		result['burstClockRate'] = self.samplerate / usual if usual and self.samplerate else None
+		if (self.clocksPerBit != 1):
+			for key in ('clockRate', 'burstClockRate'):
+				result['wire' + key[0].upper() + key[1:]] = result[key] * self.clocksPerBit if result[key] else None
+		for name in CATEGORIES:
+			result[name + 'Fraction'] = self.categories[name] / self.clocks if self.clocks else 0
+
+		limit = (usual or 0) * GAP_FACTOR
+		gaps = [(period, count) for period, count in self.periods.items() if period > limit]
+		gapCount = sum(x[1] for x in gaps)
+		gapSamples = sum(x[0] * x[1] for x in gaps)
+		result['gaps'] = gapCount
+		result['gapSeconds'] = self.seconds(gapSamples)
+		result['gapFraction'] = gapSamples / span if span else 0
+		result['longestGapSeconds'] = self.seconds(max([x[0] for x in gaps] or [0]))
+		result['clocksPerBurst'] = self.clocks / (gapCount + 1) if self.clocks else 0
+
+		result['fastdataWords'] = self.words
+		wordSpan = (self.lastWord - self.firstWord) if self.words > 1 else 0
+		result['fastdataWordsPerSecond'] = self.words / self.seconds(wordSpan) if wordSpan and self.samplerate else None
+		result['programCommands'] = len(self.programs)
+		programSamples = sum(x[0] for x in self.programs)
+		programWords = sum(x[1] for x in self.programs)
+		result['programmedWords'] = programWords
+		result['rowWords'] = self.rowWords
+		result['secondsPerRow'] = self.seconds(programSamples * self.rowWords / programWords) if programWords and self.samplerate else None
+		return result
+
+
+def formatReport(name, result, stream=sys.stderr):
+	def rate(value, unit):
+		if (value is None):
+			return '-'
+		for scale, prefix in ((1e6, 'M'), (1e3, 'k')):
+			if (value >= scale):
+				return '%.2f %s%s' % (value / scale, prefix, unit)
+		return '%.1f %s' % (value, unit)
+	def seconds(value):
+		return '-' if value is None else ('%.3f s' % value if value >= 1 else '%.3f ms' % (value * 1000))
+
+	stream.write('%s\n' % name)
+	stream.write('  TAP clocks          %d, %s over %s, %s in bursts\n' % (result['clocks'], rate(result['clockRate'], 'Hz'),
+		seconds(result['clockSeconds']), rate(result['burstClockRate'], 'Hz')))
+	if ('wireClockRate' in result):
+		stream.write('  PGEC                %s overall, %s in bursts\n' % (rate(result['wireClockRate'], 'Hz'), rate(result['wireBurstClockRate'], 'Hz')))
+	stream.write('  clocks in           ' + ', '.join('%s %.1f%%' % (x, result[x + 'Fraction'] * 100) for x in CATEGORIES) + '\n')
+	stream.write('  gaps                %d, %s total (%.1f%% of the time), longest %s, %.0f clocks per burst\n' % (result['gaps'],
+		seconds(result['gapSeconds']), result['gapFraction'] * 100, seconds(result['longestGapSeconds']), result['clocksPerBurst']))
+	stream.write('  FASTDATA            %d words, %s\n' % (result['fastdataWords'], rate(result['fastdataWordsPerSecond'], 'words/s')))
+	stream.write('  flash programming   %d commands, %d words, %s per %d word row\n' % (result['programCommands'], result['programmedWords'],
+		seconds(result['secondsPerRow']), result['rowWords']))
+
+
+def wireClocksPerBit(decoderId, options):
+	# PGEC clocks per TAP clock, options as parsed from the spec
+	if (decoderId != 'pic32_icsp'):
+		return 1
+	return 2 if options.get('phases') == '2' else 4
+
+
+def analyze(path, spec, engine='wait', rowWords=DEFAULT_ROW_WORDS, maxSamples=None):
+	decoderId, decoderClass, channels, options = decode.parseDecoderSpec(spec)
+	changed = decode.changedOptions(decoderClass, options, UNSUPPORTED_OPTIONS)
+	if (changed):
+		raise ValueError('Clocks can\'t be counted with ' + ', '.join(changed) + ', the decoder needs its default options')
+	with decode.Session(path) as session:
+		samplerate = session.samplerate
+	analyzer = EfficiencyAnalyzer(samplerate, wireClocksPerBit(decoderId, options), rowWords)
+	decode.runSession(path, spec, [analyzer], maxSamples, engine=engine)
+	return analyzer.report()
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Clock use & throughput of a programmer, from a capture')
+	parser.add_argument('cases', nargs='*', help='test captures (default: all): ' + ', '.join(CASES))
+	parser.add_argument('--session', help='analyze this session instead, needs -P')
+	parser.add_argument('-P', '--decoder', help='decoder:channel=probe..., as with sigrok-cli')
+	parser.add_argument('--engine', choices=('wait', 'numpy'), default='wait')
+	parser.add_argument('--samples', type=int, help='only decode this many samples')
+	parser.add_argument('--row-words', type=int, default=DEFAULT_ROW_WORDS, help='flash row size in words (MZ: 512, MX: 128)')
+	parser.add_argument('--json', action='store_true', help='print the results as JSON (stdout)')
+	args = parser.parse_args(argv)
+
+	if (args.session):
+		if (not args.decoder):
+			parser.error('--session needs -P')
+		runs = [(os.path.basename(args.session), args.session, args.decoder)]
+	else:
+		for name in args.cases:
+			if (name not in CASES):
+				parser.error('Unknown case: ' + name)
+		runs = [(x, os.path.join(TEST_DATA, CASES[x][0]), CASES[x][1]) for x in (args.cases or CASES)]
+
+	results = {}
+	for name, path, spec in runs:
+		try:
+			results[name] = analyze(path, spec, args.engine, args.row_words, args.samples)
+		except ValueError as error:
+			parser.error(str(error))
+		formatReport(name, results[name])
+	if (args.json):
+		sys.stdout.write(json.dumps(results, indent=1) + '\n')
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,342 @@
+'''
+Batch engines - feed the decoders from pin changes, instead of through wait()
+
+The clock edges of a whole block are found at once with numpy, the data pins are
+picked up at those edges, and only then the decoder's own per-clock code is
+called (with samplenum set), so the annotations are the same as from decode().
+'''
+
+import numpy as np
+
+from . import decode	# Puts the sigrokdecode stand-in in place, for the imports below
+from .edges import pinEdges
+
+from pic32_common.tap import JS_RunTestIdle
+from pic32_icsp import pd as icsp
+from pic32_jtag import pd as jtag
+
+
+class JtagEngine:
+	'''pic32_jtag: TMS/TDI/TDO picked up at the TCK rising edges, printed at the falling ones.'''
+
+	def __init__(self, decoder):
+		self.decoder = decoder
+		self.checkpoints = None		# CheckpointWriter (checkpoint.py), offered a checkpoint after every block
+
+	def run(self, changes, resume=None):
+		# resume: the engine's part of a checkpoint, to carry on from there
+		decoder = self.decoder
+		pending = None		# Printed on the next falling edge
+		if (resume is not None):
+			pending = resume['pending']
+		clock = None
+		for samples, values in changes:
+			if (clock is None):
+				clock = (changes.initial >> jtag.PIN_CLOCK) & 1
+			edges, levels = pinEdges(samples, values, jtag.PIN_CLOCK, clock)
+			if (len(edges) == 0):
+				continue
+			clock = int(levels[-1])
+
+			picked = values[edges]
+			at = samples[edges].tolist()
+			tms = ((picked >> jtag.PIN_TMS) & 1).tolist()
+			tdi = ((picked >> jtag.PIN_TDI) & 1).tolist()
+			tdo = ((picked >> jtag.PIN_TDO) & 1).tolist()
+			for i, level in enumerate(levels.tolist()):
+				decoder.samplenum = at[i]
+				if (level):
+					pending = decoder.onClockRising(tms[i], tdi[i], tdo[i])
+				elif (pending is not None):
+					decoder.onClockFalling(pending)
+					pending = None
+			if (self.checkpoints is not None and samples[-1] >= self.checkpoints.next):
+				self.checkpoints.take(int(samples[-1]), {'pending': pending})
+		# A rising edge without the falling one is dropped, same as when wait() runs out.
+
+
+class ChangeCursor:
+	'''Walks the pin changes one by one, across blocks. Keeps the current block's
+	clock & reset edges around, for the batch paths.'''
+
+	def __init__(self, changes, clockPin, resetPin):
+		self.iterator = iter(changes)
+		self.changes = changes
+		self.clockPin = clockPin
+		self.resetPin = resetPin
+		self.previous = None	# Pins before the next change
+		self.pos = 0
+		self.count = 0
+
+	def fill(self):
+		# Make sure there's a change at self.pos. False at end of data.
+		while (self.pos >= self.count):
+			try:
+				samples, values = next(self.iterator)
+			except StopIteration:
+				return False
+			if (self.previous is None):
+				self.previous = self.changes.initial
+			self.samples = samples
+			self.values = values
+			self.sampleList = samples.tolist()
+			self.valueList = values.tolist()
+			self.pos = 0
+			self.count = len(samples)
+
+			clock = (values >> self.clockPin) & 1
+			clockBefore = np.empty_like(clock)
+			clockBefore[0] = (self.previous >> self.clockPin) & 1
+			clockBefore[1:] = clock[:-1]
+			self.clockFalls = np.flatnonzero(clockBefore & ~clock & 1)
+			self.clockRises = np.flatnonzero(~clockBefore & clock & 1)
+			reset = (values >> self.resetPin) & 1
+			self.resetEdges = np.flatnonzero(reset[1:] != reset[:-1]) + 1
+			if (reset[0] != (self.previous >> self.resetPin) & 1):
+				self.resetEdges = np.concatenate(([0], self.resetEdges))
+		return True
+
+	def take(self):
+		# Next change, as (sample, pins, pins before). Call fill() first.
+		value = self.valueList[self.pos]
+		previous = self.previous
+		self.previous = value
+		self.pos += 1
+		return self.sampleList[self.pos - 1], value, previous
+
+	def skipTo(self, pos):
+		# Continue after change pos of the current block
+		self.previous = self.valueList[pos]
+		self.pos = pos + 1
+
+
+def demuxFrames(values, falls, rises, dataPin):
+	'''Groups PGEC falling edges into 4-phase frames.
+
+	falls/rises are indices of PGEC falling/rising edges in values, with no MCLR
+	change in between. Every 4 falling edges are one JTAG bit: TDI on the 1st,
+	TMS on the 2nd, the 3rd is the turnaround, TDO is on the rising edge before
+	the 4th. Returns (tdi, tms, tdo, index of the 4th falling edge) arrays.
+	'''
+	count = len(falls) // 4
+	frames = falls[:count*4].reshape(count, 4)
+	tdoAt = rises[np.searchsorted(rises, frames[:, 2])]
+	data = (values >> dataPin) & 1
+	return data[frames[:, 0]], data[frames[:, 1]], data[tdoAt], frames[:, 3]
+
+
+def demuxTwoPhase(values, falls, dataPin):
+	'''Same as demuxFrames, for 2-phase ICSP: TDI on the 1st falling edge, TMS on the 2nd, no TDO (0).'''
+	count = len(falls) // 2
+	frames = falls[:count*2].reshape(count, 2)
+	data = (values >> dataPin) & 1
+	return data[frames[:, 0]], data[frames[:, 1]], np.zeros(count, dtype=data.dtype), frames[:, 1]
+
+
+# Where the ICSP decode() loop is waiting, see pic32_icsp decode()
+WAIT_RESET, IN_RESET, PHASE_TDI, PHASE_TMS, PHASE_DUMMY, PHASE_TDO, PHASE_CLEANUP = range(7)
+
+# Frame templates, after the notes in pic32_icsp onJtagBit(). From Run-Test-Idle, a TMS header into
+# Shift-IR/DR, TMS 0 while the data goes in, then the footer: TMS 1, 1, 0 (Exit1, Update, Run-Test-Idle).
+# SendCommand shifts 5 bits into IR, XferData (and XferInstruction, MCHP commands) 32 or 8 into DR,
+# XferFastData 33. The length isn't part of the template. SetMode is TMS only, it goes bit by bit.
+FRAME_HEADERS = (
+	bytes((1, 1, 0, 0)),	# SendCommand: Select-DR, Select-IR, Capture-IR, Shift-IR
+	bytes((1, 0, 0)),		# XferData/XferFastData: Select-DR, Capture-DR, Shift-DR
+)
+FRAME_FOOTER = bytes((1, 1, 0))
+BIT_TEXT = bytes.maketrans(b'\x00\x01', b'01')
+
+
+def matchFrame(tmsBytes, i):
+	# (first data bit, first footer bit) if a frame template starts at bit i, else None
+	for header in FRAME_HEADERS:
+		if (tmsBytes.startswith(header, i)):
+			first = i + len(header)
+			last = tmsBytes.find(1, first)
+			if (last > first and tmsBytes.startswith(FRAME_FOOTER, last)):
+				return first, last
+			return None
+	return None
+
+
+class IcspEngine:
+	'''pic32_icsp: whole 4-phase (or 2-phase) frames are cut out of a block at once, between MCLR changes.
+
+	The MCLR changes themselves (entry, resets) go change by change, the same way
+	as the waits in decode(), so the odd cases end up the same too. The clocks
+	before entry are skipped over in bulk, with the entry key taken from the last
+	32 of them.
+	'''
+
+	def __init__(self, decoder):
+		self.decoder = decoder
+		self.checkpoints = None		# CheckpointWriter (checkpoint.py), offered a checkpoint after every block
+
+	def batch(self, cursor):
+		# At the start of a frame: feed all complete frames up to the next MCLR change (or end of block)
+		start = cursor.pos
+		limit = cursor.count
+		after = np.searchsorted(cursor.resetEdges, start)
+		if (after < len(cursor.resetEdges)):
+			limit = cursor.resetEdges[after]
+		falls = cursor.clockFalls[np.searchsorted(cursor.clockFalls, start):np.searchsorted(cursor.clockFalls, limit)]
+		decoder = self.decoder
+		if (len(falls) < (2 if decoder.twoPhase else 4)):
+			return False
+		if (decoder.twoPhase):
+			tdi, tms, tdo, ends = demuxTwoPhase(cursor.values, falls, icsp.PIN_DATA)
+		else:
+			tdi, tms, tdo, ends = demuxFrames(cursor.values, falls, cursor.clockRises, icsp.PIN_DATA)
+
+		at = cursor.samples[ends].tolist()
+		tms = tms.tolist()
+		tdo = tdo.tolist()
+		if (decoder.profiler is None):
+			self.feedFrames(at, tdi.tolist(), tms, tdo)
+		else:
+			for i, bit in enumerate(tdi.tolist()):	# Every onJtagBit() counted
+				decoder.samplenum = at[i]
+				decoder.onJtagBit(bit, tms[i], tdo[i])
+		cursor.skipTo(int(ends[-1]))
+		return True
+
+	def feedFrames(self, at, tdi, tms, tdo):
+		# Bit by bit, except for the data of frames that match a template: that goes in with one onShiftRun()
+		decoder = self.decoder
+		tmsBytes = bytes(tms)
+		tdiText = bytes(tdi).translate(BIT_TEXT)
+		tdoText = bytes(tdo).translate(BIT_TEXT)
+		count = len(at)
+		i = 0
+		while (i < count):
+			if (tms[i] and decoder.stateJTAG == JS_RunTestIdle):
+				frame = matchFrame(tmsBytes, i)
+				if (frame is not None):
+					first, last = frame
+					for j in range(i, first):	# Header
+						decoder.samplenum = at[j]
+						decoder.onJtagBit(tdi[j], tms[j], tdo[j])
+					decoder.onShiftRun(int(tdiText[first:last][::-1], 2), int(tdoText[first:last][::-1], 2), at[first:last])
+					i = last	# Footer, from the last data bit on, bit by bit
+			decoder.samplenum = at[i]
+			decoder.onJtagBit(tdi[i], tms[i], tdo[i])
+			i += 1
+
+	def batchReset(self, cursor, phase):
+		# Before entry: jump to the next MCLR change, with the clocks up to it taken in one go.
+		# MCLR low: the entry key, only the last 32 bits matter. MCLR high after a failed entry:
+		# every rising clock fails the entry again, only the last one counts (it sets startSample).
+		start = cursor.pos
+		after = np.searchsorted(cursor.resetEdges, start)
+		limit = cursor.resetEdges[after] if after < len(cursor.resetEdges) else cursor.count
+		if (limit == start):
+			return False	# MCLR changes right here, that's for the slow path
+		decoder = self.decoder
+		rises = cursor.clockRises[np.searchsorted(cursor.clockRises, start):np.searchsorted(cursor.clockRises, limit)]
+		if (phase == WAIT_RESET or len(rises) == 0):
+			pass	# Nothing there that decode() would wake up for
+		elif (cursor.previous & (1 << icsp.PIN_RESET)):
+			if (decoder.enteredICSP >= 0):
+				return False
+			decoder.samplenum = cursor.sampleList[rises[-1]]
+			decoder.onResetDeasserted()
+		else:
+			bits = (cursor.values[rises] >> icsp.PIN_DATA) & 1
+			if (decoder.enteredICSP < 0):
+				# The first clock after a failed entry starts over, let decode()'s code do that
+				decoder.samplenum = cursor.sampleList[rises[0]]
+				decoder.onClockInReset(int(bits[0]))
+				bits = bits[1:]
+			count = len(bits)
+			key = 0
+			for bit in bits[-32:].tolist():
+				key = (key << 1) | bit
+			decoder.valueInReset = ((decoder.valueInReset << min(count, 32)) | key) & 0xFFFFFFFF
+			decoder.clockCycles = min(decoder.clockCycles + count, 100)
+		cursor.skipTo(limit - 1)
+		return True
+
+	def run(self, changes, resume=None):
+		# resume: the engine's part of a checkpoint, to carry on from there
+		decoder = self.decoder
+		cursor = ChangeCursor(changes, icsp.PIN_CLOCK, icsp.PIN_RESET)
+		if (not cursor.fill()):
+			return
+		resetMask = 1 << icsp.PIN_RESET
+		clockMask = 1 << icsp.PIN_CLOCK
+
+		if (resume is not None):
+			phase, tdi, tms, tdo = resume['phase'], resume['tdi'], resume['tms'], resume['tdo']
+		else:
+			# decode() starts with a wait() for the first sample
+			decoder.samplenum = 0
+			if (cursor.previous & resetMask):
+				phase = WAIT_RESET
+			else:
+				decoder.onResetAsserted()
+				phase = IN_RESET
+			tdi = tms = tdo = 0
+
+		while True:
+			if (cursor.pos >= cursor.count and self.checkpoints is not None and cursor.sampleList[-1] >= self.checkpoints.next):
+				# Block done, all of it is in the state now
+				self.checkpoints.take(cursor.sampleList[-1], {'phase': phase, 'tdi': tdi, 'tms': tms, 'tdo': tdo})
+			if (phase == PHASE_TDI and cursor.fill() and self.batch(cursor)):
+				continue
+			if (phase <= IN_RESET and cursor.fill() and self.batchReset(cursor, phase)):
+				continue
+			if (not cursor.fill()):
+				return	# Whatever frame was started is dropped, same as in decode()
+			sample, value, previous = cursor.take()
+			rise = value & ~previous
+			fall = previous & ~value
+			reset = value & resetMask
+
+			if (phase == WAIT_RESET):
+				if (fall & resetMask):
+					decoder.samplenum = sample
+					decoder.onResetAsserted()
+					phase = IN_RESET
+			elif (phase == IN_RESET):
+				if (rise & (clockMask | resetMask)):
+					decoder.samplenum = sample
+					if (reset):
+						decoder.onResetDeasserted()
+					else:
+						decoder.onClockInReset((value >> icsp.PIN_DATA) & 1)
+					if (decoder.enteredICSP > 0):
+						phase = PHASE_TDI
+			else:
+				if (phase == PHASE_TDO):
+					matched = (rise & clockMask) or (fall & resetMask)
+				else:
+					matched = fall & (clockMask | resetMask)
+				if (not matched):
+					continue
+				decoder.samplenum = sample
+				if (phase != PHASE_DUMMY and not reset):
+					decoder.onResetAsserted()
+					phase = IN_RESET
+					continue
+				data = (value >> icsp.PIN_DATA) & 1
+				if (phase == PHASE_TDI):
+					tdi = data
+					phase = PHASE_TMS
+				elif (phase == PHASE_TMS):
+					tms = data
+					phase = PHASE_DUMMY
+					if (decoder.twoPhase):
+						decoder.onJtagBit(tdi, tms, 0)
+						phase = PHASE_TDI
+				elif (phase == PHASE_DUMMY):
+					phase = PHASE_TDO
+				elif (phase == PHASE_TDO):
+					tdo = data
+					phase = PHASE_CLEANUP
+				else:
+					decoder.onJtagBit(tdi, tms, tdo)
+					phase = PHASE_TDI
+
+
+ENGINES = {'pic32_icsp': IcspEngine, 'pic32_jtag': JtagEngine}
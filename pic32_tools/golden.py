@@ -0,0 +1,264 @@
+'''
+Golden outputs - checks that a decode still gives exactly the same annotations & records
+
+"record" decodes the captures in "Test data" (with the wait() engine, i.e. the
+decoders' own decode() loops) and saves the annotation stream and the
+OUTPUT_PYTHON record stream, each cut into chunks of CHUNK_LINES lines:
+
+- <case>.json - a SHA-256 per chunk. Small, kept in the repo (Test data/golden).
+- <case>.zip - the chunks themselves, compressed. Big, optional (--text).
+
+Besides the captures with default options (bench.CASES), there are cases for
+the options that change the output: coalesce, both reduced verbosities and
+polls=collapse, on the Progyon captures (the MPLAB one takes too long with the
+wait() engine to have them all). There's no 2-phase capture, so
+icsp-progyon-2phase reads the 4-phase one with phases=2 - nonsense after the
+entry key, but it keeps the 2-phase framing in both engines the same.
+
+"check" decodes again (any engine) and compares chunk by chunk. It stops at the
+first chunk that differs, and reports the first line that differs, with its
+sample number and the JTAG state at that point. Without the .zip, only the
+chunk is known, not the exact line.
+
+python3 -m pic32_tools.golden record --text
+python3 -m pic32_tools.golden check --engine numpy
+'''
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import zipfile
+
+from . import decode, srd
+from .bench import CASES, TEST_DATA
+
+CHUNK_LINES = 4096
+DEFAULT_DIRECTORY = os.path.join(TEST_DATA, 'golden')
+
+# Options that change the output: case name suffix -> spec options
+VARIANTS = (('coalesce', 'coalesce=yes'), ('transactions', 'verbosity=transactions'),
+	('transactions-bits', 'verbosity=transactions+bits'), ('polls', 'polls=collapse'))
+GOLDEN_CASES = dict(CASES)
+for base in ('icsp-progyon', 'jtag-progyon'):
+	for suffix, option in VARIANTS:
+		GOLDEN_CASES[base + '-' + suffix] = (CASES[base][0], CASES[base][1] + ':' + option)
+GOLDEN_CASES['icsp-progyon-2phase'] = (CASES['icsp-progyon'][0], CASES['icsp-progyon'][1] + ':phases=2')
+
+STATE_ANNOTATIONS = (14, 15, 16, 17)	# JTAG state annotations, for "where was it"
+
+
+def formatLine(startsample, endsample, data):
+	return '%d %d %d %s' % (startsample, endsample, data[0], data[1][0])
+
+
+def formatRecord(startsample, endsample, data):
+	return '%d %d py %r' % (startsample, endsample, data)
+
+# What's kept of each output: output type -> (line format, manifest keys for count & chunks, chunk name in the .zip)
+STREAMS = {
+	srd.OUTPUT_ANN: (formatLine, 'count', 'chunks', 'chunk-%d'),
+	srd.OUTPUT_PYTHON: (formatRecord, 'recordCount', 'recordChunks', 'record-%d'),
+}
+
+
+def chunkHash(lines):
+	return hashlib.sha256('\n'.join(lines).encode('utf-8')).hexdigest()
+
+
+class Divergence(Exception):
+	'''Raised by the checker at the first difference, to stop the decode.'''
+
+
+class Chunker:
+	'''Listener - collects the lines of one output type (see STREAMS), and hands them over a chunk at a time.'''
+
+	def __init__(self, outputType=srd.OUTPUT_ANN):
+		self.outputType = outputType
+		self.format, self.countKey, self.chunksKey, self.chunkName = STREAMS[outputType]
+		self.lines = []
+		self.count = 0			# Lines so far
+		self.chunkIndex = 0
+		self.firstSample = None
+
+	def __call__(self, outputType, startsample, endsample, data):
+		if (outputType != self.outputType):
+			return
+		if (not self.lines):
+			self.firstSample = startsample
+		self.lines.append(self.format(startsample, endsample, data))
+		self.count += 1
+		if (len(self.lines) == CHUNK_LINES):
+			self.flush()
+
+	def flush(self):
+		if (self.lines):
+			self.onChunk(self.chunkIndex, self.lines)
+			self.chunkIndex += 1
+			self.lines = []
+
+
+class Recorder(Chunker):
+
+	def __init__(self, archive=None, outputType=srd.OUTPUT_ANN):
+		Chunker.__init__(self, outputType)
+		self.archive = archive	# zipfile for the text, or None
+		self.chunks = []		# [first sample, hash]
+
+	def onChunk(self, index, lines):
+		self.chunks.append([self.firstSample, chunkHash(lines)])
+		if (self.archive is not None):
+			self.archive.writestr(self.chunkName % index, '\n'.join(lines))
+
+
+class Checker(Chunker):
+
+	def __init__(self, manifest, archive=None, outputType=srd.OUTPUT_ANN):
+		Chunker.__init__(self, outputType)
+		self.manifest = manifest
+		self.chunks = manifest[self.chunksKey]
+		self.archive = archive
+		self.state = None	# Last JTAG state annotation seen
+		self.problem = None
+
+	def onChunk(self, index, lines):
+		expected = self.chunks[index] if index < len(self.chunks) else None
+		if (expected is not None and expected[1] == chunkHash(lines)):
+			self.state = lastState(lines, len(lines)) or self.state
+			return
+		self.problem = self.describe(index, lines)
+		raise Divergence(self.problem)
+
+	def describe(self, index, lines):
+		first = index * CHUNK_LINES
+		what = 'annotations' if self.outputType == srd.OUTPUT_ANN else 'records'
+		if (index >= len(self.chunks)):
+			return 'Extra output after the %d golden %s, at sample %s: %s' % (self.manifest[self.countKey], what, lines[0].split()[0], lines[0])
+		if (self.archive is None):
+			return ('%s %d-%d differ (from sample %d), JTAG state before them: %s. Record with --text to see the exact line.'
+				% (what.capitalize(), first, first + len(lines) - 1, self.chunks[index][0], self.state))
+		expected = self.archive.read(self.chunkName % index).decode('utf-8').split('\n')
+		for number, (got, wanted) in enumerate(zip(lines, expected)):
+			if (got != wanted):
+				break
+		else:
+			number = min(len(lines), len(expected))
+			if (len(lines) < len(expected)):
+				return 'Output ends early, after %d %s. Next expected: %s' % (first + number, what, expected[number])
+			got = lines[number]
+			wanted = '(nothing)'
+		state = lastState(lines, number) or self.state
+		return ('First difference at %s %d, sample %s, JTAG state %s\n  expected: %s\n  got:      %s'
+			% (what[:-1], first + number, got.split()[0], state, wanted, got))
+
+	def finish(self):
+		# After the decode - last chunk, and the count
+		self.flush()
+		if (self.count < self.manifest[self.countKey]):
+			self.problem = 'Output ends early, after %d of %d %s' % (self.count, self.manifest[self.countKey],
+				'annotations' if self.outputType == srd.OUTPUT_ANN else 'records')
+			raise Divergence(self.problem)
+
+
+def lastState(lines, end):
+	# Text of the last JTAG state annotation in lines[:end]
+	for line in reversed(lines[:end]):
+		parts = line.split(' ', 3)
+		if (parts[2].isdigit() and int(parts[2]) in STATE_ANNOTATIONS):
+			return parts[3]
+	return None
+
+
+def paths(directory, name):
+	return os.path.join(directory, name + '.json'), os.path.join(directory, name + '.zip')
+
+
+def record(name, directory, text=False, engine='wait'):
+	capture, spec = GOLDEN_CASES[name]
+	manifestPath, archivePath = paths(directory, name)
+	archive = zipfile.ZipFile(archivePath, 'w', zipfile.ZIP_DEFLATED) if text else None
+	try:
+		recorders = [Recorder(archive, x) for x in STREAMS]
+		decode.runSession(os.path.join(TEST_DATA, capture), spec, recorders, engine=engine)
+		for recorder in recorders:
+			recorder.flush()
+	finally:
+		if (archive is not None):
+			archive.close()
+	manifest = {'case': name, 'capture': capture, 'decoder': spec, 'chunkLines': CHUNK_LINES}
+	for recorder in recorders:
+		manifest[recorder.countKey] = recorder.count
+	for recorder in recorders:
+		manifest[recorder.chunksKey] = recorder.chunks
+	writeManifest(manifestPath, manifest)
+	return manifest
+
+
+def writeManifest(path, manifest):
+	# One chunk per line, so a changed chunk is a one line diff
+	chunkKeys = [x[2] for x in STREAMS.values()]
+	header = dict((key, value) for key, value in manifest.items() if key not in chunkKeys)
+	with open(path, 'w') as out:
+		out.write(json.dumps(header, indent=1)[:-2])
+		for key in chunkKeys:
+			out.write(',\n "%s": [\n  ' % key)
+			out.write(',\n  '.join(json.dumps(x) for x in manifest[key]))
+			out.write('\n ]')
+		out.write('\n}\n')
+
+
+def check(name, directory, engine='wait'):
+	'''Returns None if the output is the same, otherwise what differs.'''
+	capture, spec = GOLDEN_CASES[name]
+	manifestPath, archivePath = paths(directory, name)
+	with open(manifestPath) as stream:
+		manifest = json.load(stream)
+	if (manifest['chunkLines'] != CHUNK_LINES):
+		raise ValueError(manifestPath + ' was recorded with a different chunk size')
+	archive = zipfile.ZipFile(archivePath) if os.path.exists(archivePath) else None
+	checkers = [Checker(manifest, archive, x) for x in STREAMS]
+	try:
+		decode.runSession(os.path.join(TEST_DATA, capture), manifest['decoder'], checkers, engine=engine)
+		for checker in checkers:
+			checker.finish()
+	except Divergence:
+		pass
+	finally:
+		if (archive is not None):
+			archive.close()
+	problems = [x.problem for x in checkers if x.problem is not None]
+	return problems[0] if problems else None
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Record or check golden decoder outputs of the Test data captures')
+	parser.add_argument('action', choices=('record', 'check'))
+	parser.add_argument('cases', nargs='*', help='cases (default: all): ' + ', '.join(GOLDEN_CASES))
+	parser.add_argument('--engine', choices=('wait', 'numpy'), default='wait')
+	parser.add_argument('--dir', default=DEFAULT_DIRECTORY, help='where the golden files are')
+	parser.add_argument('--text', action='store_true', help='record: also save the annotations themselves (.zip), for exact diffs')
+	args = parser.parse_args(argv)
+	for name in args.cases:
+		if (name not in GOLDEN_CASES):
+			parser.error('Unknown case: ' + name)
+
+	failed = 0
+	for name in (args.cases or GOLDEN_CASES):
+		if (args.action == 'record'):
+			os.makedirs(args.dir, exist_ok=True)
+			manifest = record(name, args.dir, args.text, args.engine)
+			sys.stderr.write('%s: %d annotations, %d records, %d chunks\n' % (name, manifest['count'], manifest['recordCount'],
+				len(manifest['chunks']) + len(manifest['recordChunks'])))
+		else:
+			problem = check(name, args.dir, args.engine)
+			if (problem is None):
+				sys.stderr.write('%s: same\n' % name)
+			else:
+				sys.stderr.write('%s: DIFFERENT\n%s\n' % (name, problem))
+				failed += 1
+	return 1 if failed else 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,194 @@
+'''
+Flash image, rebuilt from the programming executive (PE) traffic
+
+Listens to the decoders' OUTPUT_PYTHON records (see pic32_common/records.py).
+Once the PE is started (0xDEAD0000 sent over FASTDATA), the FASTDATA words are
+PE commands, and the ones that write flash (ROW_PROGRAM, PROGRAM, WORD_PROGRAM...)
+go into a sparse image, 4 KiB pages by physical address. Nothing else is kept,
+so the memory used only depends on how much flash was written.
+
+POLL records (polls=collapse) can be passed over: they only fold MCHP_STATUS and
+ETAP_CONTROL polls, the FASTDATA words & MCLR resets still come through as they are.
+
+Only the PE is understood - flash written by hand through ETAP_ADDRESS/ETAP_DATA
+(instructions over PrAcc) would need a CPU emulator, and is not picked up.
+'''
+
+import os
+
+from . import decode, srd	# decode puts the decoders' folder on the path, for pic32_common
+from pic32_common.records import *
+
+PAGE_SIZE = 4096
+DEFAULT_ROW_WORDS = 512		# ROW_PROGRAM row, MZ. MX parts use 128 (or 32 for MX1/2).
+
+PE_START_KEY = 0xDEAD0000	# Sent to the PE loader, jumps into the PE
+
+# PE opcodes (upper 16 bits of the command word)
+PE_ROW_PROGRAM = 0x0
+PE_READ = 0x1
+PE_PROGRAM = 0x2
+PE_WORD_PROGRAM = 0x3
+PE_CHIP_ERASE = 0x4
+PE_PAGE_ERASE = 0x5
+PE_BLANK_CHECK = 0x6
+PE_EXEC_VERSION = 0x7
+PE_GET_CRC = 0x8
+PE_PROGRAM_CLUSTER = 0x9
+PE_GET_DEVICEID = 0xA
+PE_CHANGE_CFG = 0xB
+PE_QUAD_WORD_PROGRAM = 0xD
+PE_DOUBLE_WORD_PROGRAM = 0xE
+
+# Commands that start with an address: opcode -> number of argument words (address first)
+PE_ADDRESS_COMMANDS = {PE_ROW_PROGRAM:1, PE_READ:1, PE_PROGRAM:2, PE_WORD_PROGRAM:1, PE_PAGE_ERASE:1, PE_BLANK_CHECK:2,
+	PE_GET_CRC:2, PE_PROGRAM_CLUSTER:2, PE_QUAD_WORD_PROGRAM:1, PE_DOUBLE_WORD_PROGRAM:1}
+
+
+def physicalAddress(address):
+	# KSEG0/KSEG1 -> physical
+	return address & 0x1FFFFFFF
+
+
+def isFlashAddress(address):
+	# Program flash or boot flash (incl. config words), physical, KSEG0 or KSEG1
+	if ((address >> 29) not in (0, 4, 5)):
+		return False
+	address = physicalAddress(address)
+	return (0x1D000000 <= address < 0x1E000000) or (0x1FC00000 <= address < 0x1FD00000)
+
+
+class FlashImage:
+	'''Sparse memory image, page number -> bytearray (unwritten bytes are 0xFF).'''
+
+	def __init__(self, pageSize=PAGE_SIZE):
+		self.pageSize = pageSize
+		self.pages = {}
+		self.bytesWritten = 0
+
+	def writeWord(self, address, word):
+		address = physicalAddress(address)
+		page = self.pages.get(address // self.pageSize)
+		if (page is None):
+			page = bytearray(b'\xFF' * self.pageSize)
+			self.pages[address // self.pageSize] = page
+		offset = address % self.pageSize
+		page[offset:offset+4] = word.to_bytes(4, 'little')
+		self.bytesWritten += 4
+
+	def regions(self):
+		'''Yield (address, data) for every run of consecutive pages, in address order.'''
+		start = None
+		data = bytearray()
+		for number in sorted(self.pages):
+			if (start is not None and number * self.pageSize != start + len(data)):
+				yield start, bytes(data)
+				start = None
+			if (start is None):
+				start = number * self.pageSize
+				data = bytearray()
+			data += self.pages[number]
+		if (start is not None):
+			yield start, bytes(data)
+
+	def writeHex(self, stream):
+		# Intel HEX, 16 bytes per line, extended linear address records for the upper 16 bits
+		upper = None
+		for start, data in self.regions():
+			for offset in range(0, len(data), 16):
+				address = start + offset
+				if (address >> 16 != upper):
+					upper = address >> 16
+					stream.write(hexRecord(0, 4, upper.to_bytes(2, 'big')))
+				stream.write(hexRecord(address & 0xFFFF, 0, data[offset:offset+16]))
+		stream.write(hexRecord(0, 1, b''))
+
+	def writeBinaries(self, prefix):
+		# One file per region, prefix-<address>.bin. Returns the names.
+		names = []
+		for start, data in self.regions():
+			name = '%s-%08x.bin' % (prefix, start)
+			with open(name, 'wb') as out:
+				out.write(data)
+			names.append(name)
+		return names
+
+
+def hexRecord(address, recordType, data):
+	record = bytes((len(data), address >> 8, address & 0xFF, recordType)) + data
+	return ':' + record.hex().upper() + '%02X\n' % ((-sum(record)) & 0xFF)
+
+
+class ImageBuilder:
+	'''Listener for DecodeRun - follows the PE commands, and writes the flash data into an image.
+
+	A command word is only taken as one, if the word after it is a flash address.
+	Reads of PE responses (and anything else) are skipped that way.
+	'''
+
+	def __init__(self, rowWords=DEFAULT_ROW_WORDS, image=None):
+		self.rowWords = rowWords	# For ROW_PROGRAM with no row size in the operand
+		self.image = image if image is not None else FlashImage()
+		self.running = False	# PE started
+		self.command = None		# Command word, waiting for its arguments
+		self.arguments = []
+		self.address = 0		# Where the next data word goes
+		self.dataWords = 0		# Data words still to come
+
+	def __call__(self, outputType, startsample, endsample, data):
+		if (outputType != srd.OUTPUT_PYTHON):
+			return
+		if (data[0] == REC_FASTDATA):
+			self.onWord(data[1])
+		elif (data[0] == REC_RESET and data[1] == 'MCLR'):
+			self.running = False	# Chip reset, the PE is gone
+			self.command = None
+			self.dataWords = 0
+
+	def onWord(self, word):
+		if (self.dataWords):
+			self.image.writeWord(self.address, word)
+			self.address += 4
+			self.dataWords -= 1
+			return
+		if (self.command is None):
+			if (word == PE_START_KEY):
+				self.running = True
+			elif (self.running and (word >> 16) in PE_ADDRESS_COMMANDS):
+				self.command = word
+				self.arguments = []
+			return
+
+		opcode = self.command >> 16
+		if (not self.arguments and not isFlashAddress(word)):
+			# Not a command after all, maybe this one is
+			self.command = None
+			self.onWord(word)
+			return
+		self.arguments.append(word)
+		if (len(self.arguments) < PE_ADDRESS_COMMANDS[opcode]):
+			return
+
+		self.address = self.arguments[0]
+		if (opcode == PE_ROW_PROGRAM):
+			self.dataWords = (self.command & 0xFFFF) or self.rowWords
+		elif (opcode in (PE_PROGRAM, PE_PROGRAM_CLUSTER)):
+			self.dataWords = self.arguments[1] // 4
+		elif (opcode == PE_WORD_PROGRAM):
+			self.dataWords = 1
+		elif (opcode == PE_DOUBLE_WORD_PROGRAM):
+			self.dataWords = 2
+		elif (opcode == PE_QUAD_WORD_PROGRAM):
+			self.dataWords = 4
+		self.command = None
+
+
+def saveImage(image, path):
+	# .hex -> Intel HEX, anything else -> raw binary, one file per region
+	base, extension = os.path.splitext(path)
+	if (extension.lower() == '.hex'):
+		with open(path, 'w') as stream:
+			image.writeHex(stream)
+		return [path]
+	return image.writeBinaries(base)
+
@@ -0,0 +1,77 @@
+'''
+Live decode - raw samples from a pipe, decoded as they come in
+
+For watching a programmer while it works, instead of a finished session file:
+
+sigrok-cli -d fx2lafw --config samplerate=16MHz --continuous -O binary | \
+	python3 -m pic32_tools.decode - -P pic32_icsp:reset=1:clock=2:data=3 --samplerate 16MHz
+
+"-" is stdin, a FIFO works too. The samples are read BLOCK_SIZE bytes at a time
+(unitsize bytes per sample, little endian, as -O binary writes them), and every
+block goes through the decoder before the next one is read. The decoders and
+engines only ever hold one block, and keep their state across blocks, so the
+memory used stays the same however long it runs. Whatever the decoder put()
+from a block is flushed out before waiting for the next one - a transaction
+shows up at most one block after it ended (BLOCK_SIZE / samplerate, 16 ms at
+16 MHz with the default).
+
+With no metadata in the stream, probes are named after the capture bits: "0",
+"1"... and "D0", "D1"... (the test captures' probe "1" is bit 1 too, so the
+same -P works for both). "#N" works as well.
+'''
+
+import sys
+
+from . import decode
+from .session import Session, parseSamplerate
+
+BLOCK_SIZE = 256*1024	# Bytes per read
+
+
+class RawSource:
+	'''Raw samples from a stream, for DecodeRun. Looks enough like a Session for channelBits().'''
+
+	probeBit = Session.probeBit
+
+	def __init__(self, stream, unitsize=1, samplerate=0, blockSize=BLOCK_SIZE, name='stdin'):
+		self.stream = stream
+		self.unitsize = unitsize
+		self.samplerate = samplerate
+		self.blockSize = blockSize - (blockSize % unitsize)
+		self.path = name
+		self.probes = {}
+		for bit in range(unitsize * 8):
+			self.probes[str(bit)] = bit
+			self.probes['D' + str(bit)] = bit
+		self.beforeRead = []	# Called before every (blocking) read - flush the output here
+		self.numSamples = 0		# Read so far
+
+	def blocks(self):
+		leftover = b''
+		while True:
+			for function in self.beforeRead:
+				function()
+			data = self.stream.read(self.blockSize)		# Returns short only at the end of the stream
+			if (not data):
+				return
+			if (leftover):
+				data = leftover + data
+			cut = len(data) - (len(data) % self.unitsize)
+			leftover = data[cut:]
+			if (cut):
+				self.numSamples += cut // self.unitsize
+				yield data[:cut]
+
+
+def runStream(source, spec, listeners, engine='wait'):
+	'''Decodes everything coming from source (a RawSource), until the stream ends.'''
+	decoderId, decoderClass, channels, options = decode.parseDecoderSpec(spec)
+	run = decode.DecodeRun(decoderClass, source.blocks(), source.unitsize, decode.channelBits(decoderClass, source, channels),
+		source.samplerate, options, listeners)
+	return run.run(engine)
+
+
+def openStream(name, unitsize=1, samplerate=None, blockSize=BLOCK_SIZE):
+	# "-" is stdin, anything else is opened (a FIFO, or a raw file)
+	stream = sys.stdin.buffer if name == '-' else open(name, 'rb')
+	return RawSource(stream, unitsize, parseSamplerate(samplerate) if samplerate else 0, blockSize, name)
@@ -0,0 +1,122 @@
+'''
+Memory-mapped session reader - logic chunks straight from the file, no copies
+
+Chunks stored uncompressed in the zip (method "store") are mapped at their
+offset in the file, and blocks() hands out memoryviews into the mapping
+instead of reading them. Only the pages being looked at are resident, so the
+memory used stays flat whatever the capture size, and a 10 MiB chunk is never
+buffered twice.
+
+sigrok itself writes the chunks deflated (so are the ones in "Test data"), and
+those can't be mapped - they are streamed, exactly as Session does.
+
+For tools looking at the pins themselves, channelWindows() gives the capture
+a window at a time, with every decoder channel unpacked (one byte per sample,
+0 or 1) only when asked for. Needs numpy for that part.
+'''
+
+import mmap
+import struct
+import zipfile
+
+from .session import Session
+
+LOCAL_HEADER = struct.Struct('<4s22xHH')	# Signature ... file name length, extra field length
+LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+
+DEFAULT_WINDOW_SAMPLES = 1024*1024
+
+
+class MappedSession(Session):
+	'''Session, with the stored chunks read through mmap. Blocks of those are memoryviews.'''
+
+	def __init__(self, path, blockSize=None):
+		if (blockSize is None):
+			Session.__init__(self, path)
+		else:
+			Session.__init__(self, path, blockSize)
+		self.file = open(path, 'rb')
+		self.map = None
+		self.offsets = {}		# Chunk name -> offset of its data in the file, stored chunks only
+		for name in self.chunkNames:
+			info = self.zip.getinfo(name)
+			if (info.compress_type == zipfile.ZIP_STORED and info.file_size):
+				self.offsets[name] = self.dataOffset(info)
+		if (self.offsets):
+			self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+	def dataOffset(self, info):
+		# The central directory only knows where the local header is, the data comes after it
+		self.file.seek(info.header_offset)
+		signature, nameLength, extraLength = LOCAL_HEADER.unpack(self.file.read(LOCAL_HEADER.size))
+		if (signature != LOCAL_HEADER_SIGNATURE):
+			raise ValueError('Bad local header for ' + info.filename + ' in ' + self.path)
+		return info.header_offset + LOCAL_HEADER.size + nameLength + extraLength
+
+	def close(self):
+		if (self.map is not None):
+			try:
+				self.map.close()
+			except BufferError:
+				pass	# Someone still holds a view, the mapping goes when they let go
+			self.map = None
+		self.file.close()
+		Session.close(self)
+
+	def isMapped(self, name):
+		return name in self.offsets
+
+	def readChunk(self, name, skip, blockSize):
+		if (name not in self.offsets):
+			yield from Session.readChunk(self, name, skip, blockSize)
+			return
+		start = self.offsets[name]
+		view = memoryview(self.map)[start:start + self.zip.getinfo(name).file_size]
+		for position in range(skip, len(view), blockSize):
+			yield view[position:position + blockSize]
+
+	def channelWindows(self, decoderClass, channels=None, windowSamples=DEFAULT_WINDOW_SAMPLES, maxSamples=None, startSample=0):
+		'''Yield a ChannelWindow per windowSamples samples, for the decoder's channels (mapped like -P does).'''
+		from .decode import channelBits
+		bits = channelBits(decoderClass, self, channels or {})
+		names = [x['id'] for x in decoderClass.channels]
+		blockSize = self.blockSize
+		self.blockSize = windowSamples * self.unitsize
+		try:
+			start = startSample
+			for data in self.blocks(maxSamples, startSample):
+				window = ChannelWindow(start, data, self.unitsize, dict(zip(names, bits)))
+				start += len(window)
+				yield window
+		finally:
+			self.blockSize = blockSize
+
+
+class ChannelWindow:
+	'''Samples [start, start + len) of a capture. window['tck'] -> uint8 array of that channel, unpacked on first use.'''
+
+	def __init__(self, start, data, unitsize, bits):
+		self.start = start
+		self.data = data		# Raw samples, memoryview into the mapping if the chunk is stored
+		self.unitsize = unitsize
+		self.bits = bits		# Channel id -> bit of the capture
+		self.unpacked = {}
+
+	def __len__(self):
+		return len(self.data) // self.unitsize
+
+	def __getitem__(self, name):
+		values = self.unpacked.get(name)
+		if (values is None):
+			values = self.unpacked[name] = unpackBit(self.data, self.unitsize, self.bits[name])
+		return values
+
+	def channels(self):
+		return list(self.bits)
+
+
+def unpackBit(data, unitsize, bit):
+	# One bit of every sample -> uint8 array of 0/1. Only the byte lane holding the bit is touched.
+	import numpy as np
+	lane = np.frombuffer(data, dtype=np.uint8)[bit // 8::unitsize]
+	return (lane >> (bit % 8)) & 1
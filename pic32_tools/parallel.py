@@ -0,0 +1,203 @@
+'''
+Parallel decode - cuts a capture where the decoder starts over, decodes the pieces in a process pool
+
+The cut points are where the decoders get back into a known state:
+- pic32_icsp: MCLR falling edges (onResetAsserted, ICSP has to be entered again)
+- pic32_jtag: the TCK falling edge after 5 clocks with TMS high (Test-Logic-Reset)
+
+Not everything the decoders remember is reset at those points though (pic32_icsp
+keeps its JTAG state across MCLR, pic32_jtag keeps the selected TAP across
+Test-Logic-Reset, annotations can start before the cut). So every segment is
+decoded by a new decoder starting LEAD_IN_CUTS cuts earlier (the lead-in), and only keeps
+what it put() from its own cut on - the decoders always put() with endsample
+being the current sample, so that's exactly what a plain run would put() there.
+The outputs are then handed to the listeners in order, as from one run. A worker
+doesn't keep its outputs: every BATCH_OUTPUTS of them are pickled to a temporary
+file, which the main process reads back a batch at a time, once it gets to that
+segment. Memory stays at a few batches per process, whatever the capture size.
+
+coalesce=yes and polls=collapse are refused: a coalesced state or a poll run
+that spans a cut is put() by both segments' decoders, differently. So is
+profile=yes: every segment would put() its own profile at its end, counted from
+the start of its lead-in, and the time spent can't be split up at the cut. The
+decoders' warnings (OUTPUT_META 'warning') are said once per decode - a segment
+whose lead-in doesn't reach back to where it was said says it again, so a
+warning already passed on is dropped.
+
+That's the same as a plain run as long as the decoder's state has caught up by
+the end of the lead-in; if something is remembered longer than that (a TAP
+selected many resets ago), output right after a cut can still differ. Check a
+capture against the golden harness, if in doubt. Needs numpy, for finding the cuts.
+'''
+
+import multiprocessing
+import os
+import pickle
+import sys
+import tempfile
+
+import numpy as np
+
+from . import decode, srd
+from .edges import ChangeStream, pinEdges
+from .session import Session
+
+SEGMENTS_PER_JOB = 4	# More segments than processes, so a long one doesn't hold up the rest
+TLR_CLOCKS = 5			# TMS high for this many clocks -> Test-Logic-Reset, from any state
+LEAD_IN_CUTS = 2		# A segment's decoder starts this many cuts early
+BATCH_OUTPUTS = 64*1024	# Outputs pickled at once, by a worker
+UNSUPPORTED_OPTIONS = ('coalesce', 'polls', 'profile')	# Their output can span a cut, or covers the whole segment
+
+
+def icspCuts(changes, resetPin):
+	# Samples where MCLR falls
+	cuts = []
+	level = None
+	for samples, values in changes:
+		if (level is None):
+			level = (changes.initial >> resetPin) & 1
+		edges, levels = pinEdges(samples, values, resetPin, level)
+		if (len(edges)):
+			level = int(levels[-1])
+			cuts.extend(samples[edges[levels == 0]].tolist())
+	return cuts
+
+
+def jtagCuts(changes, clockPin, tmsPin):
+	# Samples of the TCK falling edge, after the TLR_CLOCKS-th rising edge in a row with TMS high
+	cuts = []
+	clock = None
+	run = 0			# TMS high rising edges in a row, so far
+	waiting = False	# Cut goes on the next falling edge
+	for samples, values in changes:
+		if (clock is None):
+			clock = (changes.initial >> clockPin) & 1
+		edges, levels = pinEdges(samples, values, clockPin, clock)
+		if (len(edges) == 0):
+			continue
+		clock = int(levels[-1])
+		rising = edges[levels == 1]
+		falling = edges[levels == 0]
+
+		# Length of the TMS-high run at each rising edge, continued from the last block
+		tms = (values[rising] >> tmsPin) & 1
+		index = np.arange(len(tms))
+		lastLow = np.maximum.accumulate(np.where(tms == 0, index, -1))
+		runs = np.where(lastLow < 0, index + 1 + run, index - lastLow)
+		if (len(runs)):
+			run = int(runs[-1])
+
+		if (waiting and len(falling) and (len(rising) == 0 or falling[0] < rising[0])):
+			cuts.append(int(samples[falling[0]]))
+		waiting = False
+		for position in rising[runs == TLR_CLOCKS].tolist():
+			after = np.searchsorted(falling, position)
+			if (after < len(falling)):
+				cuts.append(int(samples[falling[after]]))
+			else:
+				waiting = True
+	return cuts
+
+
+def findCuts(decoderClass, path, bits, maxSamples=None, cache=None):
+	module = sys.modules[decoderClass.__module__]	# pd.py, for the PIN_* numbers
+	with Session(path) as session:
+		changes = decode.changeSource(path, session, bits, maxSamples, cache=cache)
+		if (changes is None):
+			changes = ChangeStream(session.blocks(maxSamples), session.unitsize, bits)
+		if (decoderClass.id == 'pic32_icsp'):
+			cuts = icspCuts(changes, module.PIN_RESET)
+		elif (decoderClass.id == 'pic32_jtag'):
+			cuts = jtagCuts(changes, module.PIN_CLOCK, module.PIN_TMS)
+		else:
+			raise ValueError('No cut points known for ' + decoderClass.id)
+		return cuts, changes.numSamples
+
+
+def chooseSegments(cuts, numSamples, count):
+	'''Picks up to count segments [(lead-in start, start, end)], at the cuts closest after the even split points.'''
+	segments = [(0, 0)]		# (lead-in start, start)
+	shortest = numSamples // (count * 2)	# Not worth a process
+	for index in range(1, count):
+		target = numSamples * index // count
+		position = np.searchsorted(cuts, max(target, segments[-1][1] + shortest))
+		if (position < len(cuts) and cuts[position] < numSamples - shortest):
+			leadIn = cuts[position - LEAD_IN_CUTS] if position >= LEAD_IN_CUTS else 0
+			segments.append((int(leadIn), int(cuts[position])))
+	ends = [x[1] for x in segments[1:]] + [numSamples]
+	return [(leadIn, start, end) for (leadIn, start), end in zip(segments, ends)]
+
+
+def decodeSegment(arguments):
+	# In a worker process. Writes the outputs from start on in batches, sample numbers already moved to the
+	# capture's, to a temporary file, and returns its name (readBatches() reads & removes it).
+	path, spec, leadIn, start, end, engine, mapped, cache = arguments
+	decoderId, decoderClass, channels, options = decode.parseDecoderSpec(spec)
+	handle, name = tempfile.mkstemp(prefix='pic32_tools-', suffix='.pickle')
+	try:
+		with os.fdopen(handle, 'wb') as stream:
+			outputs = []
+			def collect(outputType, startsample, endsample, data):
+				if (endsample + leadIn >= start):
+					outputs.append((outputType, startsample + leadIn, endsample + leadIn, data))
+					if (len(outputs) >= BATCH_OUTPUTS):
+						pickle.dump(outputs, stream, pickle.HIGHEST_PROTOCOL)
+						del outputs[:]
+			with decode.openSession(path, mapped) as session:
+				blocks = session.blocks(end - leadIn, leadIn)
+				bits = decode.channelBits(decoderClass, session, channels)
+				run = decode.DecodeRun(decoderClass, blocks, session.unitsize, bits, session.samplerate, options, [collect],
+					decode.changeSource(path, session, bits, end - leadIn, leadIn, cache))
+				run.run(engine)
+			if (outputs):
+				pickle.dump(outputs, stream, pickle.HIGHEST_PROTOCOL)
+	except:
+		os.remove(name)
+		raise
+	return name
+
+
+def readBatches(name):
+	# The batches decodeSegment() wrote, one at a time. The file is gone after.
+	try:
+		with open(name, 'rb') as stream:
+			while True:
+				try:
+					yield pickle.load(stream)
+				except EOFError:
+					return
+	finally:
+		os.remove(name)
+
+
+def runParallel(path, spec, listeners, jobs=None, maxSamples=None, engine='wait', mapped=False, cache=None):
+	'''Same as decode.runSession(), but split up over jobs processes (default: all cores).'''
+	decoderId, decoderClass, channels, options = decode.parseDecoderSpec(spec)
+	changed = decode.changedOptions(decoderClass, options, UNSUPPORTED_OPTIONS)
+	if (changed):
+		raise ValueError('Can\'t decode in parallel with ' + ', '.join(changed) + ', output can span a cut')
+	jobs = jobs or multiprocessing.cpu_count()
+	with Session(path) as session:
+		bits = decode.channelBits(decoderClass, session, channels)
+	cuts, numSamples = findCuts(decoderClass, path, bits, maxSamples, cache)
+	segments = chooseSegments(cuts, numSamples, jobs * SEGMENTS_PER_JOB)
+	work = [(path, spec, leadIn, start, end, engine, mapped, cache) for leadIn, start, end in segments]
+	names = []
+	warnings = set()	# Already passed on
+	try:
+		with multiprocessing.Pool(min(jobs, len(work))) as pool:
+			for name in pool.imap(decodeSegment, work):	# In order
+				names.append(name)
+				for outputs in readBatches(name):
+					for output in outputs:
+						if (output[0] == srd.OUTPUT_META and output[3][0] == 'warning'):
+							if (output[3] in warnings):
+								continue
+							warnings.add(output[3])
+						for listener in listeners:
+							listener(*output)
+	finally:
+		for name in names:
+			if (os.path.exists(name)):
+				os.remove(name)
+	return len(segments)
@@ -0,0 +1,260 @@
+'''
+EJTAG processor accesses (PrAcc) - what the core asked for, and how long the probe took
+
+While the core runs from dmseg (the PE loader, instructions fed by XferInstruction),
+every fetch, load & store it does is a processor access: the core sets PrAcc in
+ETAP_CONTROL, with PRnW telling if it's a write, and waits. The probe polls
+ETAP_CONTROL until it sees PrAcc, can read the address from ETAP_ADDRESS, gives
+(read) or takes (write) the word in ETAP_DATA, and writes ETAP_CONTROL with PrAcc
+cleared, which lets the core go on.
+
+Follows the OUTPUT_PYTHON records of a decode and puts each access back together:
+(seen, done, address, write, data, polls). The latency is from the start of the
+first ETAP_CONTROL read that shows PrAcc (the chip asserted it some time before
+that, after the last read without it) to the end of the write that clears it -
+how long the probe kept the core stalled. polls is how many ETAP_CONTROL reads
+came back without PrAcc first, the probe being early.
+
+A probe only goes on to ETAP_ADDRESS/ETAP_DATA once it has seen PrAcc. If it
+does that without a read showing it (parts of the ICSP test captures: the TDO
+comes out one bit off, so PrAcc & PRnW are not where they should be), the last ETAP_CONTROL
+read is taken as the one that saw it, and the access is counted as 'unknown'
+instead of read/write.
+
+FASTDATA (the PE's data, XferFastData) has its own PrAcc bit in the transfer; a
+word that came back without it didn't go through. Those are counted, and the time
+between FASTDATA words is histogrammed next to the latency.
+
+Histograms have power of 2 buckets, in microseconds. The decoder needs polls=show
+(the default), each ETAP_CONTROL read is needed with its own start sample & TDO.
+2-phase ICSP (phases=2) has no TDO, so PrAcc is never seen, and is refused too.
+
+python3 -m pic32_tools.pracc
+python3 -m pic32_tools.pracc --session capture.sr -P pic32_jtag:reset=1:tck=2:tms=3:tdi=4:tdo=5
+'''
+
+import argparse
+import json
+import os
+import sys
+
+from . import decode, srd
+from .bench import CASES, TEST_DATA
+from pic32_common.records import *
+
+ETAP_ADDRESS = 0x08
+ETAP_DATA = 0x09
+ETAP_CONTROL = 0x0A
+
+# EJTAG Control register
+CONTROL_PRACC = 1 << 18		# Core waiting on a processor access, written 0 by the probe when done
+CONTROL_PRNW = 1 << 19		# The access is a write (core -> probe)
+
+KINDS = ('read', 'write', 'unknown')
+# polls=collapse leaves the ETAP_CONTROL reads out, only the last one is in its POLL record. phases=2 has no TDO at all.
+UNSUPPORTED_OPTIONS = ('polls', 'phases')
+FIRST_BUCKET = 1.0			# us, upper edge of the first bucket
+
+
+class PraccTracer:
+	'''Listener for DecodeRun. report() after the decode.'''
+
+	def __init__(self, samplerate):
+		self.samplerate = samplerate
+		self.cycles = []		# (seen, done, address, kind, data, polls)
+		self.pending = None		# (seen, kind) of the access being served
+		self.control = None		# Start of the last ETAP_CONTROL read without PrAcc
+		self.polls = 0			# ETAP_CONTROL reads without PrAcc, since the last access
+		self.address = None		# Last read from ETAP_ADDRESS
+		self.data = None		# Last ETAP_DATA transfer, (tdi, tdo)
+		self.fastdata = 0
+		self.fastdataMissed = 0	# Words that came back without PrAcc
+		self.lastWord = None
+		self.wordGaps = []		# Samples from the end of a FASTDATA word to the end of the next
+
+	def __call__(self, outputType, startsample, endsample, data):
+		if (outputType != srd.OUTPUT_PYTHON):
+			return
+		kind = data[0]
+		if (kind == REC_DATA):
+			if (data[1] == ETAP_CONTROL):
+				self.onControl(startsample, endsample, data[2], data[3])
+			elif (data[1] in (ETAP_ADDRESS, ETAP_DATA)):
+				self.onTransfer(data[1], data[2], data[3])
+		elif (kind == REC_FASTDATA):
+			self.onFastdata(endsample, data[3])
+		elif (kind in (REC_RESET, REC_ENTER)):
+			self.pending = None	# The core is starting over, whatever it waited on is gone
+			self.control = None
+			self.polls = 0
+			self.lastWord = None
+
+	def onControl(self, startsample, endsample, tdi, tdo):
+		if (self.pending is None):
+			if (tdo & CONTROL_PRACC):
+				self.openAccess(startsample, 'write' if tdo & CONTROL_PRNW else 'read')
+			else:
+				self.control = startsample
+				self.polls += 1
+		if (self.pending is not None and not tdi & CONTROL_PRACC):
+			seen, kind = self.pending
+			value = None
+			if (self.data is not None):
+				value = self.data[1] if kind == 'write' else self.data[0]
+			self.cycles.append((seen, endsample, self.address, kind, value, self.polls))
+			self.pending = None
+			self.control = None
+			self.polls = 0
+
+	def onTransfer(self, register, tdi, tdo):
+		if (self.pending is None):
+			if (self.control is None):
+				return		# Not serving an access
+			self.openAccess(self.control, 'unknown')
+			self.polls -= 1
+		if (register == ETAP_ADDRESS):
+			self.address = tdo
+		else:
+			self.data = (tdi, tdo)
+
+	def openAccess(self, seen, kind):
+		self.pending = (seen, kind)
+		self.address = None
+		self.data = None
+
+	def onFastdata(self, endsample, praccPIC):
+		self.fastdata += 1
+		if (not praccPIC):
+			self.fastdataMissed += 1
+			return
+		if (self.lastWord is not None):
+			self.wordGaps.append(endsample - self.lastWord)
+		self.lastWord = endsample
+
+	def microseconds(self, samples):
+		return samples * 1e6 / self.samplerate if self.samplerate else None
+
+	def histogram(self, samples):
+		'''[(upper edge in us, count)], power of 2 buckets from the first one used. Empty without a samplerate.'''
+		if (not self.samplerate or not samples):
+			return []
+		counts = {}
+		for x in samples:
+			edge = FIRST_BUCKET
+			value = self.microseconds(x)
+			while (value >= edge):
+				edge *= 2
+			counts[edge] = counts.get(edge, 0) + 1
+		edge = min(counts)
+		result = []
+		while (edge <= max(counts)):
+			result.append((edge, counts.get(edge, 0)))
+			edge *= 2
+		return result
+
+	def summary(self, samples):
+		result = {'count': len(samples)}
+		if (samples and self.samplerate):
+			ordered = sorted(samples)
+			result['minUs'] = self.microseconds(ordered[0])
+			result['medianUs'] = self.microseconds(ordered[len(ordered) // 2])
+			result['maxUs'] = self.microseconds(ordered[-1])
+			result['totalUs'] = self.microseconds(sum(ordered))
+		result['histogram'] = self.histogram(samples)
+		return result
+
+	def report(self):
+		'''Everything, as a dict. Times in microseconds (left out without a samplerate).'''
+		result = {'samplerate': self.samplerate, 'accesses': len(self.cycles)}
+		result['latency'] = self.summary([x[1] - x[0] for x in self.cycles])
+		for kind in KINDS:
+			result[kind + 'Latency'] = self.summary([x[1] - x[0] for x in self.cycles if x[3] == kind])
+		result['earlyPolls'] = sum(x[5] for x in self.cycles)
+		result['withAddress'] = sum(1 for x in self.cycles if x[2] is not None)
+		result['fastdataWords'] = self.fastdata
+		result['fastdataMissed'] = self.fastdataMissed
+		result['fastdataGap'] = self.summary(self.wordGaps)
+		return result
+
+
+def formatHistogram(name, summary, stream):
+	if (not summary['histogram']):
+		stream.write('  %-19s %d\n' % (name, summary['count']))
+		return
+	stream.write('  %-19s %d, median %.2f us, max %.2f us, %.3f ms in all\n' % (name, summary['count'], summary['medianUs'],
+		summary['maxUs'], summary['totalUs'] / 1000))
+	most = max(x[1] for x in summary['histogram'])
+	for edge, count in summary['histogram']:
+		stream.write('    < %8g us %7d %s\n' % (edge, count, '#' * ((count * 40 + most - 1) // most)))
+
+
+def formatReport(name, result, stream=sys.stderr):
+	stream.write('%s\n' % name)
+	stream.write('  PrAcc accesses      %d (%d with an address read), %d ETAP_CONTROL polls before PrAcc was up\n' % (result['accesses'],
+		result['withAddress'], result['earlyPolls']))
+	formatHistogram('latency', result['latency'], stream)
+	for kind in KINDS:
+		if (result[kind + 'Latency']['count']):
+			formatHistogram(kind + ' latency', result[kind + 'Latency'], stream)
+	stream.write('  FASTDATA            %d words, %d without PrAcc\n' % (result['fastdataWords'], result['fastdataMissed']))
+	formatHistogram('FASTDATA gaps', result['fastdataGap'], stream)
+
+
+def formatCycles(tracer, stream=sys.stdout):
+	for seen, done, address, kind, data, polls in tracer.cycles:
+		stream.write('%d-%d %s %s %s latency %s, %d polls\n' % (seen, done, kind,
+			'-' if address is None else '0x%08X' % address, '-' if data is None else '0x%08X' % data,
+			'%.2f us' % tracer.microseconds(done - seen) if tracer.samplerate else str(done - seen) + ' samples', polls))
+
+
+def trace(path, spec, engine='wait', maxSamples=None):
+	decoderId, decoderClass, channels, options = decode.parseDecoderSpec(spec)
+	changed = decode.changedOptions(decoderClass, options, UNSUPPORTED_OPTIONS)
+	if (changed):
+		raise ValueError('The accesses can\'t be traced with ' + ', '.join(changed))
+	with decode.Session(path) as session:
+		samplerate = session.samplerate
+	tracer = PraccTracer(samplerate)
+	decode.runSession(path, spec, [tracer], maxSamples, engine=engine)
+	return tracer
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='EJTAG processor accesses & their latency, from a capture')
+	parser.add_argument('cases', nargs='*', help='test captures (default: all): ' + ', '.join(CASES))
+	parser.add_argument('--session', help='trace this session instead, needs -P')
+	parser.add_argument('-P', '--decoder', help='decoder:channel=probe..., as with sigrok-cli')
+	parser.add_argument('--engine', choices=('wait', 'numpy'), default='wait')
+	parser.add_argument('--samples', type=int, help='only decode this many samples')
+	parser.add_argument('--cycles', action='store_true', help='list every access (stdout)')
+	parser.add_argument('--json', action='store_true', help='print the results as JSON (stdout)')
+	args = parser.parse_args(argv)
+
+	if (args.session):
+		if (not args.decoder):
+			parser.error('--session needs -P')
+		runs = [(os.path.basename(args.session), args.session, args.decoder)]
+	else:
+		for name in args.cases:
+			if (name not in CASES):
+				parser.error('Unknown case: ' + name)
+		runs = [(x, os.path.join(TEST_DATA, CASES[x][0]), CASES[x][1]) for x in (args.cases or CASES)]
+
+	results = {}
+	for name, path, spec in runs:
+		try:
+			tracer = trace(path, spec, args.engine, args.samples)
+		except ValueError as error:
+			parser.error(str(error))
+		results[name] = tracer.report()
+		formatReport(name, results[name])
+		if (args.cycles):
+			sys.stdout.write('%s\n' % name)
+			formatCycles(tracer)
+	if (args.json):
+		sys.stdout.write(json.dumps(results, indent=1) + '\n')
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
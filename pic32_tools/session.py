@@ -0,0 +1,117 @@
+'''
+Streaming reader for sigrok session files (.sr)
+
+A session is a zip with a "metadata" ini file, and the samples split into
+"logic-1-1", "logic-1-2", ... chunks. The chunks are read one block at a time,
+in order, so the memory used does not depend on the capture size.
+'''
+
+import configparser
+import re
+import zipfile
+
+DEFAULT_BLOCK_SIZE = 1024*1024	# Bytes read from the zip at once
+
+SAMPLERATE_UNITS = {'hz':1, 'khz':1000, 'mhz':1000*1000, 'ghz':1000*1000*1000}
+
+
+def parseSamplerate(text):
+	# "16 MHz", "500 kHz", "1000" -> integer Hz
+	match = re.match(r'\s*([0-9.]+)\s*([a-zA-Z]*)\s*$', text)
+	if (match is None):
+		raise ValueError('Bad samplerate: ' + text)
+	unit = match.group(2).lower() or 'hz'
+	if (unit not in SAMPLERATE_UNITS):
+		raise ValueError('Bad samplerate unit: ' + text)
+	return int(float(match.group(1)) * SAMPLERATE_UNITS[unit])
+
+
+class Session:
+	'''One sigrok session file, opened for streaming.'''
+
+	def __init__(self, path, blockSize=DEFAULT_BLOCK_SIZE):
+		self.path = path
+		self.zip = zipfile.ZipFile(path)
+		self.blockSize = blockSize
+
+		metadata = configparser.ConfigParser(interpolation=None)
+		metadata.read_string(self.zip.read('metadata').decode('utf-8'))
+		device = metadata['device 1']
+		self.samplerate = parseSamplerate(device.get('samplerate', '0'))
+		self.unitsize = int(device.get('unitsize', '1'))
+		self.captureFile = device.get('capturefile', 'logic-1')
+
+		# probeN=name -> name:bit. Probes are numbered from 1, bits from 0.
+		self.probes = {}
+		for key, value in device.items():
+			if (key.startswith('probe') and key[5:].isdigit()):
+				self.probes[value] = int(key[5:]) - 1
+
+		# Chunks are logic-1-1 ... logic-1-N, sort them numerically, not by name.
+		# Old sessions can have a single file, named just like capturefile.
+		names = self.zip.namelist()
+		prefix = self.captureFile + '-'
+		chunks = [x for x in names if x.startswith(prefix) and x[len(prefix):].isdigit()]
+		self.chunkNames = sorted(chunks, key=lambda x: int(x[len(prefix):]))
+		if (not self.chunkNames and self.captureFile in names):
+			self.chunkNames = [self.captureFile]
+
+	def close(self):
+		self.zip.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def numSamples(self):
+		total = sum(self.zip.getinfo(x).file_size for x in self.chunkNames)
+		return total // self.unitsize
+
+	def probeBit(self, probe):
+		# Probe can be given by name ("1", "D3"...), or directly by bit number ("#2")
+		if (probe in self.probes):
+			return self.probes[probe]
+		if (probe.startswith('#') and probe[1:].isdigit()):
+			return int(probe[1:])
+		raise KeyError('No probe named ' + probe + ' in ' + self.path)
+
+	def blocks(self, maxSamples=None, startSample=0):
+		'''Yield raw sample data, in order, always a whole number of samples.
+
+		With startSample, the first samples are skipped (whole chunks without reading them).
+		'''
+		leftover = b''
+		blockSize = self.blockSize - (self.blockSize % self.unitsize)
+		remaining = None if maxSamples is None else maxSamples * self.unitsize
+		skip = startSample * self.unitsize
+		for name in self.chunkNames:
+			size = self.zip.getinfo(name).file_size
+			if (skip >= size):
+				skip -= size
+				continue
+			for data in self.readChunk(name, skip, blockSize):
+				if (leftover):
+					data = bytes(leftover) + data	# Can be a memoryview (MappedSession)
+				cut = len(data) - (len(data) % self.unitsize)
+				leftover = data[cut:]
+				if (remaining is not None):
+					cut = min(cut, remaining)
+					remaining -= cut
+				if (cut):
+					yield data[:cut]
+				if (remaining == 0):
+					return
+			skip = 0
+
+	def readChunk(self, name, skip, blockSize):
+		# Raw data of one chunk from byte skip on, blockSize at a time
+		with self.zip.open(name) as chunk:
+			while (skip):
+				skip -= len(chunk.read(min(skip, blockSize)))
+			while True:
+				data = chunk.read(blockSize)
+				if (not data):
+					break
+				yield data
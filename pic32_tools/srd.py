@@ -0,0 +1,208 @@
+'''
+Stand-in for the sigrokdecode module, for running decoders without libsigrokdecode
+
+Implements the parts of the API v3 the decoders use: Decoder.wait(), put(),
+register(), has_channel(), the OUTPUT_* types and SRD_CONF_SAMPLERATE.
+decode.py puts it into sys.modules as "sigrokdecode", before the decoders are imported.
+
+wait() doesn't look at every sample. The samples are reduced to one byte per
+sample (bit N = decoder channel N), and it jumps from one pin change to the next
+with a regex, since a condition can only become true where some pin changed.
+'''
+
+import re
+
+OUTPUT_ANN, OUTPUT_PYTHON, OUTPUT_BINARY, OUTPUT_LOGIC, OUTPUT_META = range(5)
+SRD_CONF_SAMPLERATE = 10000
+
+# Matches the last sample of a run of equal samples.
+RUN_END = re.compile(b'(.)(?!\\1)', re.DOTALL)
+
+
+def compileCondition(cond):
+	# {pin: 'r', ...} -> masks, so one condition is checked with a few int ops
+	level = levelValue = rise = fall = edge = stable = 0
+	skip = None
+	for key, value in cond.items():
+		if (key == 'skip'):
+			skip = value
+			continue
+		bit = 1 << key
+		if (value == 'l'):
+			level |= bit
+		elif (value == 'h'):
+			level |= bit
+			levelValue |= bit
+		elif (value == 'r'):
+			rise |= bit
+		elif (value == 'f'):
+			fall |= bit
+		elif (value == 'e'):
+			edge |= bit
+		elif (value == 's'):
+			stable |= bit
+		else:
+			raise ValueError('Unknown condition: ' + str(value))
+	return (level, levelValue, rise, fall, edge | rise | fall, stable, skip)
+
+
+class PinFeed:
+	'''Sample source for wait(). Keeps only one block of samples around.'''
+
+	def __init__(self, blocks, unitsize, channelBits):
+		# channelBits[N] = bit of the capture, that holds decoder channel N
+		if (len(channelBits) > 8):
+			raise ValueError('At most 8 decoder channels are supported')
+		self.blocks = iter(blocks)
+		self.unitsize = unitsize
+		self.numChannels = len(channelBits)
+		self.pinTuples = [tuple((v >> c) & 1 for c in range(self.numChannels)) for v in range(256)]
+
+		# One translate table per byte of a sample (little endian), only for bytes we need
+		self.lanes = []
+		for lane in range(unitsize):
+			table = bytearray(256)
+			used = False
+			for channel, bit in enumerate(channelBits):
+				if (bit // 8 == lane):
+					used = True
+					for value in range(256):
+						if ((value >> (bit % 8)) & 1):
+							table[value] |= 1 << channel
+			if (used):
+				self.lanes.append((lane, bytes(table)))
+
+		self.buffer = b''
+		self.base = 0			# Sample number of buffer[0]
+		self.previous = None	# Value of the sample before buffer[0]
+		self.nextPos = 0		# Where the next wait() starts looking
+		self.conditionCache = {}
+
+	def pack(self, data):
+		if (not isinstance(data, bytes)):
+			data = bytes(data)	# memoryview from a MappedSession, translate() needs bytes
+		if (self.unitsize == 1):
+			return data.translate(self.lanes[0][1])
+		if (len(self.lanes) == 1):
+			lane, table = self.lanes[0]
+			return data[lane::self.unitsize].translate(table)
+		# Channels spread over several bytes - OR the lanes together, as big ints.
+		count = len(data) // self.unitsize
+		value = 0
+		for lane, table in self.lanes:
+			value |= int.from_bytes(data[lane::self.unitsize].translate(table), 'little')
+		return value.to_bytes(count, 'little')
+
+	def load(self):
+		# Move to the next block. False if there is none.
+		for data in self.blocks:
+			packed = self.pack(data)
+			if (not packed):
+				continue
+			if (self.buffer):
+				self.previous = self.buffer[-1]
+			self.base += len(self.buffer)
+			self.buffer = packed
+			return True
+		return False
+
+	def compile(self, conds):
+		key = tuple(tuple(sorted(x.items())) for x in conds)
+		compiled = self.conditionCache.get(key)
+		if (compiled is None):
+			compiled = [compileCondition(x) for x in conds]
+			self.conditionCache[key] = compiled
+		return compiled
+
+	def nextChange(self, pos):
+		# First sample after pos, with a different value. None at end of data.
+		if (pos < self.base):
+			if (self.buffer[0] != self.previous):
+				return self.base
+			pos = self.base
+		while True:
+			offset = pos - self.base
+			end = RUN_END.search(self.buffer, offset).start() + 1
+			if (end < len(self.buffer)):
+				return self.base + end
+			value = self.buffer[-1]
+			if (not self.load()):
+				return None
+			if (self.buffer[0] != value):
+				return self.base
+			pos = self.base
+
+	def wait(self, decoder, conds):
+		if (not conds):
+			conds = [{'skip': 1}]
+		elif (isinstance(conds, dict)):
+			conds = [conds]
+		compiled = self.compile(conds)
+		pos = self.nextPos
+		skipTarget = None
+		for cond in compiled:
+			if (cond[6] is not None):
+				target = pos - 1 + cond[6]
+				if (skipTarget is None or target < skipTarget):
+					skipTarget = target
+				if (target < pos):
+					raise ValueError('skip must be at least 1')
+
+		while True:
+			while (pos >= self.base + len(self.buffer)):
+				if (not self.load()):
+					raise EOFError()
+			offset = pos - self.base
+			if (offset > 0):
+				cur = self.buffer[offset]
+				prev = self.buffer[offset - 1]
+			elif (offset == 0):
+				cur = self.buffer[0]
+				prev = cur if self.previous is None else self.previous	# First sample has no edges
+			else:
+				# Skip ended inside a run, that nextChange() already read past
+				cur = prev = self.previous
+			changed = prev ^ cur
+
+			matched = []
+			for level, levelValue, rise, fall, edge, stable, skip in compiled:
+				matched.append((skip is None or pos - self.nextPos + 1 == skip)
+					and (cur & level) == levelValue
+					and (changed & edge) == edge
+					and (cur & rise) == rise
+					and (cur & fall) == 0
+					and (changed & stable) == 0)
+			if (True in matched):
+				decoder.samplenum = pos
+				decoder.matched = tuple(matched)
+				self.nextPos = pos + 1
+				return self.pinTuples[cur]
+
+			# Nothing can change until the pins do, or the skip runs out
+			nextPos = self.nextChange(pos)
+			if (skipTarget is not None and skipTarget > pos and (nextPos is None or skipTarget < nextPos)):
+				nextPos = skipTarget
+			if (nextPos is None):
+				raise EOFError()
+			pos = nextPos
+
+
+class Decoder:
+	'''Base class for decoders, the runner (decode.py) fills in the details.'''
+
+	api_version = 3
+	options = ()
+	annotations = ()
+	annotation_rows = ()
+
+	def register(self, output_type, proto_id=None, meta=None):
+		return self._srd.register(self, output_type, meta)
+
+	def put(self, startsample, endsample, output_id, data):
+		self._srd.put(self, startsample, endsample, output_id, data)
+
+	def wait(self, conds=None):
+		return self._srd.feed.wait(self, conds)
+
+	def has_channel(self, index):
+		return index < len(self._srd.bits)
@@ -0,0 +1,193 @@
+'''
+Synthetic pin streams for the tests
+
+TAP operations (reset, IR/DR shifts, idle clocks) written out as samples, one
+byte per sample with decoder channel N on bit N:
+
+- JTAG: SYSRST, TMS, TCK, TDI, TDO. TCK low then high, everything set up before
+  the rising edge.
+- ICSP: MCLR, PGEC, PGED. The entry key, then 4-phase bits (TDI, TMS,
+  turnaround, TDO), or 2-phase ones (TDI, TMS).
+
+run() decodes such a stream with DecodeRun, without a session file.
+writeSession() saves one as a sigrok session, probes named '1', '2'... like the
+captures in Test data, for the tools that want a file.
+'''
+
+import os
+import sys
+import zipfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pic32_tools import decode, srd
+
+SAMPLERATE = 1000000
+BITS = {'pic32_jtag': [0, 1, 2, 3, 4], 'pic32_icsp': [0, 1, 2]}
+SPECS = {'pic32_jtag': 'pic32_jtag:reset=1:tms=2:tck=3:tdi=4:tdo=5', 'pic32_icsp': 'pic32_icsp:reset=1:clock=2:data=3'}	# For writeSession() files
+
+MTAP_COMMAND = 0x07
+MTAP_SW_MTAP = 0x04
+MTAP_SW_ETAP = 0x05
+ETAP_ADDRESS = 0x08
+ETAP_DATA = 0x09
+ETAP_CONTROL = 0x0A
+ETAP_FASTDATA = 0x0E
+MCHP_STATUS = 0x00
+ENTRY_KEY = 0x4D434850
+
+CONTROL_PRACC = 1 << 18
+CONTROL_PRNW = 1 << 19
+
+
+class TapWriter:
+	'''TAP level operations, bit() is up to the wire format. All shifts start and end in Run-Test-Idle.'''
+
+	def __init__(self):
+		self.samples = bytearray()
+
+	def bit(self, tms, tdi=0, tdo=0):
+		raise NotImplementedError
+
+	def resetTap(self):
+		# Test-Logic-Reset, then Run-Test-Idle
+		for x in range(5):
+			self.bit(1)
+		self.bit(0)
+
+	def idle(self, count):
+		for x in range(count):
+			self.bit(0)
+
+	def shift(self, header, tdi, tdo, bits):
+		for tms in header:
+			self.bit(tms)
+		for x in range(bits):
+			self.bit(1 if x == bits - 1 else 0, (tdi >> x) & 1, (tdo >> x) & 1)
+		self.bit(1)		# Update
+		self.bit(0)		# Run-Test-Idle
+
+	def ir(self, instruction, tdo=0):
+		self.shift((1, 1, 0, 0), instruction, tdo, 5)
+
+	def dr(self, tdi, bits, tdo=0):
+		self.shift((1, 0, 0), tdi, tdo, bits)
+
+	def xferData(self, register, tdi, tdo=0, bits=32):
+		self.ir(register)
+		self.dr(tdi, bits, tdo)
+
+	def xferFastData(self, tdi, tdo=0, praccPIC=1, praccProbe=0):
+		self.dr((tdi << 1) | praccProbe, 33, (tdo << 1) | praccPIC)
+
+	def xferInstruction(self, instruction, waits=0, write=False):
+		# EJTAG processor access, as in the programming spec: poll until PrAcc, data, clear PrAcc
+		status = CONTROL_PRACC | (CONTROL_PRNW if write else 0)
+		self.ir(ETAP_CONTROL)
+		for x in range(waits):
+			self.dr(0x0004C000, 32, 0)
+		self.dr(0x0004C000, 32, status)
+		self.xferData(ETAP_DATA, instruction)
+		self.xferData(ETAP_CONTROL, 0x0000C000, status)
+
+	def data(self):
+		return bytes(self.samples)
+
+
+class JtagWriter(TapWriter):
+
+	def __init__(self, half=2):
+		TapWriter.__init__(self)
+		self.half = half	# Samples per clock phase
+
+	def bit(self, tms, tdi=0, tdo=0):
+		low = 0x01 | (tms << 1) | (tdi << 3) | (tdo << 4)
+		self.samples += bytes((low,)) * self.half + bytes((low | 0x04,)) * self.half
+
+
+class IcspWriter(TapWriter):
+
+	def __init__(self, phases=4):
+		TapWriter.__init__(self)
+		self.phases = phases
+		self.samples += bytes((0x01,)) * 5
+
+	def put(self, mclr, clock, data, count=1):
+		self.samples += bytes((mclr | (clock << 1) | (data << 2),)) * count
+
+	def enter(self, key=ENTRY_KEY):
+		# MCLR low, the key MSB first, MCLR high
+		self.put(0, 0, 0, 5)
+		for x in range(32):
+			value = (key >> (31 - x)) & 1
+			self.put(0, 0, value)
+			self.put(0, 1, value)
+		self.put(0, 0, 0)
+		self.put(1, 0, 0, 4)
+
+	def bit(self, tms, tdi=0, tdo=0):
+		for value in ((tdi, tms) if self.phases == 2 else (tdi, tms, 0, tdo)):
+			self.put(1, 1, value)
+			self.put(1, 0, value)
+
+	def release(self):
+		# MCLR low at the end, so the last transfer is done
+		self.put(0, 0, 0, 3)
+
+
+def run(decoderId, samples, options=None, engine='wait', samplerate=SAMPLERATE, blockSize=4096, listeners=()):
+	'''Decodes samples, returns [(output type, start, end, data)] of everything put.'''
+	outputs = []
+	def listener(outputType, startsample, endsample, data):
+		outputs.append((outputType, startsample, endsample, data))
+	blocks = [samples[x:x+blockSize] for x in range(0, len(samples), blockSize)]
+	decoderClass = decode.loadDecoder(decoderId)
+	decode.DecodeRun(decoderClass, blocks, 1, BITS[decoderId], samplerate, options, [listener] + list(listeners)).run(engine)
+	return outputs
+
+
+def writeSession(path, samples, samplerate=SAMPLERATE, chunkSize=64*1024, probes=8, compression=zipfile.ZIP_DEFLATED):
+	# compression: ZIP_STORED for chunks mapped.py can map, sigrok deflates them
+	metadata = '[global]\nsigrok version=0.5.2\n\n[device 1]\ncapturefile=logic-1\ntotal probes=%d\nsamplerate=%d Hz\n' % (probes, samplerate)
+	metadata += ''.join('probe%d=%d\n' % (x, x) for x in range(1, probes + 1)) + 'unitsize=1\n'
+	with zipfile.ZipFile(path, 'w', compression) as session:
+		session.writestr('version', '2')
+		session.writestr('metadata', metadata)
+		for index, start in enumerate(range(0, len(samples), chunkSize)):
+			session.writestr('logic-1-%d' % (index + 1), samples[start:start+chunkSize])
+
+
+def records(outputs):
+	return [x[3] for x in outputs if x[0] == srd.OUTPUT_PYTHON]
+
+
+def statusPolls(writer, count, tap=True):
+	'''MCHP_STATUS polled count times, busy until the last one. tap: switch to the MTAP first.'''
+	if (tap):
+		writer.ir(MTAP_SW_MTAP)
+		writer.ir(MTAP_COMMAND)
+	for x in range(count):
+		writer.dr(MCHP_STATUS, 8, 0x80 if x == count - 1 else 0x88)
+
+
+def programmingRun(writer, polls=4):
+	'''A bit of everything: status polls, a few PrAcc accesses with early polls, FASTDATA words.'''
+	writer.resetTap()
+	statusPolls(writer, polls)
+	writer.ir(MTAP_SW_ETAP)
+	for x in range(3):
+		writer.xferInstruction(0x3C040000 + x, waits=polls, write=(x == 2))
+	writer.ir(ETAP_FASTDATA)
+	for x in range(5):
+		writer.xferFastData(0xA0000000 + x, x)
+	writer.idle(3)
+	return writer
+
+
+def icspProgrammingRun(phases=4, polls=4):
+	writer = IcspWriter(phases)
+	writer.enter()
+	programmingRun(writer, polls)
+	writer.release()
+	return writer
@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import synthetic
+import numpy as np
+from pic32_tools import cache
+
+
+class CacheKeyTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.capture = os.path.join(self.directory, 'capture.sr')
+		with open(self.capture, 'wb') as stream:
+			stream.write(b'capture' * 100)
+		self.bits = [0, 1, 2]
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def save(self):
+		path = cache.indexPath(self.directory, cache.captureKey(self.capture), self.bits)
+		cache.ChangeIndex(np.array([3, 7], np.int64), np.array([1, 0], np.uint8), 0, 10, cache.captureHash(self.capture)).save(path)
+		return path
+
+	def test_key_follows_metadata(self):
+		key = cache.captureKey(self.capture)
+		self.assertEqual(cache.captureKey(self.capture), key)
+		info = os.stat(self.capture)
+		os.utime(self.capture, ns=(info.st_atime_ns, info.st_mtime_ns + 1000))
+		self.assertNotEqual(cache.captureKey(self.capture), key)
+
+	def test_load(self):
+		path = self.save()
+		index = cache.ChangeIndex.load(path)
+		self.assertEqual(list(index.samples), [3, 7])
+		self.assertEqual(index.digest, cache.captureHash(self.capture))
+		changes = index.stream(5, 2)
+		self.assertEqual((list(changes.samples), changes.initial, changes.numSamples), ([1], 0, 5))
+
+	def test_verify(self):
+		path = self.save()
+		self.assertTrue(cache.verifyIndex(self.capture, self.bits, self.directory))
+		# Same size & mtime, other contents: found by the key, caught by the hash
+		info = os.stat(self.capture)
+		with open(self.capture, 'r+b') as stream:
+			stream.write(b'CAPTURE')
+		os.utime(self.capture, ns=(info.st_atime_ns, info.st_mtime_ns))
+		self.assertTrue(os.path.exists(path))
+		self.assertFalse(cache.verifyIndex(self.capture, self.bits, self.directory))
+		self.assertFalse(os.path.exists(path))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import synthetic
+from pic32_tools import checkpoint
+
+
+class ResumeTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def check(self, decoderId, writer):
+		path = os.path.join(self.directory, decoderId + '.sr')
+		checkpoints = os.path.join(self.directory, decoderId + '.ckpt')
+		synthetic.writeSession(path, writer.data(), chunkSize=1024)
+		spec = synthetic.SPECS[decoderId]
+		full = []
+		taken = checkpoint.recordSession(path, spec, checkpoints, [lambda *x: full.append(x)], interval=2000)
+		self.assertGreater(taken, 3)
+		total = len(writer.data())
+		for startSample in (0, 1500, total // 2, total - 100):
+			resumed = []
+			found = checkpoint.resumeSession(path, spec, checkpoints, [lambda *x: resumed.append(x)], startSample)
+			if (startSample > 2000):
+				self.assertIsNotNone(found)
+				self.assertLess(found.sample, startSample)
+			self.assertEqual(resumed, [x for x in full if x[2] >= startSample])
+		# Up to maxSamples only
+		resumed = []
+		checkpoint.resumeSession(path, spec, checkpoints, [lambda *x: resumed.append(x)], total // 2, 3000)
+		self.assertEqual(resumed, [x for x in full if total // 2 <= x[2] < total // 2 + 3000])
+
+	def test_jtag(self):
+		writer = synthetic.JtagWriter()
+		for x in range(3):
+			synthetic.programmingRun(writer)
+		self.check('pic32_jtag', writer)
+
+	def test_icsp(self):
+		writer = synthetic.IcspWriter()
+		writer.enter()
+		for x in range(3):
+			synthetic.programmingRun(writer)
+		writer.release()
+		self.check('pic32_icsp', writer)
+
+
+if __name__ == '__main__':
+	unittest.main()
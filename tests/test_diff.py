@@ -0,0 +1,52 @@
+import sys
+import unittest
+
+import synthetic
+from pic32_tools import diff
+
+
+def side(name, options, withTdo, interner, polls=4):
+	recorder = diff.TransactionRecorder(interner, withTdo)
+	synthetic.run('pic32_jtag', synthetic.programmingRun(synthetic.JtagWriter(), polls).data(), options, listeners=[recorder])
+	return diff.Side(name, None, None, recorder, synthetic.SAMPLERATE, sys.modules['pic32_jtag.pd'])
+
+
+class DiffTest(unittest.TestCase):
+
+	def test_against_itself(self):
+		for withTdo in (False, True):
+			interner = diff.Interner()
+			sideA = side('a', {}, withTdo, interner)
+			sideB = side('b', {}, withTdo, interner)
+			summary, runs = diff.compare(sideA, sideB)
+			self.assertEqual(runs, [])
+			self.assertEqual(summary['equalRecords'], len(sideA.recorder))
+
+	def test_extra_polls(self):
+		# b polls twice as long, the extra polls are what it costs
+		interner = diff.Interner()
+		sideA = side('a', {}, False, interner, 2)
+		sideB = side('b', {}, False, interner, 4)
+		summary, runs = diff.compare(sideA, sideB)
+		self.assertTrue(runs)
+		self.assertEqual(summary['recordsB'] - summary['recordsA'], 2 + 3 * 2)
+		self.assertEqual(sum(x['extraClocks'] for x in runs), sideB.recorder.clocks - sideA.recorder.clocks)
+
+
+class OptionsTest(unittest.TestCase):
+
+	def test_clocks(self):
+		# One state annotation per TCK, but the last, that's put on the falling edge after it
+		interner = diff.Interner()
+		sideA = side('a', {}, False, interner)
+		self.assertEqual(sideA.recorder.clocks, len(synthetic.programmingRun(synthetic.JtagWriter()).data()) // 4 - 1)
+
+	def test_options_refused(self):
+		# All of these lose state annotations, the clocks would be off
+		for option in ('coalesce=yes', 'verbosity=transactions', 'polls=collapse'):
+			with self.assertRaises(ValueError):
+				diff.decodeSide('a', 'not opened', synthetic.SPECS['pic32_jtag'] + ':' + option, diff.Interner(), False, 'wait')
+
+
+if __name__ == '__main__':
+	unittest.main()
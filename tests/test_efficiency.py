@@ -0,0 +1,30 @@
+import unittest
+
+import synthetic
+from pic32_tools import decode, efficiency
+
+
+class WireClockTest(unittest.TestCase):
+
+	def test_clocks_per_bit(self):
+		for spec, expected in (('pic32_jtag:reset=1', 1), ('pic32_icsp:reset=1', 4), ('pic32_icsp:reset=1:phases=4', 4),
+				('pic32_icsp:reset=1:phases=2', 2)):
+			decoderId, decoderClass, channels, options = decode.parseDecoderSpec(spec)
+			self.assertEqual(efficiency.wireClocksPerBit(decoderId, options), expected)
+
+	def test_two_phase_rates(self):
+		writer = synthetic.icspProgrammingRun(phases=2)
+		analyzer = efficiency.EfficiencyAnalyzer(synthetic.SAMPLERATE, efficiency.wireClocksPerBit('pic32_icsp', {'phases': '2'}))
+		synthetic.run('pic32_icsp', writer.data(), {'phases': '2'}, listeners=[analyzer])
+		result = analyzer.report()
+		self.assertAlmostEqual(result['wireBurstClockRate'], result['burstClockRate'] * 2)
+		self.assertAlmostEqual(result['wireBurstClockRate'], synthetic.SAMPLERATE / 2)		# 2 samples per PGEC clock
+
+	def test_options_refused(self):
+		for option in ('coalesce=yes', 'verbosity=transactions', 'verbosity=transactions+bits', 'polls=collapse'):
+			with self.assertRaises(ValueError):
+				efficiency.analyze('not opened', 'pic32_jtag:reset=1:' + option)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+
+import synthetic
+from pic32_tools import engines
+
+
+def frame(header, bits, footer=(1, 1, 0)):
+	return bytes(header) + bytes(bits - 1) + bytes(footer)
+
+
+class MatchFrameTest(unittest.TestCase):
+
+	def test_templates(self):
+		ir = frame((1, 1, 0, 0), 5)
+		self.assertEqual(engines.matchFrame(ir, 0), (4, 8))
+		dr = bytes(2) + frame((1, 0, 0), 33)
+		self.assertEqual(engines.matchFrame(dr, 2), (5, 37))
+		self.assertIsNone(engines.matchFrame(dr, 0))
+
+	def test_fallback(self):
+		# None of these are templates, they go bit by bit
+		self.assertIsNone(engines.matchFrame(frame((1, 0, 0), 1), 0))			# Nothing before the footer
+		self.assertIsNone(engines.matchFrame(bytes((1, 0, 0, 0, 0, 1, 0, 1, 0, 0, 1, 1, 0)), 0))	# Exit1, Pause-DR mid shift
+		self.assertIsNone(engines.matchFrame(bytes((1, 0, 0, 0, 0, 1, 1, 1)), 0))	# Update, then Select-DR
+		self.assertIsNone(engines.matchFrame(bytes((1, 0, 0, 0, 0, 1)), 0))	# Cut off in the footer
+		self.assertIsNone(engines.matchFrame(bytes((1, 1, 1, 1, 1, 0)), 0))	# SetMode, to Test-Logic-Reset
+		self.assertIsNone(engines.matchFrame(bytes((0, 1, 0, 0)), 0))
+
+
+class FallbackDecodeTest(unittest.TestCase):
+
+	def test_mixed_stream(self):
+		# Templates and frames that aren't, with the numpy engine the same as decode()
+		writer = synthetic.IcspWriter()
+		writer.enter()
+		writer.resetTap()
+		writer.ir(synthetic.MTAP_SW_ETAP)
+		writer.xferData(synthetic.ETAP_CONTROL, 0x0004C000, synthetic.CONTROL_PRACC)
+		for tms, tdi in ((1, 0), (0, 0), (0, 0), (0, 1), (0, 0), (1, 1), (0, 0), (0, 0), (1, 0), (0, 1), (0, 1), (1, 0), (1, 0), (0, 0)):
+			writer.bit(tms, tdi)	# Shift-DR, Pause-DR and back in the middle
+		writer.dr(1, 1)
+		writer.bit(1)
+		writer.bit(1)
+		writer.bit(1)
+		writer.resetTap()
+		writer.ir(synthetic.ETAP_FASTDATA)
+		writer.xferFastData(0x12345678, 0x9ABCDEF0)
+		writer.idle(2)
+		writer.release()
+		for blockSize in (4096, 97):
+			wait = synthetic.run('pic32_icsp', writer.data(), blockSize=blockSize)
+			self.assertTrue(synthetic.records(wait))
+			self.assertEqual(synthetic.run('pic32_icsp', writer.data(), engine='numpy', blockSize=blockSize), wait)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+
+import synthetic
+from pic32_tools import srd
+
+
+class FailedEntryTest(unittest.TestCase):
+
+	def entries(self, outputs):
+		records = [(x[1], x[2], x[3]) for x in outputs if x[0] == srd.OUTPUT_PYTHON and x[3][0] in ('ENTER', 'ENTER_FAILED')]
+		annotations = [(x[1], x[2], x[3][1][0]) for x in outputs if x[0] == srd.OUTPUT_ANN and x[3][0] == 1]
+		return records, annotations
+
+	def test_wrong_key(self):
+		writer = synthetic.IcspWriter()
+		start = len(writer.samples)
+		writer.enter(0x12345678)
+		end = len(writer.samples) - 4		# MCLR goes up 4 samples before enter() is done
+		writer.bit(1)						# Clocks after a failed entry, MCLR still high
+		writer.put(0, 0, 0, 5)				# MCLR pulse without clocks, only a reset
+		writer.put(1, 0, 0, 5)
+		writer.put(0, 0, 0, 5)
+		for x in range(40):					# 40 clocks, key in the last 32
+			writer.put(0, 0, (synthetic.ENTRY_KEY >> (39 - x)) & 1 if x >= 8 else 1)
+			writer.put(0, 1, (synthetic.ENTRY_KEY >> (39 - x)) & 1 if x >= 8 else 1)
+		writer.put(1, 0, 0, 5)
+		writer.put(0, 0, 0, 5)
+		writer.enter()
+		synthetic.programmingRun(writer, 1)
+		writer.release()
+		expected = None
+		for engine, blockSize in (('wait', 4096), ('numpy', 4096), ('numpy', 50)):
+			outputs = synthetic.run('pic32_icsp', writer.data(), engine=engine, blockSize=blockSize)
+			records, annotations = self.entries(outputs)
+			self.assertEqual([x[2] for x in records], [['ENTER_FAILED', 0x12345678, 32], ['ENTER_FAILED', synthetic.ENTRY_KEY, 40], ['ENTER']])
+			self.assertEqual(records[0][:2], (start, end))
+			self.assertEqual([x[2] for x in annotations], ['ICSP ENTER FAILED: 0x12345678, 32 clocks',
+				'ICSP ENTER FAILED: 0x4d434850, 40 clocks', 'ICSP ENTER'])
+			self.assertEqual([x[:2] for x in annotations], [x[:2] for x in records])
+			if (expected is None):
+				expected = outputs
+			self.assertEqual(outputs, expected)
+
+
+if __name__ == '__main__':
+	unittest.main()
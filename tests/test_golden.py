@@ -0,0 +1,57 @@
+import unittest
+
+import synthetic
+from pic32_tools import golden, srd
+
+
+class GoldenStreamTest(unittest.TestCase):
+
+	def manifest(self, outputs):
+		recorders = [golden.Recorder(None, x) for x in golden.STREAMS]
+		for output in outputs:
+			for recorder in recorders:
+				recorder(*output)
+		manifest = {}
+		for recorder in recorders:
+			recorder.flush()
+			manifest[recorder.countKey] = recorder.count
+			manifest[recorder.chunksKey] = recorder.chunks
+		return manifest
+
+	def check(self, manifest, outputs):
+		checkers = [golden.Checker(manifest, None, x) for x in golden.STREAMS]
+		try:
+			for output in outputs:
+				for checker in checkers:
+					checker(*output)
+			for checker in checkers:
+				checker.finish()
+		except golden.Divergence as problem:
+			return str(problem)
+		return None
+
+	def test_records_checked(self):
+		outputs = synthetic.run('pic32_jtag', synthetic.programmingRun(synthetic.JtagWriter()).data())
+		manifest = self.manifest(outputs)
+		self.assertGreater(manifest['recordCount'], 0)
+		self.assertIsNone(self.check(manifest, outputs))
+
+		# Same annotations, one record changed
+		changed = list(outputs)
+		index = [x[0] for x in outputs].index(srd.OUTPUT_PYTHON)
+		outputType, startsample, endsample, data = changed[index]
+		changed[index] = (outputType, startsample, endsample, data[:-1] + [data[-1] + 1])
+		self.assertIn('Records', self.check(manifest, changed))
+
+		# A record missing
+		del changed[index]
+		self.assertIsNotNone(self.check(manifest, changed))
+
+	def test_cases(self):
+		for name, (capture, spec) in golden.GOLDEN_CASES.items():
+			self.assertIn(capture, [x[0] for x in golden.CASES.values()])
+			self.assertTrue(spec.startswith(golden.CASES[name.split('-')[0] + '-' + name.split('-')[1]][1]))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,54 @@
+import io
+import unittest
+
+import synthetic
+from pic32_tools import live
+
+SPECS = {'pic32_jtag': 'pic32_jtag:reset=0:tms=1:tck=2:tdi=3:tdo=4', 'pic32_icsp': 'pic32_icsp:reset=D0:clock=D1:data=D2'}
+
+
+class PipeStream:
+	'''Hands out at most size bytes per read, like a pipe that isn't keeping up.'''
+
+	def __init__(self, data, size):
+		self.stream = io.BytesIO(data)
+		self.size = size
+
+	def read(self, count):
+		return self.stream.read(min(count, self.size))
+
+
+class RawSourceTest(unittest.TestCase):
+
+	def decode(self, decoderId, stream, unitsize, blockSize, engine):
+		outputs = []
+		source = live.RawSource(stream, unitsize, synthetic.SAMPLERATE, blockSize)
+		live.runStream(source, SPECS[decoderId], [lambda *x: outputs.append(x)], engine)
+		return outputs, source.numSamples
+
+	def test_same_as_decode(self):
+		for decoderId, writer in (('pic32_jtag', synthetic.programmingRun(synthetic.JtagWriter())),
+				('pic32_icsp', synthetic.icspProgrammingRun())):
+			samples = writer.data()
+			for engine in ('wait', 'numpy'):
+				expected = synthetic.run(decoderId, samples, engine=engine)
+				self.assertTrue(synthetic.records(expected))
+				outputs, count = self.decode(decoderId, io.BytesIO(samples), 1, 1000, engine)
+				self.assertEqual(outputs, expected)
+				self.assertEqual(count, len(samples))
+				# 2 bytes a sample, the high one noise, read in pieces that split samples
+				wide = b''.join(bytes((x, 0xA5)) for x in samples)
+				outputs, count = self.decode(decoderId, PipeStream(wide, 777), 2, 1001, engine)
+				self.assertEqual(outputs, expected)
+				self.assertEqual(count, len(samples))
+
+	def test_flush_before_read(self):
+		source = live.RawSource(io.BytesIO(bytes(10)), 1, 0, 4)
+		calls = []
+		source.beforeRead.append(lambda: calls.append(source.numSamples))
+		self.assertEqual([len(x) for x in source.blocks()], [4, 4, 2])
+		self.assertEqual(calls, [0, 4, 8, 10])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,62 @@
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+import synthetic
+from pic32_tools import decode
+from pic32_tools.mapped import MappedSession
+
+
+class MappedSessionTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.samples = synthetic.programmingRun(synthetic.JtagWriter()).data()
+		self.paths = {}
+		for compression in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+			path = self.paths[compression] = os.path.join(self.directory, '%d.sr' % compression)
+			synthetic.writeSession(path, self.samples, chunkSize=1000, compression=compression)
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def test_blocks(self):
+		for compression, mapped in ((zipfile.ZIP_STORED, True), (zipfile.ZIP_DEFLATED, False)):
+			with MappedSession(self.paths[compression], 300) as session:
+				self.assertTrue(all(session.isMapped(x) == mapped for x in session.chunkNames))
+				for maxSamples, startSample in ((None, 0), (None, 1234), (2500, 999), (1, 4000)):
+					blocks = list(session.blocks(maxSamples, startSample))
+					end = len(self.samples) if maxSamples is None else startSample + maxSamples
+					self.assertEqual(b''.join(bytes(x) for x in blocks), self.samples[startSample:end])
+					self.assertTrue(all(len(x) <= 300 for x in blocks))
+					self.assertEqual(mapped, all(isinstance(x, memoryview) for x in blocks))
+
+	def test_decode(self):
+		spec = synthetic.SPECS['pic32_jtag']
+		expected = []
+		decode.runSession(self.paths[zipfile.ZIP_DEFLATED], spec, [lambda *x: expected.append(x)])
+		self.assertTrue(synthetic.records(expected))
+		for engine in ('wait', 'numpy'):
+			outputs = []
+			decode.runSession(self.paths[zipfile.ZIP_STORED], spec, [lambda *x: outputs.append(x)], engine=engine, mapped=True)
+			self.assertEqual(outputs, expected)
+
+	def test_channel_windows(self):
+		decoderClass = decode.loadDecoder('pic32_jtag')
+		channels = {'reset': '1', 'tms': '2', 'tck': '3', 'tdi': '4', 'tdo': '5'}
+		with MappedSession(self.paths[zipfile.ZIP_STORED]) as session:
+			windows = list(session.channelWindows(decoderClass, channels, 700, 3000, 500))
+			# Up to windowSamples each, cut at the chunk ends too
+			self.assertTrue(all(0 < len(x) <= 700 for x in windows))
+			self.assertEqual([x.start for x in windows], [500 + sum(len(y) for y in windows[:i]) for i in range(len(windows))])
+			self.assertEqual(sum(len(x) for x in windows), 3000)
+			for bit, name in enumerate(('reset', 'tms', 'tck', 'tdi', 'tdo')):
+				values = b''.join(bytes(x[name]) for x in windows)
+				self.assertEqual(values, bytes((x >> bit) & 1 for x in self.samples[500:3500]))
+			self.assertEqual(sorted(windows[0].channels()), sorted(channels))
+
+
+if __name__ == '__main__':
+	unittest.main()
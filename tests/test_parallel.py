@@ -0,0 +1,130 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import synthetic
+from pic32_tools import decode, parallel, srd
+
+
+class ParallelTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def session(self, decoderId, runs):
+		# runs programming runs, each one starting over (TAP reset / ICSP entry)
+		samples = b''
+		for x in range(runs):
+			if (decoderId == 'pic32_jtag'):
+				samples += synthetic.programmingRun(synthetic.JtagWriter(), polls=1 + x % 3).data()
+			else:
+				samples += synthetic.icspProgrammingRun(polls=1 + x % 3).data()
+		path = os.path.join(self.directory, decoderId + '.sr')
+		synthetic.writeSession(path, samples)
+		return path
+
+	def cuts(self, decoderId, path):
+		decoderClass = decode.loadDecoder(decoderId)
+		spec = synthetic.SPECS[decoderId]
+		with decode.Session(path) as session:
+			bits = decode.channelBits(decoderClass, session, decode.parseDecoderSpec(spec)[2])
+		return parallel.findCuts(decoderClass, path, bits)
+
+	def test_icsp_cuts(self):
+		path = self.session('pic32_icsp', 3)
+		cuts, numSamples = self.cuts('pic32_icsp', path)
+		# MCLR falls for every entry and at the end of every run
+		self.assertEqual(len(cuts), 6)
+		with decode.Session(path) as session:
+			samples = b''.join(session.blocks())
+		self.assertEqual(numSamples, len(samples))
+		for cut in cuts:
+			self.assertEqual(samples[cut] & 1, 0)
+			self.assertEqual(samples[cut - 1] & 1, 1)
+
+	def test_jtag_cuts(self):
+		path = self.session('pic32_jtag', 3)
+		cuts, numSamples = self.cuts('pic32_jtag', path)
+		self.assertEqual(len(cuts), 3)		# One per resetTap()
+		with decode.Session(path) as session:
+			samples = b''.join(session.blocks())
+		for cut in cuts:
+			self.assertEqual(samples[cut] & 0x04, 0)		# TCK falling
+			self.assertEqual(samples[cut - 1] & 0x04, 0x04)
+
+	def test_same_as_one_run(self):
+		for decoderId in ('pic32_icsp', 'pic32_jtag'):
+			path = self.session(decoderId, 12)
+			spec = synthetic.SPECS[decoderId]
+			plain = []
+			decode.runSession(path, spec, [lambda *x: plain.append(x)], engine='numpy')
+			split = []
+			count = parallel.runParallel(path, spec, [lambda *x: split.append(x)], 2, engine='numpy')
+			self.assertGreater(count, 1)
+			self.assertEqual(split, plain)
+
+	def test_small_batches(self):
+		batch = parallel.BATCH_OUTPUTS
+		parallel.BATCH_OUTPUTS = 7
+		try:
+			path = self.session('pic32_jtag', 4)
+			name = parallel.decodeSegment((path, synthetic.SPECS['pic32_jtag'], 0, 0, 10**9, 'numpy', False, None))
+			batches = list(parallel.readBatches(name))
+			self.assertFalse(os.path.exists(name))
+			self.assertTrue(all(len(x) == 7 for x in batches[:-1]))
+			plain = []
+			decode.runSession(path, synthetic.SPECS['pic32_jtag'], [lambda *x: plain.append(x)], engine='numpy')
+			self.assertEqual([x for batch in batches for x in batch], plain)
+		finally:
+			parallel.BATCH_OUTPUTS = batch
+
+	def test_merging_options_refused(self):
+		path = self.session('pic32_jtag', 1)
+		for option in ('coalesce=yes', 'polls=collapse'):
+			with self.assertRaises(ValueError):
+				parallel.runParallel(path, synthetic.SPECS['pic32_jtag'] + ':' + option, [], 2)
+
+	def test_profile_refused(self):
+		# One profile from -j 1; -j N would put a partial, lead-in counted one per segment
+		path = self.session('pic32_jtag', 4)
+		spec = synthetic.SPECS['pic32_jtag'] + ':profile=yes'
+		plain = []
+		decode.runSession(path, spec, [lambda *x: plain.append(x)], engine='numpy')
+		self.assertEqual(len([x for x in plain if x[0] == srd.OUTPUT_META and x[3][0] == 'clocks-ShiftDR']), 1)
+		for jobs in ('2', '4'):
+			errors = io.StringIO()
+			with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(errors):
+				with self.assertRaises(SystemExit):
+					decode.main([path, '-P', spec, '-j', jobs, '--engine', 'numpy'])
+			self.assertIn('profile=yes', errors.getvalue())
+		with self.assertRaises(ValueError):
+			parallel.runParallel(path, spec, [], 1)
+
+	def test_warning_once(self):
+		# 2-phase warns at the first entry. A segment whose lead-in only has a failed entry says it again, that's dropped.
+		writer = synthetic.IcspWriter(2)
+		for key in [synthetic.ENTRY_KEY] + [0x12345678] * 8 + [synthetic.ENTRY_KEY]:
+			writer.put(1, 0, 0, 40)
+			writer.enter(key)
+			synthetic.programmingRun(writer)
+			writer.release()
+		path = os.path.join(self.directory, 'two-phase.sr')
+		synthetic.writeSession(path, writer.data())
+		spec = synthetic.SPECS['pic32_icsp'] + ':phases=2'
+		plain = []
+		decode.runSession(path, spec, [lambda *x: plain.append(x)], engine='numpy')
+		split = []
+		parallel.runParallel(path, spec, [lambda *x: split.append(x)], 2, engine='numpy')
+		warnings = [x for x in plain if x[0] == srd.OUTPUT_META]
+		self.assertEqual(len(warnings), 1)
+		self.assertEqual([x for x in split if x[0] == srd.OUTPUT_META], warnings)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+
+import synthetic
+from pic32_tools import efficiency, pracc
+
+JTAG_SPEC = 'pic32_jtag:reset=1:tck=2:tms=3:tdi=4:tdo=5'
+
+
+class PraccTracerTest(unittest.TestCase):
+
+	def trace(self, writer, decoderId, options=None):
+		tracer = pracc.PraccTracer(synthetic.SAMPLERATE)
+		synthetic.run(decoderId, writer.data(), options, listeners=[tracer])
+		return tracer
+
+	def test_accesses(self):
+		for writer, decoderId in ((synthetic.programmingRun(synthetic.JtagWriter()), 'pic32_jtag'),
+				(synthetic.icspProgrammingRun(), 'pic32_icsp')):
+			tracer = self.trace(writer, decoderId)
+			self.assertEqual([x[3] for x in tracer.cycles], ['read', 'read', 'write'])
+			self.assertEqual([x[4] for x in tracer.cycles], [0x3C040000, 0x3C040001, 0])
+			self.assertEqual([x[5] for x in tracer.cycles], [4, 4, 4])
+			self.assertTrue(all(x[1] > x[0] for x in tracer.cycles))
+			result = tracer.report()
+			self.assertEqual(result['fastdataWords'], 5)
+			self.assertEqual(result['latency']['count'], 3)
+			self.assertEqual(sum(x[1] for x in result['latency']['histogram']), 3)
+
+	def test_collapsed_polls_refused(self):
+		with self.assertRaises(ValueError):
+			pracc.trace('not opened', JTAG_SPEC + ':polls=collapse')
+		with self.assertRaises(ValueError):
+			efficiency.analyze('not opened', JTAG_SPEC + ':polls=collapse')
+
+
+if __name__ == '__main__':
+	unittest.main()
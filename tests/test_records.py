@@ -0,0 +1,33 @@
+import unittest
+
+import synthetic
+
+
+class FastdataRecordTest(unittest.TestCase):
+
+	def writers(self):
+		yield synthetic.JtagWriter(), 'pic32_jtag'
+		writer = synthetic.IcspWriter()
+		writer.enter()
+		yield writer, 'pic32_icsp'
+
+	def test_32_bit_fastdata(self):
+		# PicKit sends XferFastData with 32 clocks, still a FASTDATA transfer, not plain data
+		for writer, decoderId in self.writers():
+			writer.resetTap()
+			writer.ir(synthetic.MTAP_SW_ETAP)
+			writer.ir(synthetic.ETAP_FASTDATA)
+			writer.dr(0x12345679, 32, 0x0000000F)
+			writer.dr((0x0BADF00D << 1) | 1, 33, 1)
+			writer.xferData(synthetic.ETAP_DATA, 0x12345678)
+			writer.idle(2)
+			if (decoderId == 'pic32_icsp'):
+				writer.release()
+			for engine in ('wait', 'numpy'):
+				records = [x for x in synthetic.records(synthetic.run(decoderId, writer.data(), engine=engine)) if x[0] in ('DATA', 'FASTDATA')]
+				self.assertEqual(records, [['FASTDATA', 0x12345679 >> 1, 0x7, 1, 1], ['FASTDATA', 0x0BADF00D, 0, 1, 1],
+					['DATA', synthetic.ETAP_DATA, 0x12345678, 0, 32]])
+
+
+if __name__ == '__main__':
+	unittest.main()
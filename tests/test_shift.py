@@ -0,0 +1,74 @@
+import random
+import unittest
+
+import synthetic
+from pic32_common import shift
+from pic32_tools import srd
+
+
+class WordsTest(unittest.TestCase):
+
+	def test_split_join(self):
+		rng = random.Random(1)
+		for bits in (0, 1, 63, 64, 65, 128, 1000):
+			value = rng.getrandbits(bits) if bits else 0
+			full = bits // shift.WORD_BITS
+			words = shift.splitWords(value, full)
+			self.assertEqual(len(words), full)
+			self.assertTrue(all(0 <= x < 1 << shift.WORD_BITS for x in words))
+			self.assertEqual(shift.joinWords(words, value >> (full * shift.WORD_BITS)), value)
+
+	def test_join_shift(self):
+		rng = random.Random(2)
+		tdi, tdo, tms = rng.getrandbits(200), rng.getrandbits(200), rng.getrandbits(200)
+		words = list(zip(shift.splitWords(tdi, 3), shift.splitWords(tdo, 3), shift.splitWords(tms, 3)))
+		self.assertEqual(shift.joinShift(words, tdi >> 192, tdo >> 192, tms >> 192), (tdi, tdo, tms))
+		# Without TMS, the current word is handed back as it is
+		self.assertEqual(shift.joinShift(words, tdi >> 192, tdo >> 192, 5, False), (tdi, tdo, 5))
+
+	def test_shift_run(self):
+		# Same as bit by bit, from any starting bit
+		class Decoder:
+			pass
+		rng = random.Random(3)
+		for before, count in ((0, 64), (3, 61), (10, 200), (63, 1), (64, 130)):
+			bits = [(rng.getrandbits(1), rng.getrandbits(1), rng.getrandbits(1)) for x in range(before + count)]
+			decoder = Decoder()
+			decoder.clockCycles, decoder.valueTDI, decoder.valueTDO, decoder.valueTMS, decoder.shiftWords = 0, 0, 0, 0, []
+			for tdi, tdo, tms in bits[:before]:
+				shift.shiftRun(decoder, tdi, tdo, tms, 1)
+			run = bits[before:]
+			shift.shiftRun(decoder, sum(x[0] << i for i, x in enumerate(run)), sum(x[1] << i for i, x in enumerate(run)),
+				sum(x[2] << i for i, x in enumerate(run)), count)
+			self.assertEqual(decoder.clockCycles, before + count)
+			self.assertEqual(len(decoder.shiftWords), (before + count) // shift.WORD_BITS)
+			joined = shift.joinShift(decoder.shiftWords, decoder.valueTDI, decoder.valueTDO, decoder.valueTMS)
+			self.assertEqual(joined, tuple(sum(x[k] << i for i, x in enumerate(bits)) for k in range(3)))
+
+
+class LongShiftDecodeTest(unittest.TestCase):
+
+	def test_long_dr(self):
+		rng = random.Random(4)
+		for bits in (63, 64, 65, 200, 1000):
+			tdi, tdo = rng.getrandbits(bits), rng.getrandbits(bits)
+			for decoderId in ('pic32_jtag', 'pic32_icsp'):
+				writer = synthetic.JtagWriter() if decoderId == 'pic32_jtag' else synthetic.IcspWriter()
+				if (decoderId == 'pic32_icsp'):
+					writer.enter()
+				writer.resetTap()
+				writer.dr(tdi, bits, tdo)
+				writer.idle(2)
+				if (decoderId == 'pic32_icsp'):
+					writer.release()
+				for engine in ('wait', 'numpy'):
+					texts = dict((x[3][0], x[3][1][0]) for x in synthetic.run(decoderId, writer.data(), engine=engine)
+						if x[0] == srd.OUTPUT_ANN and x[3][0] in (10, 11))
+					self.assertEqual(texts[10], 'TDI %db %s' % (bits, hex(tdi)))
+					if (decoderId == 'pic32_jtag'):
+						# ICSP reads TDO one bit late (oLSb in Capture), the writer doesn't, so only JTAG's is checked
+						self.assertEqual(texts[11], 'TDO %db %s' % (bits, hex(tdo)))
+
+
+if __name__ == '__main__':
+	unittest.main()
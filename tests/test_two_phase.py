@@ -0,0 +1,47 @@
+import unittest
+
+import synthetic
+from pic32_tools import diff, pracc, srd
+
+ICSP_SPEC = 'pic32_icsp:reset=1:clock=2:data=3'
+
+
+class TwoPhaseTest(unittest.TestCase):
+
+	def decode(self, engine):
+		return synthetic.run('pic32_icsp', synthetic.icspProgrammingRun(phases=2).data(), {'phases': '2'}, engine)
+
+	def test_records(self):
+		expected = synthetic.records(synthetic.run('pic32_icsp', synthetic.icspProgrammingRun().data()))
+		for engine in ('wait', 'numpy'):
+			records = synthetic.records(self.decode(engine))
+			self.assertEqual(len(records), len(expected))
+			for record, full in zip(records, expected):
+				# Same TDI, no TDO
+				self.assertEqual(record[:2], full[:2])
+				if (record[0] == 'DATA'):
+					self.assertEqual(record[2], full[2])
+					self.assertEqual(record[3], 0)
+				elif (record[0] in ('COMMAND_DR', 'FASTDATA')):
+					self.assertEqual(record[2], 0)
+
+	def test_engines_match(self):
+		self.assertEqual(self.decode('wait'), self.decode('numpy'))
+
+	def test_warning(self):
+		for engine in ('wait', 'numpy'):
+			meta = [x[3] for x in self.decode(engine) if x[0] == srd.OUTPUT_META]
+			self.assertEqual(len(meta), 1)
+			self.assertEqual(meta[0][0], 'warning')
+		meta = [x for x in synthetic.run('pic32_icsp', synthetic.icspProgrammingRun().data()) if x[0] == srd.OUTPUT_META]
+		self.assertEqual(meta, [])
+
+	def test_tdo_tools_refuse(self):
+		with self.assertRaises(ValueError):
+			pracc.trace('not opened', ICSP_SPEC + ':phases=2')
+		with self.assertRaises(ValueError):
+			diff.decodeSide('a', 'not opened', ICSP_SPEC + ':phases=2', diff.Interner(), True, 'wait')
+
+
+if __name__ == '__main__':
+	unittest.main()